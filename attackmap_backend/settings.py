@@ -49,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'attacks.middleware.RequestMetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'attackmap_backend.urls'
@@ -123,10 +124,65 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# JSON responses are encoded by orjson when it is installed (same bytes as JSONRenderer)
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'attacks.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Attacks written per insert_many round trip by the bulk ingestion path
+ATTACK_BULK_BATCH_SIZE = 1000
+
+# Response cache for the dashboard endpoints. The data version that invalidates
+# entries is kept in MongoDB, so a per-process locmem cache stays correct behind
+# several processes; a shared backend only saves recomputing the same response:
+#     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#     'LOCATION': BASE_DIR / 'cache',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'attackmap',
+    }
+}
+
+# Seconds a cached response lives; writes invalidate it earlier
+ATTACK_RESPONSE_CACHE_TIMEOUT = 300
+
+# Serve /api/attacks/statistics/ from the minute / hour rollups when the range
+# allows. The bulk API and generate_attacks keep the rollups up to date; attacks
+# written directly with CyberAttack.save(), or before rollups existed, are missing
+# from them until `manage.py rebuild_rollups` runs. Only turn on after that.
+ATTACK_STATISTICS_FROM_ROLLUPS = False
+
+# Flows kept per hour / day summary for /api/attacks/flows/; a flow's count is
+# off by at most (attacks in the bucket) / ATTACK_FLOW_SUMMARY_SIZE
+ATTACK_FLOW_SUMMARY_SIZE = 500
+
+# /api/attacks/flows/ counts ranges up to this many hours from the raw attacks
+ATTACK_FLOW_EXACT_HOURS = 6
+
+# Opt-in: delete notifications by a TTL index this many days after triggered_at
+# (None, the default, keeps them forever). `manage.py sync_indexes` builds / updates /
+# drops the index. A --full re-scan can recreate expired per-attack notifications.
+ATTACK_NOTIFICATION_RETENTION_DAYS = None
+
+# Send per-request DB / serialization timings in a Server-Timing header
+ATTACK_SERVER_TIMING = DEBUG
+
+# Connections per event loop for the async read views (/api/async/...)
+ATTACK_ASYNC_MAX_POOL_SIZE = 50
+
+# MongoDB connection, shared by mongoengine and the async rule engine
+MONGODB = {
+    'db': 'cyberattacks',
+    'host': 'localhost',
+    'port': 27017,
+}
+
 from mongoengine import connect
+from attacks.instrumentation import COMMAND_LISTENER
 
-connect(
-    db='cyberattacks',
-    host='localhost',
-    port=27017
-)
+# The listener feeds the per-request MongoDB metrics
+connect(**MONGODB, event_listeners=[COMMAND_LISTENER])
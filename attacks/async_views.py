@@ -0,0 +1,235 @@
+import asyncio
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import HttpResponse, HttpResponseBase, StreamingHttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from attacks.histogram import DEFAULT_INTERVAL, GROUP_KEYS, fill_buckets, histogram_pipeline, histogram_range, parse_interval
+from attacks.models import AttackRollup, CyberAttack, Notification
+from attacks.mongo import async_client, async_database, shared_database
+from attacks.pagination import count_total_async, parse_page, parse_page_size, seek_filter, split_page
+from attacks.queries import attack_filter, attack_matcher, notification_filter, parse_datetime
+from attacks.renderers import FastJSONRenderer
+from attacks.rollups import (
+    STATISTICS_KEYS, rollup_filter, rollup_granularity, search_pipeline, search_total, statistics_counts,
+    statistics_pipeline,
+)
+from attacks.stream import Subscription, event_stream
+from attacks.transforms import ATTACK_RECORD_PROJECTION, attack_record, notification_record
+
+
+async def facet_counts(collection, pipeline):
+    cursor = await collection.aggregate(pipeline)
+    return statistics_counts(await cursor.next())
+
+
+class AsyncReadView(View):
+    """Async twin of a read-only APIView, on the shared AsyncMongoClient.
+
+    ``get`` returns response data; it is rendered with the same renderer as
+    the DRF views, and API exceptions become the same error responses.
+    Under WSGI, Django runs each request on an event loop of its own that is
+    closed afterwards, so the request gets a client of its own too, closed
+    before the loop goes away.
+    """
+
+    client = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        if isinstance(request, WSGIRequest):
+            self.client = async_client()
+        try:
+            data = await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (list, dict)) else {"detail": exc.detail}
+            return self.render(detail, exc.status_code)
+        finally:
+            if self.client is not None:
+                await self.client.close()
+        if isinstance(data, HttpResponseBase):
+            return data
+        return self.render(data)
+
+    def render(self, data, status_code=status.HTTP_200_OK):
+        renderer = FastJSONRenderer()
+        return HttpResponse(renderer.render(data), content_type=renderer.media_type, status=status_code)
+
+    def collection(self, document):
+        database = async_database(self.client) if self.client is not None else shared_database()
+        return database[document._get_collection_name()]
+
+
+class AsyncAttackListView(AsyncReadView):
+    async def get(self, request):
+        filters = attack_filter(request.GET)
+        attacks = self.collection(CyberAttack)
+
+        if 'cursor' in request.GET:
+            return await self.get_cursor_page(request, attacks, filters)
+
+        page = parse_page(request.GET)
+        page_size = parse_page_size(request.GET)
+        start_index = (page - 1) * page_size
+
+        if request.GET.get('facets') == 'true':
+            pipeline = search_pipeline(filters, start_index, page_size, ATTACK_RECORD_PROJECTION)
+            facets = await (await attacks.aggregate(pipeline)).next()
+            counts = statistics_counts(facets)
+            return {
+                "total": search_total(facets),
+                "page": page,
+                "page_size": page_size,
+                "results": [attack_record(attack) for attack in facets["results"]],
+                "facets": {key: dict(counts[key]) for key in STATISTICS_KEYS},
+            }
+
+        # Count and page fetch go out together
+        count = attacks.count_documents(filters) if filters else attacks.estimated_document_count()
+        fetch = attacks.find(filters, ATTACK_RECORD_PROJECTION).sort("timestamp", -1).skip(start_index).limit(page_size)
+        total, results = await asyncio.gather(count, fetch.to_list())
+
+        return {
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "results": [attack_record(attack) for attack in results]
+        }
+
+    async def get_cursor_page(self, request, attacks, filters):
+        page_size = parse_page_size(request.GET)
+        count = count_total_async(attacks, filters, request.GET.get('include_total', 'estimated'))
+
+        cursor = request.GET.get('cursor')
+        if cursor:
+            filters = {"$and": [filters, seek_filter("timestamp", cursor)]} if filters else seek_filter("timestamp", cursor)
+        fetch = attacks.find(filters, ATTACK_RECORD_PROJECTION).sort([("timestamp", -1), ("_id", -1)]).limit(page_size + 1)
+        (total, exact), results = await asyncio.gather(count, fetch.to_list())
+        results, next_cursor = split_page(results, page_size, "timestamp")
+
+        data = {
+            "page_size": page_size,
+            "next": next_cursor,
+            "results": [attack_record(attack) for attack in results]
+        }
+        if total is not None:
+            data["total"] = total
+            data["total_exact"] = exact
+        return data
+
+
+class AsyncRecentAttackView(AsyncReadView):
+    async def get(self, request):
+        try:
+            limit = int(request.GET.get('limit', 10))
+        except ValueError:
+            raise ValidationError("Limit must be an integer.")
+
+        if limit < 1 or limit > 1000:
+            return self.render({"error": "Limit must be between 1 and 1000"}, status.HTTP_400_BAD_REQUEST)
+
+        attacks = self.collection(CyberAttack).find({}, ATTACK_RECORD_PROJECTION).sort("timestamp", -1).limit(limit)
+        results = [attack_record(attack) for attack in await attacks.to_list()]
+        return {
+            "count": len(results),
+            "results": results
+        }
+
+
+class AsyncAttackStatisticsView(AsyncReadView):
+    async def get(self, request):
+        attacks = self.collection(CyberAttack)
+
+        granularity = rollup_granularity(request.GET)
+        if granularity is None:
+            counts = await facet_counts(attacks, statistics_pipeline(attack_filter(request.GET)))
+        else:
+            rollups = self.collection(AttackRollup)
+            queries = [facet_counts(rollups, statistics_pipeline(rollup_filter(request.GET, granularity), rolled_up=True))]
+            end = parse_datetime(request.GET, 'end')
+            if end:
+                # Attacks exactly at the inclusive end open a bucket the rollups leave out
+                queries.append(facet_counts(attacks, statistics_pipeline(
+                    {"$and": [attack_filter(request.GET), {"timestamp": end}]}
+                )))
+            counts, *edges = await asyncio.gather(*queries)
+            for edge in edges:
+                for key in STATISTICS_KEYS:
+                    counts[key].update(edge[key])
+
+        return {key: dict(counts[key]) for key in STATISTICS_KEYS}
+
+
+class AsyncAttackHistogramView(AsyncReadView):
+    async def get(self, request):
+        unit, bin_size, step = parse_interval(request.GET)
+        start, end = histogram_range(request.GET, step)
+
+        group_by = request.GET.get("group_by") or None
+        if group_by is not None and group_by not in GROUP_KEYS:
+            raise ValidationError({"group_by": f"Must be one of {', '.join(GROUP_KEYS)}."})
+
+        pipeline = histogram_pipeline(request.GET, unit, bin_size, start, end, group_by)
+        facets = await (await self.collection(CyberAttack).aggregate(pipeline)).next()
+        return {
+            "interval": request.GET.get("interval") or DEFAULT_INTERVAL,
+            "start": start,
+            "end": end,
+            "group_by": group_by,
+            "buckets": fill_buckets(facets, start, end, step, group_by),
+        }
+
+
+class AsyncNotificationLogView(AsyncReadView):
+    async def get(self, request):
+        filters = notification_filter(request.GET)
+        page_size = parse_page_size(request.GET)
+        logs = self.collection(Notification)
+        count = count_total_async(logs, filters, request.GET.get('include_total', 'estimated'))
+
+        cursor = request.GET.get('cursor')
+        if cursor:
+            filters = {"$and": [filters, seek_filter("triggered_at", cursor)]} if filters else seek_filter("triggered_at", cursor)
+        fetch = logs.find(filters).sort([("triggered_at", -1), ("_id", -1)]).limit(page_size + 1)
+        (total, exact), results = await asyncio.gather(count, fetch.to_list())
+        results, next_cursor = split_page(results, page_size, "triggered_at")
+
+        data = {
+            "page_size": page_size,
+            "next": next_cursor,
+            "results": [notification_record(log) for log in results]
+        }
+        if total is not None:
+            data["total"] = total
+            data["total_exact"] = exact
+        return data
+
+
+class AttackStreamView(AsyncReadView):
+    """Server-Sent Events of newly inserted attacks (and notifications with notifications=true)."""
+
+    async def get(self, request):
+        if isinstance(request, WSGIRequest):
+            # WSGI would have to drain the endless async body synchronously
+            return self.render(
+                {"detail": "The event stream needs an ASGI server (e.g. uvicorn attackmap_backend.asgi:application)."},
+                status.HTTP_501_NOT_IMPLEMENTED,
+            )
+        filters = attack_filter(request.GET)
+        subscription = Subscription(attack_matcher(request.GET), request.GET.get("notifications") == "true")
+
+        last_event_id = request.headers.get("Last-Event-ID") or request.GET.get("last_event_id")
+        if last_event_id:
+            try:
+                last_event_id = ObjectId(last_event_id)
+            except InvalidId:
+                raise ValidationError({"last_event_id": "Must be an event id from this stream."})
+
+        response = StreamingHttpResponse(
+            event_stream(subscription, filters, last_event_id), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        # Stop nginx from buffering the stream
+        response["X-Accel-Buffering"] = "no"
+        return response
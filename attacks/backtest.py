@@ -0,0 +1,144 @@
+import bisect
+from array import array
+from datetime import datetime, timedelta
+from rest_framework.exceptions import ValidationError
+from attacks.models import CyberAttack
+from attacks.queries import as_utc, parse_datetime, parse_int
+from attacks.rules import BATCH_SIZE, EPOCH, RULE_PROJECTION, RuleIndex, rule_filter
+
+try:
+    import numpy
+except ImportError:  # in requirements.txt; the loop below gives the same results without it
+    numpy = None
+
+DEFAULT_RANGE = timedelta(days=7)
+
+# Trigger times listed per rule; the trigger count covers all of them
+TIMESTAMP_LIMIT = 100
+MAX_TIMESTAMP_LIMIT = 10_000
+
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def epoch_ms(timestamp):
+    return (timestamp - EPOCH) // MILLISECOND
+
+
+def from_epoch_ms(value):
+    return EPOCH + value * MILLISECOND
+
+
+def window_ends(times, threshold, window, earlier=0):
+    """Indexes of the matches at which at least ``threshold`` matches fall within ``window`` ms.
+
+    ``times`` are the epoch milliseconds of a rule's matches, in order. Without
+    a window every match counts, ``earlier`` of them before ``times`` starts.
+    """
+    if window is None:
+        return range(max(threshold - 1 - earlier, 0), len(times))
+    if len(times) < threshold:
+        return []
+    if numpy is not None:
+        values = numpy.frombuffer(times, dtype=numpy.int64)
+        spans = values[threshold - 1:] - values[:len(values) - threshold + 1]
+        return (numpy.flatnonzero(spans <= window) + (threshold - 1)).tolist()
+    return [index for index in range(threshold - 1, len(times)) if times[index] - times[index - threshold + 1] <= window]
+
+
+def volume_triggers(times, threshold, window, cooldown, first=0, earlier=0):
+    """Indexes of the matches a threshold rule fires on, from ``times[first]`` on.
+
+    The rule is evaluated on every match, and after firing stays quiet for
+    ``cooldown`` ms, as ``in_cooldown`` keeps it in the live engine.
+    """
+    ends = window_ends(times, threshold, window, earlier)
+    fired = []
+    position = bisect.bisect_left(ends, first)
+    while position < len(ends):
+        index = ends[position]
+        fired.append(index)
+        resume = bisect.bisect_left(times, times[index] + cooldown)
+        position = bisect.bisect_left(ends, resume, position + 1)
+    return fired
+
+
+def backtest(rules, start, end, limit=TIMESTAMP_LIMIT):
+    """Replay the attacks in [start, end] against ``rules`` as if they had been active all along.
+
+    Attacks are streamed once, in timestamp order, through a ``RuleIndex``.
+    Per-attack rules fire on each match; threshold rules keep the epoch
+    milliseconds of their matches, whose windows and cooldowns are worked out
+    once the stream ends. Nothing is written. Returns (attacks replayed,
+    [{rule, triggers, timestamps}]).
+    """
+    start_ms = epoch_ms(start)
+    threshold_rules = [rule for rule in rules if rule.threshold_count]
+    # Windows open at start are filled from the attacks before it
+    warm_up = max(
+        (timedelta(minutes=rule.time_window_minutes) for rule in threshold_rules if rule.time_window_minutes),
+        default=timedelta(0),
+    )
+
+    matches = {id(rule): array("q") for rule in threshold_rules}
+    triggers = {id(rule): 0 for rule in rules if not rule.threshold_count}
+    timestamps = {id(rule): [] for rule in rules}
+    index = RuleIndex(rules)
+    replayed = 0
+    cursor = CyberAttack._get_collection().find(
+        {"timestamp": {"$gte": start - warm_up, "$lte": end}}, RULE_PROJECTION
+    ).sort([("timestamp", 1), ("_id", 1)]).batch_size(BATCH_SIZE)
+    for attack in cursor:
+        timestamp = attack["timestamp"]
+        in_range = timestamp >= start
+        replayed += in_range
+        for rule in index.match(attack):
+            key = id(rule)
+            if key in matches:
+                matches[key].append(epoch_ms(timestamp))
+            elif in_range:
+                triggers[key] += 1
+                if len(timestamps[key]) < limit:
+                    timestamps[key].append(timestamp)
+
+    for rule in threshold_rules:
+        times = matches[id(rule)]
+        window = rule.time_window_minutes and rule.time_window_minutes * 60_000
+        earlier = 0
+        if not window:
+            # Without a window, the count includes every earlier match
+            earlier = CyberAttack._get_collection().count_documents(
+                {"$and": [rule_filter(rule), {"timestamp": {"$lt": start - warm_up}}]}
+            )
+        fired = volume_triggers(
+            times, max(rule.threshold_count, 1), window or None, (rule.cooldown_minutes or 10) * 60_000,
+            first=bisect.bisect_left(times, start_ms), earlier=earlier,
+        )
+        triggers[id(rule)] = len(fired)
+        timestamps[id(rule)] = [from_epoch_ms(times[index]) for index in fired[:limit]]
+
+    return replayed, [
+        {"rule": rule.name, "triggers": triggers[id(rule)], "timestamps": timestamps[id(rule)]}
+        for rule in rules
+    ]
+
+
+def replay_range(start=None, end=None):
+    """Replayed range, defaulting to the last week; ``end`` is inclusive."""
+    end = as_utc(end) if end else datetime.utcnow()
+    start = as_utc(start) if start else end - DEFAULT_RANGE
+    if start > end:
+        raise ValidationError({"start": "Must not be after end."})
+    return start, end
+
+
+def backtest_range(params):
+    return replay_range(parse_datetime(params, 'start'), parse_datetime(params, 'end'))
+
+
+def parse_timestamp_limit(params):
+    limit = parse_int(params, 'limit')
+    if limit is None:
+        return TIMESTAMP_LIMIT
+    if not 0 <= limit <= MAX_TIMESTAMP_LIMIT:
+        raise ValidationError({"limit": f"Must be between 0 and {MAX_TIMESTAMP_LIMIT}."})
+    return limit
@@ -0,0 +1,234 @@
+import argparse
+import random
+import resource
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.test import override_settings
+from mongoengine import connect, disconnect
+from attacks.ingest import location_document
+from attacks.instrumentation import COMMAND_LISTENER
+from attacks.models import CyberAttack, Notification, NotificationRule, RuleEngineState
+from attacks.rules import RuleEvaluator
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+
+ATTACK_TYPES = ['DDoS', 'Malware', 'Phishing', 'Ransomware', 'Zero-Day', 'SQL Injection']
+
+# (country, latitude, longitude) of the seeded endpoints
+COUNTRIES = [
+    ("USA", 38.9, -77.0), ("Canada", 45.4, -75.7), ("Brazil", -15.8, -47.9), ("Mexico", 19.4, -99.1),
+    ("United Kingdom", 51.5, -0.1), ("France", 48.9, 2.4), ("Germany", 52.5, 13.4), ("Netherlands", 52.4, 4.9),
+    ("Russia", 55.8, 37.6), ("Ukraine", 50.5, 30.5), ("Turkey", 39.9, 32.9), ("Iran", 35.7, 51.4),
+    ("India", 28.6, 77.2), ("China", 39.9, 116.4), ("Japan", 35.7, 139.7), ("South Korea", 37.6, 127.0),
+    ("Singapore", 1.4, 103.8), ("Australia", -35.3, 149.1), ("South Africa", -25.7, 28.2), ("Nigeria", 9.1, 7.5),
+]
+
+# Seeded attacks are spread over this period before the anchor
+SPAN = timedelta(days=30)
+
+
+def parse_size(value):
+    """Attack count from '10k', '1m', '10m' or a plain number."""
+    try:
+        return SIZES.get(value.lower()) or int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected one of {', '.join(SIZES)} or a number, got '{value}'.")
+
+
+def anchor_time():
+    # Whole hours, so the ranges below line up with the hourly rollups
+    return datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+
+
+def synthetic_attack(rng, anchor):
+    (src, src_lat, src_lng), (dst, dst_lat, dst_lng) = rng.sample(COUNTRIES, 2)
+    return {
+        "source_location": location_document(src_lat + rng.uniform(-2, 2), src_lng + rng.uniform(-2, 2), src),
+        "destination_location": location_document(dst_lat + rng.uniform(-2, 2), dst_lng + rng.uniform(-2, 2), dst),
+        "attack_type": rng.choice(ATTACK_TYPES),
+        "severity": rng.randint(1, 10),
+        "timestamp": anchor - timedelta(seconds=rng.randrange(int(SPAN.total_seconds()))),
+        "additional_details": {
+            "ip_src": f"203.0.113.{rng.randrange(256)}",
+            "ip_dst": f"198.51.100.{rng.randrange(256)}",
+            "description": "Synthetic benchmark attack",
+        },
+    }
+
+
+def attack_batches(count, seed, anchor, batch_size):
+    """The same attacks for the same seed, in batches so 10M never sit in memory."""
+    rng = random.Random(seed)
+    for offset in range(0, count, batch_size):
+        yield [synthetic_attack(rng, anchor) for _ in range(min(batch_size, count - offset))]
+
+
+def synthetic_rules(count, seed):
+    """Per-attack rules on the last hour, with every tenth a volume rule."""
+    rng = random.Random(seed)
+    rules = []
+    for number in range(count):
+        rule = NotificationRule(
+            name=f"bench-{number}",
+            attack_type=rng.choice(ATTACK_TYPES),
+            country=rng.choice(COUNTRIES)[0],
+            time_window_minutes=60,
+        )
+        if number % 10 == 9:
+            rule.country = None
+            rule.threshold_count = 50
+        else:
+            rule.min_severity = rng.randint(1, 8)
+        rules.append(rule)
+    return rules
+
+
+def endpoint_cases(anchor):
+    """(name, path) of the GET requests measured, with representative filter combinations."""
+    week = f"start={(anchor - timedelta(days=7)).isoformat()}&end={anchor.isoformat()}"
+    day = f"start={(anchor - timedelta(days=1)).isoformat()}&end={anchor.isoformat()}"
+    return [
+        ("attacks: first page", "/api/attacks/"),
+        ("attacks: type and severity", "/api/attacks/?attack_type=DDoS&min_severity=7"),
+        ("attacks: country, last week", f"/api/attacks/?country=Germany&{week}"),
+        ("attacks: page 50", "/api/attacks/?page=50&page_size=20"),
+        ("attacks: cursor page", "/api/attacks/?cursor=&page_size=50"),
+        ("attacks: bbox", "/api/attacks/?bbox=-10,35,30,60"),
+        ("attacks: faceted, type", "/api/attacks/?attack_type=DDoS&facets=true"),
+        ("recent: 100", "/api/attacks/recent/?limit=100"),
+        ("visualization: map", "/api/attacks/visualization-data/"),
+        ("visualization: clusters", "/api/attacks/visualization-data/?cluster=true&zoom=3"),
+        ("visualization: streamed", "/api/attacks/visualization-data/?stream=true&limit=10000"),
+        ("visualization: ndjson", "/api/attacks/visualization-data/?format=ndjson&limit=10000"),
+        ("statistics: all", "/api/attacks/statistics/"),
+        ("statistics: type", "/api/attacks/statistics/?attack_type=Malware"),
+        ("statistics: last week", f"/api/attacks/statistics/?{week}"),
+        ("histogram: last day by hour", f"/api/attacks/histogram/?interval=1h&{day}"),
+        ("histogram: last week by type", f"/api/attacks/histogram/?interval=1h&group_by=attack_type&{week}"),
+        ("flows: last day", f"/api/attacks/flows/?{day}"),
+        ("flows: last week", f"/api/attacks/flows/?limit=50&{week}"),
+        ("cardinality: source IPs, last week", f"/api/attacks/cardinality/?ip=src&{week}"),
+        ("cardinality: country and type", f"/api/attacks/cardinality/?ip=dst&country=Germany&attack_type=DDoS&{week}"),
+        ("notification rules", "/api/notifications/rules/"),
+        ("backtest: last day", f"/api/notifications/rules/backtest/?{day}"),
+        ("notification logs", "/api/notifications/logs/"),
+        ("metrics", "/metrics"),
+    ]
+
+
+# The async twins, measured on the same requests
+ASYNC_PREFIXES = {
+    "/api/attacks/": "/api/async/attacks/",
+    "/api/attacks/recent/": "/api/async/attacks/recent/",
+    "/api/attacks/statistics/": "/api/async/attacks/statistics/",
+    "/api/attacks/histogram/": "/api/async/attacks/histogram/",
+    "/api/notifications/logs/": "/api/async/notifications/logs/",
+}
+
+
+def async_path(path):
+    route, _, query = path.partition("?")
+    if route not in ASYNC_PREFIXES:
+        return None
+    return ASYNC_PREFIXES[route] + (f"?{query}" if query else "")
+
+
+def summarize(samples):
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "runs": len(samples),
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+    }
+
+
+def measure(call, repeat):
+    """Latency percentiles over ``repeat`` timed calls, and peak Python allocations of one more."""
+    call()  # warm-up
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {**summarize(samples), "peak_memory_kb": round(peak / 1024, 1)}
+
+
+async def measure_async(call, repeat):
+    await call()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await call()
+        samples.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        await call()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {**summarize(samples), "peak_memory_kb": round(peak / 1024, 1)}
+
+
+def rule_throughput(rules):
+    """One full evaluate_rules pass over every attack with ``rules`` active."""
+    NotificationRule.objects.delete()
+    Notification.objects.delete()
+    RuleEngineState.objects(name="bench").delete()
+    for rule in rules:
+        rule.save()
+
+    attacks = CyberAttack._get_collection().estimated_document_count()
+    evaluator = RuleEvaluator(name="bench")
+    started = time.perf_counter()
+    created = evaluator.run(full=True)
+    elapsed = time.perf_counter() - started
+    return {
+        "rules": len(rules),
+        "attacks": attacks,
+        "seconds": round(elapsed, 3),
+        "attacks_per_second": round(attacks / elapsed),
+        "notifications": created,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+@contextmanager
+def bench_database(name):
+    """Point mongoengine and the async views at database ``name``, with the response cache off."""
+    options = {**settings.MONGODB, "db": name}
+    disconnect()
+    connect(**options, event_listeners=[COMMAND_LISTENER])
+    try:
+        with override_settings(
+            MONGODB=options,
+            CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}},
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+        ):
+            yield
+    finally:
+        disconnect()
+        connect(**settings.MONGODB, event_listeners=[COMMAND_LISTENER])
+
+
+def compare(results, baseline):
+    """(name, baseline p95, current p95) for every endpoint measured in both runs."""
+    before = {case["name"]: case for case in baseline.get("endpoints", [])}
+    return [
+        (case["name"], before[case["name"]]["p95_ms"], case["p95_ms"])
+        for case in results["endpoints"]
+        if case["name"] in before
+    ]
@@ -0,0 +1,101 @@
+import hashlib
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponseNotModified
+from rest_framework.response import Response
+from attacks.models import DataVersion
+
+VERSION_NAME = "attacks"
+
+# How long a request waits for another one computing the same response
+SINGLE_FLIGHT_WAIT = 5.0
+SINGLE_FLIGHT_POLL = 0.05
+
+
+def data_version():
+    """Current data version, read from MongoDB so that every process sees every write."""
+    collection = DataVersion._get_collection()
+    document = collection.find_one({"_id": VERSION_NAME}, {"version": 1})
+    if document is None:
+        # Start from the clock, not 0: a lost counter must never reuse an old version
+        collection.update_one({"_id": VERSION_NAME}, {"$setOnInsert": {"version": time.time_ns()}}, upsert=True)
+        document = collection.find_one({"_id": VERSION_NAME}, {"version": 1})
+    return document["version"]
+
+
+def bump_data_version():
+    """Invalidate every cached response; call after any attack or rule write."""
+    collection = DataVersion._get_collection()
+    if not collection.update_one({"_id": VERSION_NAME}, {"$inc": {"version": 1}}).matched_count:
+        collection.update_one({"_id": VERSION_NAME}, {"$setOnInsert": {"version": time.time_ns()}}, upsert=True)
+
+
+def response_key(request):
+    """Path, sorted query parameters and Accept header; the representation a response depends on."""
+    params = sorted((name, value) for name in request.GET for value in request.GET.getlist(name))
+    digest = hashlib.sha256(repr((request.path, params, request.META.get("HTTP_ACCEPT", ""))).encode())
+    return digest.hexdigest()[:32]
+
+
+def etag_matches(request, etag):
+    header = request.META.get("HTTP_IF_NONE_MATCH")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+def wait_for_leader(key):
+    """Wait while another request computes this key; its data, or None."""
+    lock = f"{key}:lock"
+    deadline = time.monotonic() + SINGLE_FLIGHT_WAIT
+    while cache.get(lock) and time.monotonic() < deadline:
+        time.sleep(SINGLE_FLIGHT_POLL)
+        data = cache.get(key)
+        if data is not None:
+            return data
+    # The leader stores its data before releasing the lock
+    return cache.get(key)
+
+
+def cached_response(get):
+    """Cache a view's GET responses until the next data version.
+
+    Entries are keyed on the normalized request and the current data
+    version, so any write makes them unreachable. The ETag is derived from
+    the same key; a matching If-None-Match short-circuits to 304 while the
+    entry is still cached. Only one request per key computes a missing
+    entry; the others wait for it. Streaming responses get an ETag but are
+    not stored.
+    """
+    @wraps(get)
+    def cached_get(self, request, *args, **kwargs):
+        key = f"attacks:response:{response_key(request)}:{data_version()}"
+        etag = f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+        data = cache.get(key)
+        if data is not None and etag_matches(request, etag):
+            return HttpResponseNotModified(headers={"ETag": etag})
+        if data is None:
+            data = wait_for_leader(key)
+        if data is not None:
+            response = Response(data)
+            response["ETag"] = etag
+            return response
+
+        lock = f"{key}:lock"
+        leader = cache.add(lock, True, SINGLE_FLIGHT_WAIT)
+        try:
+            response = get(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                response["ETag"] = etag
+                if leader and isinstance(response, Response):
+                    cache.set(key, response.data, getattr(settings, 'ATTACK_RESPONSE_CACHE_TIMEOUT', 300))
+            return response
+        finally:
+            if leader:
+                cache.delete(lock)
+
+    return cached_get
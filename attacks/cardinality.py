@@ -0,0 +1,198 @@
+import hashlib
+import math
+import zlib
+from collections import defaultdict
+from pymongo import UpdateOne
+from rest_framework.exceptions import ValidationError
+from attacks.flows import FLOW_GRANULARITIES, ceil_time, floor_time, range_plan
+from attacks.models import CyberAttack, IPSketch
+from attacks.queries import as_utc
+
+# 2**12 one-byte registers: about 1.6% standard error. Stored sketches depend on it.
+PRECISION = 12
+
+STANDARD_ERROR = round(1.04 / math.sqrt(1 << PRECISION), 4)
+
+# Country / attack type of the sketches over all of them
+ALL = "*"
+
+# Which IP is counted, and the country at the other end of the attack it is counted for
+IP_FIELDS = {
+    "src": ("ip_src", "destination_location.country"),
+    "dst": ("ip_dst", "source_location.country"),
+}
+
+KEY_FIELDS = ("granularity", "bucket", "field", "country", "attack_type")
+
+
+class HyperLogLog:
+    """Mergeable distinct-count sketch (Flajolet et al.) over 64-bit blake2b hashes."""
+
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers or bytes(1 << PRECISION))
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+        rest_bits = 64 - PRECISION
+        rest = hashed & ((1 << rest_bits) - 1)
+        # Position of the first 1 bit after the register index
+        rank = rest_bits - rest.bit_length() + 1
+        index = hashed >> rest_bits
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        size = len(self.registers)
+        raw = 0.7213 / (1 + 1.079 / size) * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * size and zeros:
+            # Linear counting is more accurate for small sets
+            return round(size * math.log(size / zeros))
+        return round(raw)
+
+    def to_binary(self):
+        # Mostly zero registers compress to a few bytes
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_binary(cls, data):
+        return cls(zlib.decompress(data))
+
+
+def sketch_entries(attack):
+    """(field, country, attack_type, ip) for each sketch an attack's IPs go into."""
+    details = attack.get("additional_details") or {}
+    for field, country_path in IP_FIELDS.values():
+        ip = details.get(field)
+        if not isinstance(ip, str) or not ip:
+            continue
+        location, _, name = country_path.partition(".")
+        country = attack[location][name]
+        for country_key in (country, ALL):
+            for type_key in (attack["attack_type"], ALL):
+                yield field, country_key, type_key, ip
+
+
+def build_sketches(attacks):
+    sketches = defaultdict(HyperLogLog)
+    for attack in attacks:
+        timestamp = as_utc(attack["timestamp"])
+        for field, country, attack_type, ip in sketch_entries(attack):
+            for granularity in FLOW_GRANULARITIES:
+                sketches[(granularity, floor_time(timestamp, granularity), field, country, attack_type)].add(ip)
+    return sketches
+
+
+def store_sketches(sketches):
+    """Merge sketches into the stored ones with a compare-and-set per document.
+
+    Merging is idempotent, so when any write loses a race the whole set is
+    simply merged again.
+    """
+    collection = IPSketch._get_collection()
+    while sketches:
+        keys = [dict(zip(KEY_FIELDS, key)) for key in sketches]
+        stored = {
+            tuple(document[field] for field in KEY_FIELDS): document
+            for document in collection.find({"$or": keys})
+        }
+        operations = []
+        for key, sketch in sketches.items():
+            document = stored.get(key)
+            if document is None:
+                # Matches, and so does nothing, if someone else inserted it first
+                operations.append(UpdateOne(
+                    dict(zip(KEY_FIELDS, key)),
+                    {"$setOnInsert": {"registers": sketch.to_binary(), "version": 1}},
+                    upsert=True,
+                ))
+            else:
+                merged = HyperLogLog.from_binary(document["registers"])
+                merged.merge(sketch)
+                operations.append(UpdateOne(
+                    {"_id": document["_id"], "version": document["version"]},
+                    {"$set": {"registers": merged.to_binary()}, "$inc": {"version": 1}},
+                ))
+        result = collection.bulk_write(operations, ordered=False)
+        if result.modified_count + result.upserted_count == len(operations):
+            return
+
+
+def record_sketches(attacks):
+    store_sketches(build_sketches(attacks))
+
+
+def rebuild_sketches(start=None, end=None):
+    """Recompute the sketches of whole days in [start, end) from the raw attacks, a day at a time.
+
+    Returns the number of sketches written.
+    """
+    collection, attacks = IPSketch._get_collection(), CyberAttack._get_collection()
+    bucket = {}
+    if start:
+        bucket["$gte"] = floor_time(start, "day")
+    if end:
+        bucket["$lt"] = ceil_time(end, "day")
+    collection.delete_many({"bucket": bucket} if bucket else {})
+
+    written = 0
+    while True:
+        # Skip straight to the next day that has attacks
+        first = attacks.find_one({"timestamp": bucket} if bucket else {}, {"timestamp": 1}, sort=[("timestamp", 1)])
+        if first is None:
+            return written
+        day = floor_time(first["timestamp"], "day")
+        following = day + FLOW_GRANULARITIES["day"]
+        documents = attacks.find(
+            {"timestamp": {"$gte": day, "$lt": following}},
+            {"timestamp": 1, "attack_type": 1, "source_location.country": 1, "destination_location.country": 1,
+             "additional_details.ip_src": 1, "additional_details.ip_dst": 1},
+        )
+        sketches = build_sketches(documents)
+        store_sketches(sketches)
+        written += len(sketches)
+        bucket["$gte"] = following
+
+
+def parse_ip_field(params):
+    ip = params.get("ip") or "src"
+    if ip not in IP_FIELDS:
+        raise ValidationError({"ip": f"Must be one of {', '.join(IP_FIELDS)}."})
+    return ip
+
+
+def distinct_ips(ip, country, attack_type, start, end):
+    """Estimated distinct IPs in [start, end], and the number of stored sketches merged."""
+    field, country_path = IP_FIELDS[ip]
+    plan, edges = range_plan(start, end)
+    sketch = HyperLogLog()
+    merged = 0
+
+    for granularity, ranges in plan.items():
+        buckets = [{"bucket": {"$gte": low, "$lt": high}} for low, high in ranges if low < high]
+        if not buckets:
+            continue
+        documents = IPSketch._get_collection().find({
+            "granularity": granularity, "field": field, "country": country or ALL,
+            "attack_type": attack_type or ALL, "$or": buckets,
+        }, {"registers": 1})
+        for document in documents:
+            sketch.merge(HyperLogLog.from_binary(document["registers"]))
+            merged += 1
+
+    # Partial hours at the edges come from the raw attacks
+    for low, high, inclusive in edges:
+        query = {"timestamp": {"$gte": low, "$lte" if inclusive else "$lt": high}}
+        if country:
+            query[country_path] = country
+        if attack_type:
+            query["attack_type"] = attack_type
+        for attack in CyberAttack._get_collection().find(query, {f"additional_details.{field}": 1}):
+            ip_value = (attack.get("additional_details") or {}).get(field)
+            if isinstance(ip_value, str) and ip_value:
+                sketch.add(ip_value)
+
+    return sketch.estimate(), merged
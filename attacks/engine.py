@@ -0,0 +1,255 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, OperationFailure
+from attacks.models import CyberAttack, NotificationRule, Notification, RuleEngineState
+from attacks.rules import (
+    BATCH_SIZE, RULE_PROJECTION, NotificationBatch, RuleIndex, SlidingWindowCounter,
+    epoch_seconds, in_cooldown, trigger_volume, within_window,
+)
+
+# ObjectIds from several writers are only ordered to the second, so each
+# polling cycle looks back this far past the high-water mark
+POLL_OVERLAP = timedelta(seconds=1)
+
+# Attack ids remembered to drop the overlap (and change stream replays)
+RECENT_IDS = 100000
+
+# Longest a match waits in the notification buffer
+FLUSH_INTERVAL = 0.2
+
+# Insert events, trimmed to the fields rules look at
+CHANGE_PIPELINE = [
+    {"$match": {"operationType": "insert"}},
+    {"$project": {f"fullDocument.{field}": 1 for field in ["_id", *RULE_PROJECTION]}},
+]
+
+
+def rule_signature(rule):
+    return (
+        rule.name, rule.attack_type, rule.country, rule.min_severity, rule.max_severity,
+        rule.threshold_count, rule.time_window_minutes, rule.cooldown_minutes,
+    )
+
+
+class RuleEngine:
+    """Long-running rule evaluation over newly inserted attacks.
+
+    Follows a change stream on the attack collection when the deployment has
+    one, otherwise polls by ``_id``. Each attack is matched once against every
+    active rule through a ``RuleIndex``; per-attack matches are flushed as
+    batched upserts within ``FLUSH_INTERVAL`` and threshold rules keep live
+    ``SlidingWindowCounter``s. Rules are reloaded when they change and the
+    stream position is checkpointed in ``RuleEngineState``.
+    """
+
+    def __init__(self, database, name="run_rule_engine", poll_interval=1.0,
+                 reload_interval=10.0, checkpoint_interval=5.0, flush_size=1000, log=None):
+        self.attacks = database[CyberAttack._get_collection_name()]
+        self.notification_collection = database[Notification._get_collection_name()]
+        self.rule_collection = database[NotificationRule._get_collection_name()]
+        self.states = database[RuleEngineState._get_collection_name()]
+        self.name = name
+        self.poll_interval = poll_interval
+        self.reload_interval = reload_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.flush_size = flush_size
+        self.log = log or (lambda message: None)
+
+        self.rules = {}
+        self.signatures = {}
+        self.counters = {}
+        # Attacks at or below a counter's seed mark were already counted by the seed
+        self.seed_marks = {}
+        self.index = RuleIndex([])
+        self.notifications = NotificationBatch(size=None)
+        self.volume_candidates = set()
+        self.recent = OrderedDict()
+        self.last_id = None
+        self.last_timestamp = None
+        self.resume_token = None
+        self.last_flush = 0.0
+        self.stopping = asyncio.Event()
+
+    def stop(self):
+        self.stopping.set()
+
+    async def sleep(self, seconds):
+        try:
+            await asyncio.wait_for(self.stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        await self.load_state()
+        await self.reload_rules()
+        try:
+            await asyncio.gather(self.follow_attacks(), self.follow_rules(), self.checkpoint_periodically())
+        finally:
+            await self.checkpoint()
+
+    async def load_state(self):
+        state = await self.states.find_one({"name": self.name})
+        if state:
+            self.last_id = state.get("last_attack_id")
+            self.last_timestamp = state.get("last_timestamp")
+            self.resume_token = state.get("resume_token") or None
+            self.log(f"Resuming after attack {self.last_id}")
+        else:
+            # History is evaluate_rules' job; start from the newest attack
+            newest = await self.attacks.find_one({}, {"_id": 1, "timestamp": 1}, sort=[("_id", -1)])
+            if newest:
+                self.last_id, self.last_timestamp = newest["_id"], newest["timestamp"]
+            self.log("No checkpoint, starting from the newest attack")
+
+    async def reload_rules(self):
+        rules = await asyncio.to_thread(lambda: list(NotificationRule.objects(active=True)))
+        signatures = {str(rule.id): rule_signature(rule) for rule in rules}
+        newest = await self.attacks.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        now = datetime.utcnow()
+
+        counters, seed_marks = {}, {}
+        for rule in rules:
+            key = str(rule.id)
+            if not rule.threshold_count:
+                continue
+            if key in self.counters and self.signatures.get(key) == signatures[key]:
+                counters[key], seed_marks[key] = self.counters[key], self.seed_marks[key]
+            else:
+                counters[key] = await asyncio.to_thread(SlidingWindowCounter.seed, rule, now)
+                seed_marks[key] = newest["_id"] if newest else None
+
+        if signatures != self.signatures:
+            self.log(f"Loaded {len(rules)} active rules")
+        self.rules = {str(rule.id): rule for rule in rules}
+        self.signatures, self.counters, self.seed_marks = signatures, counters, seed_marks
+        self.index = RuleIndex(rules)
+
+    def process(self, attack):
+        attack_id = attack["_id"]
+        if attack_id in self.recent:
+            return
+        self.recent[attack_id] = None
+        if len(self.recent) > RECENT_IDS:
+            self.recent.popitem(last=False)
+
+        now = datetime.utcnow()
+        for rule in self.index.match(attack):
+            key = str(rule.id)
+            if rule.threshold_count:
+                mark = self.seed_marks.get(key)
+                if mark is None or attack_id > mark:
+                    self.counters[key].add(epoch_seconds(attack["timestamp"]))
+                    self.volume_candidates.add(key)
+            elif within_window(rule, attack, now):
+                self.notifications.add(rule, attack)
+
+        if self.last_id is None or attack_id > self.last_id:
+            self.last_id, self.last_timestamp = attack_id, attack["timestamp"]
+
+    async def after_batch(self):
+        """Flush buffered notifications and check the threshold rules that saw new attacks."""
+        self.last_flush = asyncio.get_running_loop().time()
+        operations = self.notifications.take()
+        if operations:
+            try:
+                self.notifications.record(await self.notification_collection.bulk_write(operations, ordered=False))
+            except BulkWriteError as exc:
+                self.notifications.record_error(exc)
+
+        candidates, self.volume_candidates = self.volume_candidates, set()
+        now = datetime.utcnow()
+        for key in candidates:
+            rule = self.rules.get(key)
+            if rule is None or key not in self.counters or in_cooldown(rule, now):
+                continue
+            matched_count = self.counters[key].count(now)
+            if matched_count >= rule.threshold_count:
+                if await asyncio.to_thread(trigger_volume, rule, matched_count):
+                    self.log(f"Rule '{rule.name}' triggered by volume: {matched_count} attacks")
+
+    def flush_due(self):
+        return (
+            len(self.notifications.operations) >= self.flush_size
+            or asyncio.get_running_loop().time() - self.last_flush > FLUSH_INTERVAL
+        )
+
+    async def follow_attacks(self):
+        try:
+            await self.follow_change_stream()
+        except OperationFailure as exc:
+            if self.stopping.is_set():
+                return
+            self.log(f"Change stream unavailable ({exc}); polling by _id")
+            self.resume_token = None
+            await self.poll_attacks()
+
+    async def follow_change_stream(self):
+        stream = await self.attacks.watch(
+            CHANGE_PIPELINE, resume_after=self.resume_token, max_await_time_ms=500, batch_size=BATCH_SIZE
+        )
+        async with stream:
+            self.log("Following the attack change stream")
+            if self.resume_token is None:
+                # The stream is open, so nothing inserted from here on is missed
+                await self.poll_cycle()
+                await self.after_batch()
+            while not self.stopping.is_set() and stream.alive:
+                change = await stream.try_next()
+                if change is not None:
+                    self.process(change["fullDocument"])
+                self.resume_token = stream.resume_token
+                if change is None or self.flush_due():
+                    await self.after_batch()
+
+    async def poll_cycle(self):
+        """Read every attack past the high-water mark; return how many were read."""
+        query = {}
+        if self.last_id:
+            query = {"_id": {"$gt": ObjectId.from_datetime(self.last_id.generation_time - POLL_OVERLAP)}}
+        read = 0
+        while True:
+            batch = await self.attacks.find(query, RULE_PROJECTION).sort("_id", 1).limit(BATCH_SIZE).to_list()
+            for attack in batch:
+                self.process(attack)
+            read += len(batch)
+            if self.flush_due():
+                await self.after_batch()
+            if len(batch) < BATCH_SIZE:
+                return read
+            query = {"_id": {"$gt": batch[-1]["_id"]}}
+
+    async def poll_attacks(self):
+        while not self.stopping.is_set():
+            await self.poll_cycle()
+            await self.after_batch()
+            await self.sleep(self.poll_interval)
+
+    async def follow_rules(self):
+        try:
+            stream = await self.rule_collection.watch(max_await_time_ms=1000)
+            async with stream:
+                while not self.stopping.is_set() and stream.alive:
+                    if await stream.try_next() is not None:
+                        await self.reload_rules()
+        except OperationFailure:
+            while not self.stopping.is_set():
+                await self.sleep(self.reload_interval)
+                await self.reload_rules()
+
+    async def checkpoint_periodically(self):
+        while not self.stopping.is_set():
+            await self.sleep(self.checkpoint_interval)
+            await self.checkpoint()
+
+    async def checkpoint(self):
+        # Snapshot first: the flush below only covers attacks processed so far
+        position = {
+            "last_attack_id": self.last_id,
+            "last_timestamp": self.last_timestamp,
+            "resume_token": self.resume_token or {},
+        }
+        await self.after_batch()
+        position["updated_at"] = datetime.utcnow()
+        await self.states.update_one({"name": self.name}, {"$set": position}, upsert=True)
@@ -0,0 +1,259 @@
+import heapq
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from django.conf import settings
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from rest_framework.exceptions import ValidationError
+from attacks.models import AttackRollup, CyberAttack, FlowSummary
+from attacks.queries import as_utc, parse_datetime, parse_int
+from attacks.rules import DUPLICATE_KEY
+
+FLOW_FIELDS = ("src_country", "dst_country", "attack_type")
+
+# Summary buckets, coarsest first
+FLOW_GRANULARITIES = {
+    "day": timedelta(days=1),
+    "hour": timedelta(hours=1),
+}
+
+DEFAULT_LIMIT = 10
+
+
+def summary_size():
+    return getattr(settings, 'ATTACK_FLOW_SUMMARY_SIZE', 500)
+
+
+def exact_range():
+    # Ranges up to this long are always counted from the raw attacks
+    return timedelta(hours=getattr(settings, 'ATTACK_FLOW_EXACT_HOURS', 6))
+
+
+def flow_key(attack):
+    return attack["source_location"]["country"], attack["destination_location"]["country"], attack["attack_type"]
+
+
+def floor_time(timestamp, granularity):
+    timestamp = timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        timestamp = timestamp.replace(hour=0)
+    return timestamp
+
+
+def ceil_time(timestamp, granularity):
+    floored = floor_time(timestamp, granularity)
+    return floored if floored == timestamp else floored + FLOW_GRANULARITIES[granularity]
+
+
+def exact_summary(counts):
+    return {key: (count, 0) for key, count in counts.items()}, 0
+
+
+def stored_summary(document):
+    """(counters, floor) of a stored summary, where floor bounds the count of any flow it does not list."""
+    if document is None:
+        return {}, 0
+    counters = {tuple(row[field] for field in FLOW_FIELDS): (row["count"], row["error"]) for row in document["counters"]}
+    return counters, document["floor"]
+
+
+def merge_summaries(summaries, capacity):
+    """Merge Space-Saving summaries into one (counters, floor) that keeps at most ``capacity`` flows.
+
+    Each counter stays an upper bound of the flow's true count, with ``error``
+    the most it can be over: a summary that does not list a flow contributes
+    its floor to both. Flows dropped to stay within ``capacity`` raise the floor.
+    """
+    totals, errors, floors = Counter(), Counter(), Counter()
+    total_floor = 0
+    for counters, floor in summaries:
+        total_floor += floor
+        for key, (count, error) in counters.items():
+            totals[key] += count
+            errors[key] += error
+            floors[key] += floor
+    merged = {
+        key: (totals[key] + total_floor - floors[key], errors[key] + total_floor - floors[key])
+        for key in totals
+    }
+    kept = heapq.nlargest(capacity + 1, merged.items(), key=lambda item: (item[1][0], item[0]))
+    if len(kept) > capacity:
+        total_floor = max(total_floor, kept.pop()[1][0])
+    return dict(kept), total_floor
+
+
+def summary_rows(counters):
+    return [
+        {**dict(zip(FLOW_FIELDS, key)), "count": count, "error": error}
+        for key, (count, error) in sorted(counters.items(), key=lambda item: (-item[1][0], item[0]))
+    ]
+
+
+def update_summaries(collection, buckets, capacity):
+    """Fold exact flow counts into the stored summaries of their buckets, with a compare-and-set on each version.
+
+    ``buckets`` maps (granularity, bucket) to counts. The summaries are read
+    with one find and written with one unordered bulk_write. A write that
+    lost a race fails with a duplicate key, inserting a bucket someone else
+    created or upserting a version someone else moved past; only those
+    buckets are read and folded in again.
+    """
+    while buckets:
+        keys = list(buckets)
+        stored = {
+            (document["granularity"], document["bucket"]): document
+            for document in collection.find({"$or": [{"granularity": granularity, "bucket": bucket}
+                                                      for granularity, bucket in keys]})
+        }
+        operations = []
+        for key in keys:
+            document = stored.get(key)
+            counters, floor = merge_summaries([stored_summary(document), exact_summary(buckets[key])], capacity)
+            summary = {"counters": summary_rows(counters), "floor": floor}
+            granularity, bucket = key
+            if document is None:
+                operations.append(InsertOne({"granularity": granularity, "bucket": bucket, **summary, "version": 1}))
+            else:
+                # The upsert turns a stale version into a duplicate _id instead of a silent no-op
+                operations.append(UpdateOne(
+                    {
+                        "_id": document["_id"], "granularity": granularity, "bucket": bucket,
+                        "version": document["version"],
+                    },
+                    {"$set": summary, "$inc": {"version": 1}},
+                    upsert=True,
+                ))
+        try:
+            collection.bulk_write(operations, ordered=False)
+            return
+        except BulkWriteError as exc:
+            errors = exc.details["writeErrors"]
+            if any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            buckets = {keys[error["index"]]: buckets[keys[error["index"]]] for error in errors}
+
+
+def record_flows(attacks):
+    buckets = defaultdict(Counter)
+    for attack in attacks:
+        timestamp = as_utc(attack["timestamp"])
+        for granularity in FLOW_GRANULARITIES:
+            buckets[(granularity, floor_time(timestamp, granularity))][flow_key(attack)] += 1
+
+    update_summaries(FlowSummary._get_collection(), buckets, summary_size())
+
+
+def rebuild_summaries(start=None, end=None):
+    """Recompute the summaries of whole days in [start, end) from the hourly rollups.
+
+    Returns the number of summaries written.
+    """
+    collection, capacity = FlowSummary._get_collection(), summary_size()
+    bucket = {}
+    if start:
+        bucket["$gte"] = floor_time(start, "day")
+    if end:
+        bucket["$lt"] = ceil_time(end, "day")
+    stale = {"bucket": bucket} if bucket else {}
+    collection.delete_many(stale)
+
+    written = 0
+    for granularity in FLOW_GRANULARITIES:
+        pipeline = [
+            {"$match": {"granularity": "hour", **stale}},
+            {"$group": {
+                "_id": {
+                    "bucket": {"$dateTrunc": {"date": "$bucket", "unit": granularity}},
+                    **{field: f"${field}" for field in FLOW_FIELDS},
+                },
+                "count": {"$sum": "$count"},
+            }},
+            {"$group": {"_id": "$_id.bucket", "flows": {"$push": {
+                **{field: f"$_id.{field}" for field in FLOW_FIELDS}, "count": "$count",
+            }}}},
+        ]
+        for row in AttackRollup._get_collection().aggregate(pipeline, allowDiskUse=True):
+            counts = Counter({tuple(flow[field] for field in FLOW_FIELDS): flow["count"] for flow in row["flows"]})
+            counters, floor = merge_summaries([exact_summary(counts)], capacity)
+            # Ingest may have recreated the bucket since the delete
+            collection.replace_one(
+                {"granularity": granularity, "bucket": row["_id"]},
+                {
+                    "granularity": granularity, "bucket": row["_id"], "counters": summary_rows(counters),
+                    "floor": floor, "version": 1,
+                },
+                upsert=True,
+            )
+            written += 1
+    return written
+
+
+def summary_range(params):
+    """Range of a query over the hour / day summaries, defaulting to the last day; ``end`` is inclusive."""
+    end = parse_datetime(params, 'end')
+    end = as_utc(end) if end else datetime.utcnow()
+    start = parse_datetime(params, 'start')
+    start = as_utc(start) if start else end - timedelta(days=1)
+    if start > end:
+        raise ValidationError({"start": "Must not be after end."})
+    return start, end
+
+
+def parse_limit(params, capacity):
+    limit = parse_int(params, 'limit') or DEFAULT_LIMIT
+    if not 1 <= limit <= capacity:
+        raise ValidationError({"limit": f"Must be between 1 and {capacity}."})
+    return limit
+
+
+def range_plan(start, end):
+    """Split [start, end] into summary buckets and the partial hours counted exactly.
+
+    Returns ({granularity: [(from, to), ...]}, [(from, to, inclusive), ...]).
+    """
+    hours_from, hours_to = ceil_time(start, "hour"), floor_time(end, "hour")
+    if hours_from >= hours_to:
+        return {}, [(start, end, True)]
+
+    exact = [(hours_to, end, True)]
+    if start < hours_from:
+        exact.append((start, hours_from, False))
+
+    days_from, days_to = ceil_time(hours_from, "day"), floor_time(hours_to, "day")
+    if days_from >= days_to:
+        return {"hour": [(hours_from, hours_to)]}, exact
+    return {"day": [(days_from, days_to)], "hour": [(hours_from, days_from), (days_to, hours_to)]}, exact
+
+
+def exact_counts(start, end, inclusive=True):
+    pipeline = [
+        {"$match": {"timestamp": {"$gte": start, "$lte" if inclusive else "$lt": end}}},
+        {"$group": {
+            "_id": {"src": "$source_location.country", "dst": "$destination_location.country", "type": "$attack_type"},
+            "count": {"$sum": 1},
+        }},
+    ]
+    return Counter({
+        (row["_id"]["src"], row["_id"]["dst"], row["_id"]["type"]): row["count"]
+        for row in CyberAttack._get_collection().aggregate(pipeline)
+    })
+
+
+def top_flows(start, end, limit, exact=False):
+    """The ``limit`` busiest flows in [start, end], and whether their counts are exact."""
+    capacity = summary_size()
+    if exact or end - start <= exact_range():
+        summaries = [exact_summary(exact_counts(start, end))]
+    else:
+        plan, edges = range_plan(start, end)
+        summaries = [exact_summary(exact_counts(*edge)) for edge in edges]
+        collection = FlowSummary._get_collection()
+        for granularity, ranges in plan.items():
+            buckets = [{"bucket": {"$gte": low, "$lt": high}} for low, high in ranges if low < high]
+            if buckets:
+                for document in collection.find({"granularity": granularity, "$or": buckets}):
+                    summaries.append(stored_summary(document))
+
+    counters, _ = merge_summaries(summaries, capacity)
+    flows = summary_rows(counters)[:limit]
+    return flows, all(floor == 0 for _, floor in summaries)
@@ -0,0 +1,77 @@
+import json
+
+# Only the fields the map needs; additional_details can be large
+FEATURE_PROJECTION = {
+    "_id": 0,
+    "source_location.latitude": 1,
+    "source_location.longitude": 1,
+    "source_location.country": 1,
+    "destination_location.latitude": 1,
+    "destination_location.longitude": 1,
+    "destination_location.country": 1,
+    "attack_type": 1,
+    "severity": 1,
+    "timestamp": 1,
+}
+
+
+def dumps(data):
+    # Same encoding as DRF's default JSONRenderer
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def point_feature(location, direction, attack):
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [
+                location["longitude"],
+                location["latitude"]
+            ]
+        },
+        "properties": {
+            "direction": direction,
+            "country": location["country"],
+            "attack_type": attack["attack_type"],
+            "severity": attack["severity"],
+            "timestamp": attack["timestamp"].isoformat()
+        }
+    }
+
+
+def attack_features(attack):
+    """Source and destination point features for a raw (projected) attack document."""
+    yield point_feature(attack["source_location"], "source", attack)
+    yield point_feature(attack["destination_location"], "destination", attack)
+
+
+def stream_feature_collection(features):
+    """Write a GeoJSON FeatureCollection one feature at a time."""
+    yield '{"type":"FeatureCollection","features":['
+    separator = ''
+    for feature in features:
+        yield separator + dumps(feature)
+        separator = ','
+    yield ']}'
+
+
+def stream_ndjson(items):
+    for item in items:
+        yield dumps(item) + '\n'
+
+
+def cluster_feature(cluster):
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [cluster["lng"], cluster["lat"]]
+        },
+        "properties": {
+            "cell": cluster["cell"],
+            "count": cluster["count"],
+            "max_severity": cluster["max_severity"],
+            "by_attack_type": cluster["by_attack_type"]
+        }
+    }
@@ -0,0 +1,88 @@
+import re
+from datetime import datetime, timedelta
+from rest_framework.exceptions import ValidationError
+from attacks.queries import as_utc, attack_filter, parse_datetime
+
+INTERVAL_UNITS = {
+    "s": ("second", timedelta(seconds=1)),
+    "m": ("minute", timedelta(minutes=1)),
+    "h": ("hour", timedelta(hours=1)),
+    "d": ("day", timedelta(days=1)),
+}
+
+# $dateTrunc lines up bins of binSize > 1 on this instant
+BIN_REFERENCE = datetime(2000, 1, 1)
+
+DEFAULT_INTERVAL = "1h"
+
+MAX_BUCKETS = 10000
+
+GROUP_KEYS = {
+    "attack_type": "$attack_type",
+    "severity": "$severity",
+    # An attack counts towards both its source and destination country
+    "country": ["$source_location.country", "$destination_location.country"],
+}
+
+
+def parse_interval(params, name='interval', default=DEFAULT_INTERVAL):
+    """``<n><unit>`` with unit s, m, h or d; returns (unit, bin_size, step)."""
+    match = re.fullmatch(r"(\d+)([smhd])", params.get(name) or default)
+    if not match or int(match.group(1)) < 1:
+        raise ValidationError({name: "Must look like 30s, 5m, 1h or 1d."})
+    bin_size = int(match.group(1))
+    unit, step = INTERVAL_UNITS[match.group(2)]
+    return unit, bin_size, step * bin_size
+
+
+def bucket_start(timestamp, step):
+    return BIN_REFERENCE + (timestamp - BIN_REFERENCE) // step * step
+
+
+def histogram_range(params, step):
+    """Range covered by the histogram, defaulting to the last day."""
+    end = parse_datetime(params, 'end')
+    end = as_utc(end) if end else datetime.utcnow()
+    start = parse_datetime(params, 'start')
+    start = as_utc(start) if start else end - timedelta(days=1)
+    if start > end:
+        raise ValidationError({"start": "Must not be after end."})
+    if (end - start) // step >= MAX_BUCKETS:
+        raise ValidationError({"interval": f"Too fine for this range (more than {MAX_BUCKETS} buckets)."})
+    return start, end
+
+
+def histogram_pipeline(params, unit, bin_size, start, end, group_by=None):
+    """Per-bucket totals, and per-group counts when ``group_by`` is set."""
+    bucket = {"$dateTrunc": {"date": "$timestamp", "unit": unit, "binSize": bin_size}}
+    facets = {"totals": [{"$group": {"_id": bucket, "count": {"$sum": 1}}}]}
+    if group_by:
+        facets["groups"] = [
+            {"$project": {"bucket": bucket, "key": GROUP_KEYS[group_by]}},
+            {"$unwind": "$key"},
+            {"$group": {"_id": {"bucket": "$bucket", "key": "$key"}, "count": {"$sum": 1}}},
+        ]
+    # The range replaces start / end, which may have been defaulted
+    filters = attack_filter({name: params.get(name) for name in params if name not in ("start", "end")})
+    return [
+        {"$match": {"$and": [filters, {"timestamp": {"$gte": start, "$lte": end}}]}},
+        {"$facet": facets},
+    ]
+
+
+def fill_buckets(facets, start, end, step, group_by=None):
+    """Every bucket from start to end in order, with zero counts where nothing happened."""
+    totals = {row["_id"]: row["count"] for row in facets["totals"]}
+    groups = {}
+    for row in facets.get("groups", ()):
+        groups.setdefault(row["_id"]["bucket"], {})[str(row["_id"]["key"])] = row["count"]
+
+    buckets = []
+    current = bucket_start(start, step)
+    while current <= end:
+        bucket = {"start": current, "count": totals.get(current, 0)}
+        if group_by:
+            bucket["groups"] = groups.get(current, {})
+        buckets.append(bucket)
+        current += step
+    return buckets
@@ -0,0 +1,119 @@
+from datetime import datetime
+from django.conf import settings
+from pymongo.errors import BulkWriteError
+from attacks.caching import bump_data_version
+from attacks.cardinality import record_sketches
+from attacks.flows import record_flows
+from attacks.models import CyberAttack
+from attacks.rollups import record_attacks
+
+
+def batch_size_setting():
+    return getattr(settings, 'ATTACK_BULK_BATCH_SIZE', 1000)
+
+
+def location_document(latitude, longitude, country):
+    """Stored shape of a Location, including the GeoJSON point set by Location.clean()."""
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "country": country,
+        "point": {"type": "Point", "coordinates": [longitude, latitude]},
+    }
+
+
+def _number(value):
+    # bool is an int subclass, but never a coordinate
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _validate_location(value, errors, name):
+    if not isinstance(value, dict):
+        errors[name] = "Must be an object with latitude, longitude and country."
+        return None
+    latitude, longitude, country = value.get("latitude"), value.get("longitude"), value.get("country")
+    if not _number(latitude) or not -90 <= latitude <= 90:
+        errors[f"{name}.latitude"] = "Must be a number between -90 and 90."
+    if not _number(longitude) or not -180 <= longitude <= 180:
+        errors[f"{name}.longitude"] = "Must be a number between -180 and 180."
+    if not isinstance(country, str) or not country:
+        errors[f"{name}.country"] = "Must be a non-empty string."
+    if errors:
+        return None
+    return location_document(float(latitude), float(longitude), country)
+
+
+def validate_attack(item):
+    """Check one incoming attack without building a Document.
+
+    Returns (document, None) with the document in its stored shape, or
+    (None, errors) with a field -> message dict.
+    """
+    if not isinstance(item, dict):
+        return None, {"non_field_errors": "Must be an object."}
+
+    errors = {}
+    source = _validate_location(item.get("source_location"), errors, "source_location")
+    destination = _validate_location(item.get("destination_location"), errors, "destination_location")
+
+    attack_type = item.get("attack_type")
+    if not isinstance(attack_type, str) or not attack_type:
+        errors["attack_type"] = "Must be a non-empty string."
+
+    severity = item.get("severity")
+    if not isinstance(severity, int) or isinstance(severity, bool):
+        errors["severity"] = "Must be an integer."
+
+    timestamp = item.get("timestamp")
+    try:
+        timestamp = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        errors["timestamp"] = "Must be an ISO 8601 datetime."
+
+    additional_details = item.get("additional_details", {})
+    if not isinstance(additional_details, dict):
+        errors["additional_details"] = "Must be an object."
+
+    if errors:
+        return None, errors
+    return {
+        "source_location": source,
+        "destination_location": destination,
+        "attack_type": attack_type,
+        "severity": severity,
+        "timestamp": timestamp,
+        "additional_details": additional_details,
+    }, None
+
+
+def insert_attacks(documents, batch_size=None):
+    """Write stored-shape attack documents with unordered insert_many in chunks.
+
+    Returns (inserted_count, errors) where each error carries the index of the
+    failed document in ``documents``. Inserted attacks are added to the rollups
+    flow summaries and distinct-IP sketches, and invalidate cached responses.
+    """
+    batch_size = batch_size or batch_size_setting()
+    collection = CyberAttack._get_collection()
+    inserted = 0
+    errors = []
+
+    for offset in range(0, len(documents), batch_size):
+        chunk = documents[offset:offset + batch_size]
+        failed = set()
+        try:
+            inserted += len(collection.insert_many(chunk, ordered=False).inserted_ids)
+        except BulkWriteError as exc:
+            inserted += exc.details["nInserted"]
+            for error in exc.details["writeErrors"]:
+                failed.add(error["index"])
+                errors.append({"index": offset + error["index"], "errors": {"non_field_errors": error["errmsg"]}})
+        stored = [attack for index, attack in enumerate(chunk) if index not in failed]
+        record_attacks(stored)
+        record_flows(stored)
+        record_sketches(stored)
+
+    if inserted:
+        bump_data_version()
+
+    return inserted, errors
@@ -0,0 +1,53 @@
+import time
+from contextvars import ContextVar
+from pymongo import monitoring
+
+
+class RequestStats:
+    """MongoDB and rendering cost of one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.commands = 0
+        self.mongo_seconds = 0.0
+        self.documents = 0
+        self.serialization_seconds = 0.0
+
+
+# Stats of the request running in this context, if any
+current_stats = ContextVar("current_stats", default=None)
+
+
+def returned_documents(reply):
+    cursor = reply.get("cursor") if isinstance(reply, dict) else None
+    if not cursor:
+        return 0
+    return len(cursor.get("firstBatch") or cursor.get("nextBatch") or ())
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Adds every command's duration and returned documents to the current request's stats.
+
+    Events fire on the thread or task that issued the command, so the
+    context variable set by the middleware is visible here.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        stats = current_stats.get()
+        if stats is not None:
+            stats.commands += 1
+            stats.mongo_seconds += event.duration_micros / 1e6
+            stats.documents += returned_documents(event.reply)
+
+    def failed(self, event):
+        stats = current_stats.get()
+        if stats is not None:
+            stats.commands += 1
+            stats.mongo_seconds += event.duration_micros / 1e6
+
+
+# Passed to every MongoClient the project opens
+COMMAND_LISTENER = MongoCommandListener()
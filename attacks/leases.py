@@ -0,0 +1,202 @@
+import math
+import random
+import signal
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+from django.core.management.base import OutputWrapper
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from attacks.metrics import REGISTRY
+from attacks.models import NotificationRule, RuleLease, WorkerHeartbeat
+from attacks.rules import RuleEvaluator
+
+
+class LeaseLost(Exception):
+    """Another worker took over a partition while it was being evaluated."""
+
+
+def partition_of(rule, partitions):
+    # Stable across processes, unlike hash()
+    return zlib.crc32(str(rule.id).encode()) % partitions
+
+
+class LeaseCoordinator:
+    """Splits rule partitions between live workers with expiring leases in MongoDB.
+
+    Every worker heartbeats, counts the live workers and aims for its fair
+    share of partitions. It renews the leases it holds, gives back any above
+    its share, and claims free or expired ones with an atomic
+    find_one_and_update. A worker that dies stops renewing; its leases expire
+    and the survivors pick them up on their next round.
+    """
+
+    def __init__(self, worker_id, partitions, lease_seconds=30):
+        self.worker_id = worker_id
+        self.partitions = partitions
+        self.lease = timedelta(seconds=lease_seconds)
+        self.leases = RuleLease._get_collection()
+        self.heartbeats = WorkerHeartbeat._get_collection()
+
+    def heartbeat(self, now):
+        self.heartbeats.update_one(
+            {"worker_id": self.worker_id},
+            {"$set": {"expires_at": now + self.lease}},
+            upsert=True,
+        )
+
+    def fair_share(self, now):
+        live = self.heartbeats.count_documents({"expires_at": {"$gt": now}})
+        return math.ceil(self.partitions / max(live, 1))
+
+    def owned(self, now):
+        return sorted(
+            lease["_id"] for lease in self.leases.find(
+                {"owner": self.worker_id, "expires_at": {"$gt": now}}, {"_id": 1}
+            )
+        )
+
+    def claim(self, partition, now):
+        try:
+            lease = self.leases.find_one_and_update(
+                {
+                    "_id": partition,
+                    "$or": [
+                        {"owner": self.worker_id},
+                        {"owner": None},
+                        {"expires_at": {"$lte": now}},
+                    ]
+                },
+                {"$set": {"owner": self.worker_id, "expires_at": now + self.lease}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Held by a live worker: the filter missed and the upsert collided
+            return False
+        return lease["owner"] == self.worker_id
+
+    def renew(self, partition):
+        """Extend one held lease; raise LeaseLost if it is no longer ours."""
+        now = datetime.utcnow()
+        renewed = self.leases.update_one(
+            {"_id": partition, "owner": self.worker_id, "expires_at": {"$gt": now}},
+            {"$set": {"expires_at": now + self.lease}},
+        )
+        if not renewed.matched_count:
+            raise LeaseLost(partition)
+
+    def release(self, partitions):
+        self.leases.update_many(
+            {"_id": {"$in": list(partitions)}, "owner": self.worker_id},
+            {"$set": {"owner": None, "expires_at": datetime.utcnow()}},
+        )
+
+    def release_all(self):
+        self.leases.update_many({"owner": self.worker_id}, {"$set": {"owner": None, "expires_at": datetime.utcnow()}})
+        self.heartbeats.delete_one({"worker_id": self.worker_id})
+
+    def rebalance(self):
+        """Renew, shed and claim leases; return the partitions this worker now owns."""
+        now = datetime.utcnow()
+        self.heartbeat(now)
+        share = self.fair_share(now)
+
+        owned = self.owned(now)
+        if len(owned) > share:
+            self.release(owned[share:])
+            owned = owned[:share]
+        self.leases.update_many(
+            {"_id": {"$in": owned}, "owner": self.worker_id},
+            {"$set": {"expires_at": now + self.lease}},
+        )
+
+        free = [partition for partition in range(self.partitions) if partition not in owned]
+        random.shuffle(free)
+        for partition in free:
+            if len(owned) >= share:
+                break
+            if self.claim(partition, now):
+                owned.append(partition)
+        return sorted(owned)
+
+
+class ShardedEvaluator:
+    """Runs RuleEvaluator over only the rule partitions this worker holds leases for.
+
+    Each partition keeps its own high-water mark, so a partition that moves
+    to another worker carries on from where it stopped.
+    """
+
+    def __init__(self, worker_id, partitions, lease_seconds=30, log=None, metrics_file=None):
+        self.coordinator = LeaseCoordinator(worker_id, partitions, lease_seconds)
+        self.partitions = partitions
+        self.metrics_file = metrics_file
+        self.log = log or (lambda message: None)
+        self.created = 0
+        self.stopping = False
+
+    def run_once(self):
+        owned = self.coordinator.rebalance()
+        self.log(f"Worker {self.coordinator.worker_id} owns partitions {owned}")
+
+        rules = list(NotificationRule.objects(active=True))
+        for partition in owned:
+            if self.stopping:
+                break
+            # Renew before each partition, and skip any handed to a newer worker
+            if partition not in self.coordinator.rebalance():
+                continue
+            subset = [rule for rule in rules if partition_of(rule, self.partitions) == partition]
+            evaluator = RuleEvaluator(
+                name=f"evaluate_rules:{partition}", log=self.log, worker=self.coordinator.worker_id,
+                keep_alive=self.keep_alive(partition),
+            )
+            try:
+                self.created += evaluator.run(rules=subset)
+            except LeaseLost:
+                # Its new owner carries on from the last saved high-water mark
+                self.log(f"Lost the lease on partition {partition}; stopped evaluating it")
+        if self.metrics_file:
+            REGISTRY.write(self.metrics_file)
+        return self.created
+
+    def keep_alive(self, partition):
+        """Renewal callback for a long evaluation, so the lease cannot lapse halfway through."""
+        renewed = time.monotonic()
+
+        def renew():
+            nonlocal renewed
+            # A third of the lease, so a slow batch still renews in time
+            if time.monotonic() - renewed >= self.coordinator.lease.total_seconds() / 3:
+                self.coordinator.renew(partition)
+                renewed = time.monotonic()
+
+        return renew
+
+    def run_forever(self, interval):
+        def stop(signum, frame):
+            self.stopping = True
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+        try:
+            while not self.stopping:
+                self.run_once()
+                deadline = time.monotonic() + interval
+                while not self.stopping and time.monotonic() < deadline:
+                    time.sleep(0.1)
+        finally:
+            self.coordinator.release_all()
+        return self.created
+
+
+def run_worker(worker_id, partitions, lease_seconds, interval, metrics_file=None):
+    """Process-pool entry point: one leased worker per process."""
+    import django
+    django.setup()
+
+    # Commands' stdout writer; the parent's self.stdout cannot be passed to a spawned process
+    log = OutputWrapper(sys.stdout).write
+    ShardedEvaluator(worker_id, partitions, lease_seconds, log=log, metrics_file=metrics_file).run_forever(interval)
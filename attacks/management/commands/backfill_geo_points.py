@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from attacks.caching import bump_data_version
+from attacks.models import CyberAttack
+
+LOCATIONS = ("source_location", "destination_location")
+
+
+def set_point(location):
+    # Server-side update: copy the float coordinates into a GeoJSON point
+    return [{
+        "$set": {
+            f"{location}.point": {
+                "type": "Point",
+                "coordinates": [f"${location}.longitude", f"${location}.latitude"]
+            }
+        }
+    }]
+
+
+def valid_coordinates(location):
+    # Anything else would fail the 2dsphere index build
+    return {
+        f"{location}.latitude": {"$type": "number", "$gte": -90, "$lte": 90},
+        f"{location}.longitude": {"$type": "number", "$gte": -180, "$lte": 180},
+    }
+
+
+class Command(BaseCommand):
+    help = "Backfill GeoJSON source/destination points on existing attacks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help="Attacks updated per round trip (default: 10000)",
+        )
+
+    def handle(self, *args, **options):
+        collection = CyberAttack._get_collection()
+
+        updated = 0
+        for location in LOCATIONS:
+            missing = {f"{location}.point": {"$exists": False}, **valid_coordinates(location)}
+            while True:
+                ids = [doc["_id"] for doc in collection.find(missing, {"_id": 1}).limit(options['batch_size'])]
+                if not ids:
+                    break
+                updated += collection.update_many({"_id": {"$in": ids}}, set_point(location)).modified_count
+                self.stdout.write(f"Backfilled {updated} points...")
+
+            skipped = collection.count_documents({
+                f"{location}.point": {"$exists": False},
+                "$nor": [valid_coordinates(location)],
+            })
+            if skipped:
+                self.stdout.write(self.style.WARNING(
+                    f"Skipped {skipped} attacks without a valid {location} latitude / longitude."
+                ))
+        if updated:
+            bump_data_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. {updated} points backfilled. Run `manage.py sync_indexes` to build the 2dsphere indexes."
+        ))
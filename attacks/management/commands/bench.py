@@ -0,0 +1,211 @@
+import asyncio
+import io
+import json
+import random
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+from attacks.benchmarks import (
+    anchor_time, async_path, attack_batches, bench_database, compare, endpoint_cases, measure, measure_async,
+    parse_size, rule_throughput, synthetic_attack, synthetic_rules,
+)
+from attacks.ingest import batch_size_setting, insert_attacks
+from attacks.models import CyberAttack
+
+BULK_BATCH = 1000
+
+BENCH_SUFFIX = "_bench"
+
+# Marks the attacks posted by the bulk benchmark, which are removed afterwards
+BULK_DESCRIPTION = "Synthetic benchmark bulk attack"
+
+# Bulk attacks all fall in the hour after the anchor, so only that hour's
+# rollups, and its day's flow summaries and sketches, need rebuilding after
+BULK_SPAN = timedelta(hours=1)
+
+
+def api_attack(document):
+    """A seeded attack as the bulk endpoint accepts it."""
+    fields = ("latitude", "longitude", "country")
+    return {
+        **document,
+        "additional_details": {**document["additional_details"], "description": BULK_DESCRIPTION},
+        "source_location": {key: document["source_location"][key] for key in fields},
+        "destination_location": {key: document["destination_location"][key] for key in fields},
+        "timestamp": document["timestamp"].isoformat(),
+    }
+
+
+class Command(BaseCommand):
+    help = "Seed a benchmark database and measure API latency and rule evaluation throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            type=parse_size,
+            default=parse_size("10k"),
+            help="Attacks to seed: 10k, 1m, 10m or a number (default: 10k)",
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help="Seed of the generated attacks and rules (default: 42)",
+        )
+        parser.add_argument(
+            '--db',
+            help="Database to seed and measure, named *_bench; it is dropped first (default: <MONGODB db>_bench)",
+        )
+        parser.add_argument(
+            '--reuse',
+            action='store_true',
+            help="Keep the database if it already holds --size attacks instead of seeding it again",
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help="Timed requests per endpoint case (default: 20)",
+        )
+        parser.add_argument(
+            '--rules',
+            default="10,100,1000",
+            help="Comma-separated rule counts for evaluate_rules throughput, or 'none' (default: 10,100,1000)",
+        )
+        parser.add_argument(
+            '--output',
+            help="JSON results file (default: bench-<size>.json)",
+        )
+        parser.add_argument(
+            '--compare',
+            metavar='PATH',
+            help="Earlier results file to print p95 changes against",
+        )
+
+    def handle(self, *args, **options):
+        size, seed = options['size'], options['seed']
+        if options['repeat'] < 2:
+            raise CommandError("--repeat must be at least 2.")
+        rule_counts = [] if options['rules'] == 'none' else [int(count) for count in options['rules'].split(',')]
+        database = options['db'] or f"{settings.MONGODB['db']}_bench"
+        # Seeding drops the database: never the configured one, nor anything not named for benchmarks
+        if database == settings.MONGODB['db'] or not database.endswith(BENCH_SUFFIX):
+            raise CommandError(f"--db must name a benchmark database ending in '{BENCH_SUFFIX}', got '{database}'.")
+
+        with bench_database(database):
+            anchor = self.seed(database, size, seed, options['reuse'])
+            results = {
+                "size": size,
+                "seed": seed,
+                "database": database,
+                "created_at": datetime.utcnow().isoformat() + "Z",
+                "rules": [],
+                "endpoints": [],
+            }
+
+            # Rules first, so the notification log endpoint has something to list
+            for count in rule_counts:
+                result = rule_throughput(synthetic_rules(count, seed))
+                self.stdout.write(
+                    f"evaluate_rules, {count} rules: {result['attacks_per_second']} attacks/s, "
+                    f"{result['notifications']} notifications"
+                )
+                results["rules"].append(result)
+
+            for name, path in endpoint_cases(anchor):
+                self.record(results, name, "GET", path, self.measure_get(path, options['repeat']))
+            asyncio.run(self.measure_async_endpoints(results, anchor, options['repeat']))
+            self.record(results, f"bulk: {BULK_BATCH} attacks", "POST", "/api/attacks/bulk/",
+                        self.measure_bulk(seed, anchor, options['repeat']))
+
+        output = options['output'] or f"bench-{size}.json"
+        with open(output, "w") as handle:
+            json.dump(results, handle, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+        if options['compare']:
+            with open(options['compare']) as handle:
+                baseline = json.load(handle)
+            for name, before, after in compare(results, baseline):
+                self.stdout.write(f"{name:45} p95 {before:10.2f} -> {after:10.2f} ms ({after / before:.2f}x)")
+
+    def seed(self, database, size, seed, reuse):
+        collection = CyberAttack._get_collection()
+        if reuse and collection.estimated_document_count() == size:
+            self.stdout.write(f"Reusing {size} attacks in '{database}'")
+            newest = collection.find_one({}, {"timestamp": 1}, sort=[("timestamp", -1)])
+            return newest["timestamp"].replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+        collection.database.client.drop_database(database)
+        anchor = anchor_time()
+        batch_size = batch_size_setting()
+        seeded = 0
+        for batch in attack_batches(size, seed, anchor, batch_size):
+            seeded += insert_attacks(batch, batch_size)[0]
+            if seeded % 100_000 < batch_size:
+                self.stdout.write(f"Seeded {seeded}/{size} attacks")
+        # Indexes are built once the data is in, as on a production collection
+        call_command("sync_indexes", stdout=io.StringIO())
+        return anchor
+
+    def record(self, results, name, method, path, measured):
+        results["endpoints"].append({"name": name, "method": method, "path": path, **measured})
+        self.stdout.write(
+            f"{name:45} p50 {measured['p50_ms']:9.2f}  p95 {measured['p95_ms']:9.2f}  "
+            f"p99 {measured['p99_ms']:9.2f} ms  peak {measured['peak_memory_kb']:10.1f} KiB"
+        )
+
+    def measure_get(self, path, repeat):
+        client = Client()
+
+        def call():
+            response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f"GET {path} returned {response.status_code}")
+            # Streamed bodies are produced while iterating
+            if response.streaming:
+                b"".join(response.streaming_content)
+
+        return measure(call, repeat)
+
+    async def measure_async_endpoints(self, results, anchor, repeat):
+        client = AsyncClient()
+        for name, path in endpoint_cases(anchor):
+            path = async_path(path)
+            if path is None:
+                continue
+
+            async def call(path=path):
+                response = await client.get(path)
+                if response.status_code != 200:
+                    raise CommandError(f"GET {path} returned {response.status_code}")
+
+            self.record(results, f"async {name}", "GET", path, await measure_async(call, repeat))
+
+    def measure_bulk(self, seed, anchor, repeat):
+        client = Client()
+        rng = random.Random(seed + 1)
+        # Bodies are built up front so only the request is timed (warm-up + timed + memory run)
+        bodies = iter([
+            json.dumps([api_attack(self.bulk_attack(rng, anchor)) for _ in range(BULK_BATCH)])
+            for _ in range(repeat + 2)
+        ])
+
+        def call():
+            response = client.post("/api/attacks/bulk/", next(bodies), content_type="application/json")
+            if response.status_code != 201:
+                raise CommandError(f"POST /api/attacks/bulk/ returned {response.status_code}")
+
+        try:
+            return measure(call, repeat)
+        finally:
+            # Keep the seeded set, and everything ingest derived from it, as it was for --reuse
+            CyberAttack._get_collection().delete_many({"additional_details.description": BULK_DESCRIPTION})
+            call_command("rebuild_rollups", start=anchor, end=anchor + BULK_SPAN, stdout=io.StringIO())
+
+    def bulk_attack(self, rng, anchor):
+        attack = synthetic_attack(rng, anchor)
+        attack["timestamp"] = anchor + timedelta(seconds=rng.randrange(int(BULK_SPAN.total_seconds())))
+        return attack
@@ -0,0 +1,71 @@
+import time
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from attacks.ingest import location_document
+from attacks.models import CyberAttack
+from attacks.renderers import FastJSONRenderer
+from attacks.serializers import CyberAttackSerializer
+from attacks.transforms import attack_record
+
+
+def sample_documents(count):
+    """Raw attack documents as the list endpoints read them, without touching MongoDB."""
+    start = datetime(2025, 1, 1)
+    return [{
+        "source_location": location_document(40.7128 + i % 7, -74.006 - i % 11, "USA"),
+        "destination_location": location_document(48.8566 - i % 5, 2.3522 + i % 13, "France"),
+        "attack_type": ("DDoS", "Malware", "Phishing")[i % 3],
+        "severity": i % 10 + 1,
+        "timestamp": start + timedelta(seconds=i, microseconds=i % 1000 * 1000),
+        "additional_details": {"ip_src": f"192.0.2.{i % 256}", "ip_dst": f"198.51.100.{i % 256}",
+                               "description": "Attack – näive payload"},
+    } for i in range(count)]
+
+
+class Command(BaseCommand):
+    help = "Compare the per-row cost of the Serializer and raw-document response paths"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=1000,
+            help="Attacks per response (default: 1000)",
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help="Timed runs per path; the fastest counts (default: 5)",
+        )
+
+    def timed(self, function, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            output = function()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        documents = sample_documents(rows)
+
+        def serializer_path():
+            # What the views did before: hydrate Documents, Serializer, JSONRenderer
+            attacks = [CyberAttack._from_son(document) for document in documents]
+            return JSONRenderer().render({"results": CyberAttackSerializer(attacks, many=True).data})
+
+        def fast_path():
+            return FastJSONRenderer().render({"results": [attack_record(document) for document in documents]})
+
+        before, expected = self.timed(serializer_path, options['repeat'])
+        after, output = self.timed(fast_path, options['repeat'])
+        if output != expected:
+            raise CommandError("Raw-document path does not render the same bytes as the Serializer path")
+
+        self.stdout.write(f"Serializer path: {before / rows * 1e6:.2f} µs/row")
+        self.stdout.write(f"Raw path:        {after / rows * 1e6:.2f} µs/row")
+        self.stdout.write(self.style.SUCCESS(f"Identical output, {before / after:.1f}x faster."))
@@ -0,0 +1,100 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import CollectionInvalid
+from attacks.caching import bump_data_version
+from attacks.models import CyberAttack
+
+
+# What stops working on a time-series attack collection
+LIMITATIONS = (
+    "no change streams: run_rule_engine and /api/attacks/stream/ fall back to polling; "
+    "no _id index: the _id high-water queries of evaluate_rules, run_rule_engine and the live feed scan the "
+    "whole collection; "
+    "restricted updates and deletes: backfill_geo_points and the bench bulk cleanup need MongoDB 7.0+ and may fail"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the attack collection into a MongoDB time-series collection (timeField=timestamp). "
+        f"Requires --force, because it has {LIMITATIONS}."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--granularity',
+            choices=['seconds', 'minutes', 'hours'],
+            default='seconds',
+            help="Time-series bucketing granularity, the typical gap between attacks of one type (default: seconds)",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help="Attacks copied per round trip (default: 10000)",
+        )
+        parser.add_argument(
+            '--drop-backup',
+            action='store_true',
+            help="Drop the original collection once every attack is copied",
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help="Convert despite the limitations in the description above",
+        )
+
+    def handle(self, *args, **options):
+        if not options['force']:
+            raise CommandError(
+                f"A time-series attack collection has {LIMITATIONS}. Pass --force to convert anyway."
+            )
+        collection = CyberAttack._get_collection()
+        database, name = collection.database, collection.name
+
+        info = next(database.list_collections(filter={"name": name}), None)
+        if info and info["type"] == "timeseries":
+            self.stdout.write(f"'{name}' is already a time-series collection.")
+            return
+
+        backup_name = f"{name}_backup_{datetime.utcnow():%Y%m%d%H%M%S}"
+        if info:
+            collection.rename(backup_name)
+        try:
+            # attack_type is the metaField: documents keep their shape and
+            # attacks of one type share buckets
+            database.create_collection(name, timeseries={
+                "timeField": "timestamp",
+                "metaField": "attack_type",
+                "granularity": options['granularity'],
+            })
+        except CollectionInvalid:
+            raise CommandError(
+                f"'{name}' was recreated while migrating; stop writers, move it aside and "
+                f"rename '{backup_name}' back before retrying."
+            )
+        self.stdout.write(f"Created time-series collection '{name}'")
+
+        copied = 0
+        if info:
+            backup = database[backup_name]
+            batch = []
+            for attack in backup.find().sort("_id", 1).batch_size(options['batch_size']):
+                batch.append(attack)
+                if len(batch) >= options['batch_size']:
+                    copied += len(collection.insert_many(batch, ordered=False).inserted_ids)
+                    batch = []
+                    self.stdout.write(f"Copied {copied} attacks...")
+            if batch:
+                copied += len(collection.insert_many(batch, ordered=False).inserted_ids)
+
+            if options['drop_backup']:
+                backup.drop()
+            else:
+                self.stdout.write(f"Original attacks kept in '{backup_name}'")
+
+        bump_data_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. {copied} attacks copied. Run `manage.py sync_indexes` to rebuild the secondary indexes."
+        ))
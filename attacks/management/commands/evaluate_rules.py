@@ -1,91 +1,186 @@
-from django.core.management.base import BaseCommand
-from attacks.models import CyberAttack, NotificationRule, Notification
+import multiprocessing
+import os
+import signal
+import socket
+from datetime import datetime
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from attacks.backtest import backtest, replay_range
+from attacks.leases import ShardedEvaluator, run_worker
+from attacks.metrics import REGISTRY
+from attacks.models import NotificationRule
+from attacks.queries import as_utc
+from attacks.rules import RuleEvaluator
 
 class Command(BaseCommand):
-    help = "Evaluate notification rules against attack data"
+    help = "Evaluate notification rules against attacks added since the last run"
 
-from django.core.management.base import BaseCommand
-from attacks.models import CyberAttack, NotificationRule, Notification
-from datetime import datetime, timedelta
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help="Forget the high-water mark and re-scan every attack",
+        )
+        parser.add_argument(
+            '--partitions',
+            type=int,
+            default=0,
+            help="Split active rules into this many leased partitions shared by all workers (default: off)",
+        )
+        parser.add_argument(
+            '--worker-id',
+            default=f"{socket.gethostname()}:{os.getpid()}",
+            help="Unique name of this worker when partitioned (default: host:pid)",
+        )
+        parser.add_argument(
+            '--lease-seconds',
+            type=int,
+            default=30,
+            help="How long a partition lease lasts without renewal (default: 30)",
+        )
+        parser.add_argument(
+            '--loop',
+            type=float,
+            metavar='SECONDS',
+            help="Keep evaluating every SECONDS until interrupted (partitioned mode)",
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help="Run this many local leased workers in separate processes (implies --loop)",
+        )
+        parser.add_argument(
+            '--metrics-file',
+            metavar='PATH',
+            help="Write per-rule timings and match counts here in the Prometheus text format after each run",
+        )
+        parser.add_argument(
+            '--backtest',
+            action='store_true',
+            help="Replay past attacks against the rules, active or not, and report when each would have fired; "
+                 "writes nothing",
+        )
+        parser.add_argument(
+            '--start',
+            type=datetime.fromisoformat,
+            help="Backtest from this ISO 8601 time (default: a week before --end)",
+        )
+        parser.add_argument(
+            '--end',
+            type=datetime.fromisoformat,
+            help="Backtest up to this ISO 8601 time, inclusive (default: now)",
+        )
+        parser.add_argument(
+            '--rule',
+            action='append',
+            help="Only backtest the rule with this name (repeatable; default: all)",
+        )
+        parser.add_argument(
+            '--timestamps',
+            type=int,
+            default=10,
+            help="Trigger times listed per rule in a backtest (default: 10)",
+        )
 
-class Command(BaseCommand):
-    help = "Evaluate notification rules against attack data"
+    def handle(self, *args, **options):
+        partitioned = options['partitions'] > 0
+        if options['processes'] > 1 and not partitioned:
+            raise CommandError("--processes needs --partitions")
+        if options['loop'] and not partitioned:
+            raise CommandError("--loop needs --partitions")
+        if options['full'] and partitioned:
+            raise CommandError("--full cannot be combined with --partitions")
+        if options['backtest'] and (partitioned or options['full']):
+            raise CommandError("--backtest cannot be combined with --partitions or --full")
+
+        if options['backtest']:
+            return self.handle_backtest(options)
+        if partitioned:
+            return self.handle_partitioned(options)
+
+        evaluator = RuleEvaluator(log=self.stdout.write)
+        total_matched = evaluator.run(full=options['full'])
+        if options['metrics_file']:
+            REGISTRY.write(options['metrics_file'])
 
-    def handle(self, *args, **kwargs):
-        rules = NotificationRule.objects(active=True)
-        total_matched = 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Total new notifications created: {total_matched} "
+            f"({evaluator.notifications.existing} already present)"
+        ))
 
-        for rule in rules:
-            # Cooldown check
-            if rule.last_triggered_at:
-                cooldown_end = rule.last_triggered_at + timedelta(minutes=rule.cooldown_minutes or 10)
-                if datetime.utcnow() < cooldown_end:
-                    self.stdout.write(f"Skipping '{rule.name}' (cooldown active)")
-                    continue
+    def handle_partitioned(self, options):
+        partitions, lease_seconds = options['partitions'], options['lease_seconds']
 
-            # Build base query
-            query = CyberAttack.objects
-            if rule.attack_type:
-                query = query.filter(attack_type=rule.attack_type)
-            if rule.country:
-                query = query.filter(__raw__={
-                    "$or": [
-                        {"source_location.country": rule.country},
-                        {"destination_location.country": rule.country}
-                    ]
-                })
-            if rule.min_severity:
-                query = query.filter(severity__gte=rule.min_severity)
-            if rule.max_severity:
-                query = query.filter(severity__lte=rule.max_severity)
-            if rule.time_window_minutes:
-                cutoff = datetime.utcnow() - timedelta(minutes=rule.time_window_minutes)
-                query = query.filter(timestamp__gte=cutoff)
+        if options['processes'] > 1:
+            interval = options['loop'] or 10.0
+            context = multiprocessing.get_context('spawn')
+            workers = [
+                context.Process(
+                    target=run_worker,
+                    args=(f"{options['worker_id']}/{number}", partitions, lease_seconds, interval,
+                          self.worker_metrics_file(options['metrics_file'], number)),
+                )
+                for number in range(options['processes'])
+            ]
+            for worker in workers:
+                worker.start()
 
-            matched_attacks = list(query)
+            def terminate(signum, frame):
+                # systemd / docker stop only signal this process: pass it on, or the
+                # workers outlive it and hold their leases until they expire
+                for worker in workers:
+                    if worker.is_alive():
+                        worker.terminate()
 
-            # Volume-based rule
-            if rule.threshold_count:
-                if len(matched_attacks) >= rule.threshold_count:
-                    Notification(
-                        rule_name=rule.name,
-                        attack_id="(volume_trigger)",
-                        triggered_at=datetime.utcnow(),
-                        details={
-                            "matched_count": len(matched_attacks),
-                            "rule": rule.name
-                        }
-                    ).save()
-                    rule.last_triggered_at = datetime.utcnow()
-                    rule.save()
-                    total_matched += 1
-                    self.stdout.write(self.style.SUCCESS(
-                        f"Rule '{rule.name}' triggered by volume: {len(matched_attacks)} attacks"
-                    ))
-            else:
-                # Default: trigger per matching attack
-                for attack in matched_attacks:
-                    already = Notification.objects(rule_name=rule.name, attack_id=str(attack.id)).first()
-                    if not already:
-                        Notification(
-                            rule_name=rule.name,
-                            attack_id=str(attack.id),
-                            triggered_at=datetime.utcnow(),
-                            details={
-                                "attack_type": attack.attack_type,
-                                "severity": attack.severity,
-                                "country_src": attack.source_location.country,
-                                "country_dst": attack.destination_location.country,
-                                "timestamp": str(attack.timestamp)
-                            }
-                        ).save()
-                        total_matched += 1
-                        self.stdout.write(self.style.SUCCESS(
-                            f"Rule '{rule.name}' triggered by attack {attack.id}"
-                        ))
+            # Ctrl-C reaches the workers directly; they release their leases and exit
+            previous = signal.signal(signal.SIGINT, signal.SIG_IGN), signal.signal(signal.SIGTERM, terminate)
+            try:
+                for worker in workers:
+                    worker.join()
+            finally:
+                signal.signal(signal.SIGINT, previous[0])
+                signal.signal(signal.SIGTERM, previous[1])
+            self.stdout.write(self.style.SUCCESS(f"Done. {len(workers)} workers stopped."))
+            return
+
+        evaluator = ShardedEvaluator(
+            options['worker_id'], partitions, lease_seconds, log=self.stdout.write, metrics_file=options['metrics_file']
+        )
+        if options['loop']:
+            total_matched = evaluator.run_forever(options['loop'])
+        else:
+            try:
+                total_matched = evaluator.run_once()
+            finally:
+                evaluator.coordinator.release_all()
 
         self.stdout.write(self.style.SUCCESS(
             f"Done. Total new notifications created: {total_matched}"
         ))
 
+    def handle_backtest(self, options):
+        if options['start'] and options['end'] and as_utc(options['start']) > as_utc(options['end']):
+            raise CommandError("--start must not be after --end")
+        start, end = replay_range(options['start'], options['end'])
+        rules = NotificationRule.objects()
+        if options['rule']:
+            rules = rules.filter(name__in=options['rule'])
+
+        replayed, results = backtest(list(rules), start, end, options['timestamps'])
+        for result in results:
+            self.stdout.write(f"{result['rule']}: {result['triggers']} triggers")
+            for timestamp in result['timestamps']:
+                self.stdout.write(f"  {timestamp.isoformat()}")
+            if result['triggers'] > len(result['timestamps']):
+                self.stdout.write(f"  ... {result['triggers'] - len(result['timestamps'])} more")
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Backtested {len(results)} rules on {replayed} attacks from {start.isoformat()} to {end.isoformat()}"
+        ))
 
+    def worker_metrics_file(self, path, number):
+        # One file per process; the textfile collector merges them
+        if not path:
+            return None
+        path = Path(path)
+        return str(path.with_name(f"{path.stem}-{number}{path.suffix}"))
@@ -1,45 +1,64 @@
-from django.core.management.base import BaseCommand
-from attacks.models import CyberAttack, Location
+from django.core.management.base import BaseCommand, CommandError
+from attacks.ingest import batch_size_setting, insert_attacks, location_document
 from faker import Faker
 import random
-from datetime import datetime
 
 fake = Faker()
 
 class Command(BaseCommand):
     help = 'Generate realistic cyber attack data using Faker'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=100,
+            help="Number of attacks to generate (default: 100)",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help="Attacks written per insert_many round trip (default: ATTACK_BULK_BATCH_SIZE)",
+        )
+
+    def handle(self, *args, **options):
         attack_types = ['DDoS', 'Malware', 'Phishing', 'Ransomware', 'Zero-Day', 'SQL Injection']
+        count = options['count']
+        batch_size = options['batch_size']
+        if batch_size is None:
+            batch_size = batch_size_setting()
+        elif batch_size < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        generated = inserted_total = 0
+        while generated < count:
+            batch = []
+            for _ in range(min(batch_size, count - generated)):
+                src_coords = fake.location_on_land(coords_only=True)
+                dst_coords = fake.location_on_land(coords_only=True)
+
+                batch.append({
+                    "source_location": location_document(
+                        float(src_coords[0]), float(src_coords[1]), fake.country()
+                    ),
+                    "destination_location": location_document(
+                        float(dst_coords[0]), float(dst_coords[1]), fake.country()
+                    ),
+                    "attack_type": random.choice(attack_types),
+                    "severity": random.randint(1, 10),
+                    "timestamp": fake.date_time_this_year(),
+                    "additional_details": {
+                        "ip_src": fake.ipv4_public(),
+                        "ip_dst": fake.ipv4_public(),
+                        "description": fake.sentence()
+                    }
+                })
+
+            inserted, errors = insert_attacks(batch, batch_size)
+            generated += len(batch)
+            inserted_total += inserted
+            for error in errors:
+                self.stderr.write(f"Attack {error['index']} failed: {error['errors']}")
 
-        for _ in range(100):
-            src_coords = fake.location_on_land(coords_only=True)
-            dst_coords = fake.location_on_land(coords_only=True)
-
-            src = Location(
-                latitude=float(src_coords[0]),
-                longitude=float(src_coords[1]),
-                country=fake.country()
-            )
-            dst = Location(
-                latitude=float(dst_coords[0]),
-                longitude=float(dst_coords[1]),
-                country=fake.country()
-            )
-
-            attack = CyberAttack(
-                source_location=src,
-                destination_location=dst,
-                attack_type=random.choice(attack_types),
-                severity=random.randint(1, 10),
-                timestamp=fake.date_time_this_year(),
-                additional_details={
-                    "ip_src": fake.ipv4_public(),
-                    "ip_dst": fake.ipv4_public(),
-                    "description": fake.sentence()
-                }
-            )
-
-            attack.save()
-
-        self.stdout.write(self.style.SUCCESS("100 realistic attack records generated."))
+        self.stdout.write(self.style.SUCCESS(f"{inserted_total} realistic attack records generated."))
@@ -0,0 +1,61 @@
+import asyncio
+import signal
+from django.core.management.base import BaseCommand
+from attacks.engine import RuleEngine
+from attacks.mongo import async_client, async_database
+
+class Command(BaseCommand):
+    help = "Evaluate notification rules continuously as attacks are inserted"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--name',
+            default='run_rule_engine',
+            help="Checkpoint name; give each independent engine its own (default: run_rule_engine)",
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help="Seconds between polls when change streams are unavailable (default: 1)",
+        )
+        parser.add_argument(
+            '--reload-interval',
+            type=float,
+            default=10.0,
+            help="Seconds between rule reloads when change streams are unavailable (default: 10)",
+        )
+        parser.add_argument(
+            '--checkpoint-interval',
+            type=float,
+            default=5.0,
+            help="Seconds between checkpoints of the stream position (default: 5)",
+        )
+
+    def handle(self, *args, **options):
+        asyncio.run(self.serve(options))
+
+    async def serve(self, options):
+        client = async_client()
+        engine = RuleEngine(
+            async_database(client),
+            name=options['name'],
+            poll_interval=options['poll_interval'],
+            reload_interval=options['reload_interval'],
+            checkpoint_interval=options['checkpoint_interval'],
+            log=self.stdout.write,
+        )
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, engine.stop)
+
+        try:
+            await engine.run()
+        finally:
+            await client.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Stopped. Notifications created: {engine.notifications.inserted} "
+            f"({engine.notifications.existing} already present)"
+        ))
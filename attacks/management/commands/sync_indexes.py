@@ -0,0 +1,158 @@
+from datetime import datetime
+from bson import ObjectId
+from django.core.management.base import BaseCommand
+from attacks.models import (
+    VOLUME_TRIGGER_ID, AttackRollup, CyberAttack, FlowSummary, IPSketch, NotificationRule, Notification,
+    RuleLease, WorkerHeartbeat, notification_retention_seconds,
+)
+
+# Representative query shapes issued by the API views and evaluate_rules
+QUERY_SHAPES = [
+    (CyberAttack, "recent attacks", {}, [("timestamp", -1)]),
+    (CyberAttack, "cursor page", {
+        "timestamp": {"$lte": datetime(2025, 1, 1)},
+        "$or": [
+            {"timestamp": {"$lt": datetime(2025, 1, 1)}},
+            {"timestamp": datetime(2025, 1, 1), "_id": {"$lt": ObjectId("0" * 24)}}
+        ]
+    }, [("timestamp", -1), ("_id", -1)]),
+    (CyberAttack, "filter by attack_type", {"attack_type": "DDoS"}, [("timestamp", -1)]),
+    (CyberAttack, "filter by country", {
+        "$or": [
+            {"source_location.country": "USA"},
+            {"destination_location.country": "USA"}
+        ]
+    }, [("timestamp", -1)]),
+    (CyberAttack, "filter by severity", {"severity": {"$gte": 7}}, [("timestamp", -1)]),
+    (Notification, "notification lookup", {"rule_name": "rule", "attack_id": "0" * 24}, None),
+    (Notification, "notification log by rule", {"rule_name": "rule"}, [("triggered_at", -1), ("_id", -1)]),
+    (AttackRollup, "hourly rollups", {"granularity": "hour", "bucket": {"$gte": datetime(2025, 1, 1)}}, None),
+    (FlowSummary, "daily flow summaries", {"granularity": "day", "bucket": {"$gte": datetime(2025, 1, 1)}}, None),
+    (IPSketch, "distinct IP sketches", {
+        "granularity": "day", "field": "ip_src", "country": "Germany", "attack_type": "DDoS",
+        "bucket": {"$gte": datetime(2025, 1, 1)},
+    }, None),
+]
+
+
+def plan_stages(plan):
+    plan = plan.get("queryPlan", plan)
+    stages = [plan.get("stage")]
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            stages.extend(plan_stages(child))
+    return stages
+
+
+class Command(BaseCommand):
+    help = "Build the declared MongoDB indexes in the background and report unused or missing ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Only report, do not build missing indexes",
+        )
+
+    def handle(self, *args, **options):
+        # Before ensure_indexes, which would fail with IndexOptionsConflict on a TTL index with the old period
+        self.sync_retention(options['dry_run'])
+        # Before the unique (rule_name, attack_id) index, which cannot be built over duplicates
+        self.dedupe_notifications(options['dry_run'])
+
+        documents = (
+            CyberAttack, NotificationRule, Notification, RuleLease, WorkerHeartbeat, AttackRollup, FlowSummary, IPSketch,
+        )
+        for document in documents:
+            collection = document._get_collection()
+            self.stdout.write(f"Collection '{collection.name}':")
+
+            missing = document.compare_indexes()["missing"]
+            for keys in missing:
+                self.stdout.write(self.style.WARNING(f"  missing index {keys}"))
+            if missing and not options['dry_run']:
+                document.ensure_indexes()
+                self.stdout.write(self.style.SUCCESS(f"  built {len(missing)} index(es)"))
+
+            for keys in document.compare_indexes()["extra"]:
+                self.stdout.write(f"  undeclared index {keys}")
+
+            for stats in collection.aggregate([{"$indexStats": {}}]):
+                if stats["name"] != "_id_" and stats["accesses"]["ops"] == 0:
+                    self.stdout.write(self.style.WARNING(
+                        f"  unused index '{stats['name']}' (no accesses since {stats['accesses']['since']})"
+                    ))
+
+        # Query shapes that would still fall back to a collection scan
+        for document, label, query, sort in QUERY_SHAPES:
+            cursor = document._get_collection().find(query).limit(20)
+            if sort:
+                cursor = cursor.sort(sort)
+            stages = plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+            if "COLLSCAN" in stages:
+                self.stdout.write(self.style.WARNING(f"Collection scan for '{label}': {' <- '.join(stages)}"))
+            else:
+                self.stdout.write(f"Indexed plan for '{label}': {' <- '.join(stages)}")
+
+        self.stdout.write(self.style.SUCCESS("Index sync complete."))
+
+    def sync_retention(self, dry_run):
+        # An index's TTL cannot be changed by creating it again: update it in place, or drop it to keep everything
+        seconds = notification_retention_seconds()
+        collection = Notification._get_collection()
+        for index in collection.list_indexes():
+            if "expireAfterSeconds" not in index or index["expireAfterSeconds"] == seconds:
+                continue
+            if seconds is None:
+                self.stdout.write(self.style.WARNING(
+                    f"Notification retention is {index['expireAfterSeconds']}s, configured to keep notifications"
+                ))
+                if not dry_run:
+                    collection.drop_index(index["name"])
+                    self.stdout.write(self.style.SUCCESS("  dropped the TTL index"))
+                continue
+            self.stdout.write(self.style.WARNING(
+                f"Notification retention is {index['expireAfterSeconds']}s, configured {seconds}s"
+            ))
+            if not dry_run:
+                collection.database.command(
+                    "collMod", collection.name, index={"keyPattern": index["key"], "expireAfterSeconds": seconds}
+                )
+                self.stdout.write(self.style.SUCCESS("  updated the TTL index"))
+
+    def dedupe_notifications(self, dry_run):
+        # Re-runs of the evaluator before the unique index wrote the same notification again; keep the oldest
+        collection = Notification._get_collection()
+        keys = [("rule_name", 1), ("attack_id", 1)]
+        if any(list(index["key"].items()) == keys and index.get("unique") for index in collection.list_indexes()):
+            return
+        duplicates = collection.aggregate([
+            {"$match": {"attack_id": {"$gt": VOLUME_TRIGGER_ID}}},
+            {"$group": {
+                "_id": {"rule_name": "$rule_name", "attack_id": "$attack_id"},
+                "keep": {"$min": "$_id"},
+                "ids": {"$push": "$_id"},
+            }},
+            {"$match": {"ids.1": {"$exists": True}}},
+        ], allowDiskUse=True)
+        pairs = removed = 0
+        extra = []
+        for group in duplicates:
+            pairs += 1
+            extra.extend(_id for _id in group["ids"] if _id != group["keep"])
+            if len(extra) >= 1000 and not dry_run:
+                removed += collection.delete_many({"_id": {"$in": extra}}).deleted_count
+                extra = []
+        if not pairs:
+            return
+        if dry_run:
+            self.stdout.write(self.style.WARNING(
+                f"{pairs} (rule_name, attack_id) pair(s) have {len(extra)} duplicate notification(s); "
+                "the unique index cannot be built until they are removed"
+            ))
+            return
+        if extra:
+            removed += collection.delete_many({"_id": {"$in": extra}}).deleted_count
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {removed} duplicate notification(s) of {pairs} (rule_name, attack_id) pair(s), kept the oldest"
+        ))
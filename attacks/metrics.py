@@ -0,0 +1,146 @@
+import math
+import os
+import threading
+from collections import defaultdict
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000, 100000)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            lines += self.samples()
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        with self.lock:
+            self.values[self.key(labels)] += amount
+
+    def samples(self):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram in the Prometheus text format."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.series.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self.series[key] = (counts, total + value)
+
+    def samples(self):
+        lines = []
+        for key, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        return "".join(line + "\n" for metric in self.metrics for line in metric.exposition())
+
+    def write(self, path):
+        """Write the exposition atomically, for node_exporter's textfile collector."""
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as handle:
+            handle.write(self.render())
+        os.replace(temporary, path)
+
+
+# Metrics of this process, served at /metrics
+REGISTRY = Registry()
+
+REQUEST_SECONDS = Histogram(
+    "attackmap_request_seconds", "Time to produce a response, by URL route.", ["route", "method"])
+MONGO_COMMANDS = Histogram(
+    "attackmap_request_mongo_commands", "MongoDB commands issued per request.", ["route", "method"], COUNT_BUCKETS)
+MONGO_SECONDS = Histogram(
+    "attackmap_request_mongo_seconds", "Time spent in MongoDB commands per request.", ["route", "method"])
+MONGO_DOCUMENTS = Histogram(
+    "attackmap_request_mongo_documents", "Documents returned by MongoDB per request.", ["route", "method"],
+    COUNT_BUCKETS)
+SERIALIZATION_SECONDS = Histogram(
+    "attackmap_request_serialization_seconds", "Time spent rendering the response body per request.",
+    ["route", "method"])
+
+RULE_SECONDS = Histogram(
+    "attackmap_rule_evaluation_seconds", "Time spent evaluating one rule on its own (catch-up or threshold).",
+    ["worker", "rule"])
+RULE_MATCHES = Counter(
+    "attackmap_rule_matches_total", "Attacks matched by a per-attack rule.", ["worker", "rule"])
+RULE_WINDOW_MATCHES = Gauge(
+    "attackmap_rule_window_matches", "Attacks in a threshold rule's window at its last evaluation.",
+    ["worker", "rule"])
+RULE_PASS_SECONDS = Histogram(
+    "attackmap_rule_pass_seconds", "Time of the shared single pass over new attacks.", ["worker"])
@@ -0,0 +1,56 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from attacks.instrumentation import RequestStats, current_stats
+from attacks.metrics import MONGO_COMMANDS, MONGO_DOCUMENTS, MONGO_SECONDS, REQUEST_SECONDS, SERIALIZATION_SECONDS
+
+
+class RequestMetricsMiddleware:
+    """Records per-route request, MongoDB and serialization metrics, and the Server-Timing header."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        # Streamed bodies are produced later and only their setup is counted
+        elapsed = time.perf_counter() - stats.started
+        match = getattr(request, "resolver_match", None)
+        labels = {"route": f"/{match.route}" if match else "(unmatched)", "method": request.method}
+
+        REQUEST_SECONDS.observe(elapsed, **labels)
+        MONGO_COMMANDS.observe(stats.commands, **labels)
+        MONGO_SECONDS.observe(stats.mongo_seconds, **labels)
+        MONGO_DOCUMENTS.observe(stats.documents, **labels)
+        SERIALIZATION_SECONDS.observe(stats.serialization_seconds, **labels)
+
+        if getattr(settings, 'ATTACK_SERVER_TIMING', False):
+            response["Server-Timing"] = ", ".join([
+                f'db;dur={stats.mongo_seconds * 1000:.1f};desc="{stats.commands} commands, {stats.documents} documents"',
+                f"serialize;dur={stats.serialization_seconds * 1000:.1f}",
+                f"total;dur={elapsed * 1000:.1f}",
+            ])
+        return response
@@ -1,10 +1,17 @@
 from mongoengine import Document, EmbeddedDocument, fields
 from datetime import datetime
+from django.conf import settings
 
 class Location(EmbeddedDocument):
     latitude = fields.FloatField(required = True)
     longitude = fields.FloatField(required = True)
     country = fields.StringField(required = True)
+    # GeoJSON copy of the coordinates, 2dsphere-indexed for bbox / radius queries
+    point = fields.PointField()
+
+    def clean(self):
+        if self.latitude is not None and self.longitude is not None:
+            self.point = [self.longitude, self.latitude]
 
 class CyberAttack(Document):
     source_location = fields.EmbeddedDocumentField(Location)
@@ -14,6 +21,21 @@ class CyberAttack(Document):
     timestamp = fields.DateTimeField(required = True)
     additional_details = fields.DictField()
 
+    meta = {
+        'indexes': [
+            ('-timestamp', '-id'),
+            ('attack_type', '-timestamp', '-id'),
+            ('source_location.country', '-timestamp', '-id'),
+            ('destination_location.country', '-timestamp', '-id'),
+            ('severity', '-timestamp', '-id'),
+            '(source_location.point',
+            '(destination_location.point',
+        ],
+        # Built by `manage.py sync_indexes` rather than on first access
+        'auto_create_index': False,
+        'index_background': True,
+    }
+
 class NotificationRule(Document):
     name = fields.StringField(required = True)
     attack_type = fields.StringField()
@@ -27,9 +49,141 @@ class NotificationRule(Document):
     cooldown_minutes = fields.IntField(default=10)              
     last_triggered_at = fields.DateTimeField(default=None)      
 
+# attack_id used by volume (threshold) notifications, which are not tied to one attack
+VOLUME_TRIGGER_ID = "(volume_trigger)"
+
+def notification_retention_seconds():
+    days = getattr(settings, 'ATTACK_NOTIFICATION_RETENTION_DAYS', None)
+    return None if days is None else int(days * 86400)
+
 class Notification(Document):
     rule_name = fields.StringField(required = True)
     attack_id = fields.StringField(required = True)
-    triggered_at = fields.DateTimeField(default = datetime.now)
+    triggered_at = fields.DateTimeField(default = datetime.utcnow)
     details = fields.DictField()
 
+    meta = {
+        'indexes': [
+            # One notification per (rule, attack). Volume triggers repeat their
+            # sentinel attack_id, and every real ObjectId sorts after it.
+            {
+                'fields': ('rule_name', 'attack_id'),
+                'unique': True,
+                'partialFilterExpression': {'attack_id': {'$gt': VOLUME_TRIGGER_ID}},
+            },
+            # Log pages, newest first, overall and per rule
+            ('-triggered_at', '-_id'),
+            ('rule_name', '-triggered_at', '-_id'),
+            'attack_id',
+            # Retention: expire notifications once they are older than the configured period
+            *([{'fields': ['triggered_at'], 'expireAfterSeconds': notification_retention_seconds()}]
+              if notification_retention_seconds() is not None else []),
+        ],
+        'auto_create_index': False,
+        'index_background': True,
+    }
+
+class RuleEngineState(Document):
+    # Where incremental rule evaluation stopped, per evaluator
+    name = fields.StringField(required = True, unique = True)
+    last_attack_id = fields.ObjectIdField()
+    last_timestamp = fields.DateTimeField()
+    rule_ids = fields.ListField(fields.StringField())
+    # Change stream position, for evaluators that follow one
+    resume_token = fields.DictField()
+    updated_at = fields.DateTimeField()
+
+class DataVersion(Document):
+    # Version of the attack and rule data shared by every process; cached responses are keyed on it
+    name = fields.StringField(primary_key = True)
+    version = fields.IntField(default = 0)
+
+    meta = {
+        'auto_create_index': False,
+    }
+
+class RuleLease(Document):
+    # Ownership of one partition of the active rules by one evaluate_rules worker
+    partition = fields.IntField(primary_key = True)
+    owner = fields.StringField()
+    expires_at = fields.DateTimeField()
+
+    meta = {
+        'indexes': [
+            {'fields': ['expires_at'], 'expireAfterSeconds': 0},
+        ],
+        'auto_create_index': False,
+        'index_background': True,
+    }
+
+class WorkerHeartbeat(Document):
+    # Live evaluate_rules workers, used to size each worker's share of partitions
+    worker_id = fields.StringField(required = True, unique = True)
+    expires_at = fields.DateTimeField()
+
+    meta = {
+        'indexes': [
+            {'fields': ['expires_at'], 'expireAfterSeconds': 0},
+        ],
+        'auto_create_index': False,
+        'index_background': True,
+    }
+
+class AttackRollup(Document):
+    # Attack counts per minute / hour bucket, kept up to date by ingest
+    granularity = fields.StringField(required = True, choices = ('minute', 'hour'))
+    bucket = fields.DateTimeField(required = True)
+    attack_type = fields.StringField()
+    src_country = fields.StringField()
+    dst_country = fields.StringField()
+    severity = fields.IntField()
+    count = fields.IntField(default = 0)
+
+    meta = {
+        'indexes': [
+            {
+                'fields': ('granularity', 'bucket', 'attack_type', 'src_country', 'dst_country', 'severity'),
+                'unique': True,
+            },
+        ],
+        'auto_create_index': False,
+        'index_background': True,
+    }
+
+class FlowSummary(Document):
+    # Space-Saving summary of the busiest (source, destination, attack type) flows per hour / day
+    granularity = fields.StringField(required = True, choices = ('hour', 'day'))
+    bucket = fields.DateTimeField(required = True)
+    # [{src_country, dst_country, attack_type, count, error}], busiest first
+    counters = fields.ListField(fields.DictField())
+    # Upper bound on the count of any flow not in counters
+    floor = fields.IntField(default = 0)
+    version = fields.IntField(default = 0)
+
+    meta = {
+        'indexes': [
+            {'fields': ('granularity', 'bucket'), 'unique': True},
+        ],
+        'auto_create_index': False,
+        'index_background': True,
+    }
+
+class IPSketch(Document):
+    # HyperLogLog of the distinct ip_src / ip_dst per hour / day, country and attack type ('*' for all)
+    granularity = fields.StringField(required = True, choices = ('hour', 'day'))
+    bucket = fields.DateTimeField(required = True)
+    field = fields.StringField(required = True, choices = ('ip_src', 'ip_dst'))
+    # Destination country for ip_src, source country for ip_dst
+    country = fields.StringField(required = True)
+    attack_type = fields.StringField(required = True)
+    # zlib-compressed one-byte registers
+    registers = fields.BinaryField()
+    version = fields.IntField(default = 0)
+
+    meta = {
+        'indexes': [
+            {'fields': ('field', 'country', 'attack_type', 'granularity', 'bucket'), 'unique': True},
+        ],
+        'auto_create_index': False,
+        'index_background': True,
+    }
@@ -0,0 +1,39 @@
+import asyncio
+import weakref
+from django.conf import settings
+from pymongo import AsyncMongoClient
+from attacks.instrumentation import COMMAND_LISTENER
+
+# One client per event loop: an AsyncMongoClient must stay on the loop it started on
+_shared_clients = weakref.WeakKeyDictionary()
+
+
+def async_client(**options):
+    """AsyncMongoClient for the database mongoengine is connected to."""
+    return AsyncMongoClient(
+        host=settings.MONGODB.get('host', 'localhost'),
+        port=settings.MONGODB.get('port', 27017),
+        event_listeners=[COMMAND_LISTENER],
+        **options
+    )
+
+
+def async_database(client):
+    return client[settings.MONGODB['db']]
+
+
+def shared_database():
+    """Database on this event loop's shared client, for async views.
+
+    Every request on the loop borrows from one pool capped at
+    ATTACK_ASYNC_MAX_POOL_SIZE connections; requests beyond that wait for a
+    free connection instead of opening more. Only for long-lived loops (ASGI):
+    nothing closes the client when its loop closes.
+    """
+    loop = asyncio.get_running_loop()
+    client = _shared_clients.get(loop)
+    if client is None:
+        client = _shared_clients[loop] = async_client(
+            maxPoolSize=getattr(settings, 'ATTACK_ASYNC_MAX_POOL_SIZE', 50)
+        )
+    return async_database(client)
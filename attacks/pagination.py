@@ -0,0 +1,93 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from rest_framework.exceptions import ValidationError
+
+# Filtered counts stop here when the client asks for an estimated total
+ESTIMATED_TOTAL_CAP = 10000
+
+
+def encode_cursor(value, object_id):
+    """Opaque keyset token for the last row of a page sorted by (value, _id) descending."""
+    payload = json.dumps({"v": value.isoformat(), "id": str(object_id)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return datetime.fromisoformat(payload["v"]), ObjectId(payload["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError, InvalidId):
+        raise ValidationError({"cursor": "Invalid cursor."})
+
+
+def seek_filter(field, token):
+    """Range-seek past the row a cursor token points at, for a (field, _id) descending sort."""
+    value, object_id = decode_cursor(token)
+    return {
+        # The outer bound lets the planner turn the seek into an index range
+        field: {"$lte": value},
+        "$or": [
+            {field: {"$lt": value}},
+            {field: value, "_id": {"$lt": object_id}}
+        ]
+    }
+
+
+def split_page(rows, page_size, field):
+    """Drop the look-ahead row of a page fetched with limit(page_size + 1); returns (rows, next cursor)."""
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(rows[-1][field], rows[-1]["_id"])
+
+
+def parse_page(params):
+    try:
+        page = int(params.get('page', 1))
+    except ValueError:
+        raise ValidationError({"page": "Must be an integer."})
+    if page < 1:
+        raise ValidationError({"page": "Must be at least 1."})
+    return page
+
+
+def parse_page_size(params, default=20, maximum=1000):
+    try:
+        page_size = int(params.get('page_size', default))
+    except ValueError:
+        raise ValidationError({"page_size": "Must be an integer."})
+    if page_size < 1 or page_size > maximum:
+        raise ValidationError({"page_size": f"Must be between 1 and {maximum}."})
+    return page_size
+
+
+def count_total(collection, query, mode):
+    """Return (total, exact) for include_total=true|false|estimated, or (None, False) when disabled."""
+    if mode == "false":
+        return None, False
+    if mode == "estimated":
+        if not query:
+            return collection.estimated_document_count(), False
+        total = collection.count_documents(query, limit=ESTIMATED_TOTAL_CAP)
+        return total, total < ESTIMATED_TOTAL_CAP
+    if mode == "true":
+        return collection.count_documents(query), True
+    raise ValidationError({"include_total": "Must be one of true, false, estimated."})
+
+
+async def count_total_async(collection, query, mode):
+    """count_total for an AsyncMongoClient collection."""
+    if mode == "false":
+        return None, False
+    if mode == "estimated":
+        if not query:
+            return await collection.estimated_document_count(), False
+        total = await collection.count_documents(query, limit=ESTIMATED_TOTAL_CAP)
+        return total, total < ESTIMATED_TOTAL_CAP
+    if mode == "true":
+        return await collection.count_documents(query), True
+    raise ValidationError({"include_total": "Must be one of true, false, estimated."})
@@ -0,0 +1,291 @@
+from datetime import datetime, timezone
+import math
+from rest_framework.exceptions import ValidationError
+
+
+def parse_int(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: "Must be an integer."})
+
+
+def parse_datetime(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValidationError({name: "Must be an ISO 8601 date or datetime."})
+
+
+def as_utc(timestamp):
+    # Naive UTC, like every stored timestamp
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def attack_filter(params):
+    """Build a raw MongoDB filter from the AttackListView query parameters."""
+    clauses = []
+
+    # Filter by attack_type
+    attack_type = params.get('attack_type')
+    if attack_type:
+        clauses.append({"attack_type": attack_type})
+
+    # Filter by country (source or destination)
+    country = params.get('country')
+    if country:
+        clauses.append({
+            "$or": [
+                {"source_location.country": country},
+                {"destination_location.country": country}
+            ]
+        })
+
+    # Severity range
+    severity = {}
+    min_severity = parse_int(params, 'min_severity')
+    max_severity = parse_int(params, 'max_severity')
+    if min_severity is not None:
+        severity["$gte"] = min_severity
+    if max_severity is not None:
+        severity["$lte"] = max_severity
+    if severity:
+        clauses.append({"severity": severity})
+
+    # Date range
+    timestamp = {}
+    start = parse_datetime(params, 'start')
+    end = parse_datetime(params, 'end')
+    if start:
+        timestamp["$gte"] = start
+    if end:
+        timestamp["$lte"] = end
+    if timestamp:
+        clauses.append({"timestamp": timestamp})
+
+    # Region: source or destination point inside a bounding box or radius
+    region = region_filter(params)
+    if region:
+        clauses.append({
+            "$or": [
+                {"source_location.point": region},
+                {"destination_location.point": region}
+            ]
+        })
+
+    if not clauses:
+        return {}
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+def notification_filter(params):
+    """Build a raw MongoDB filter from the NotificationLogView query parameters."""
+    query = {}
+    if params.get('rule_name'):
+        query["rule_name"] = params['rule_name']
+    if params.get('attack_id'):
+        query["attack_id"] = params['attack_id']
+
+    triggered_at = {}
+    start, end = parse_datetime(params, 'start'), parse_datetime(params, 'end')
+    if start:
+        triggered_at["$gte"] = start
+    if end:
+        triggered_at["$lte"] = end
+    if triggered_at:
+        query["triggered_at"] = triggered_at
+    return query
+
+
+def parse_bbox(params, name='bbox'):
+    """Parse a "west,south,east,north" bounding box in degrees, or return None."""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        west, south, east, north = (float(part) for part in value.split(','))
+    except ValueError:
+        raise ValidationError({name: "Must be four comma-separated numbers: west,south,east,north."})
+    if not (-180 <= west <= 180 and -180 <= east <= 180 and -90 <= south < north <= 90):
+        raise ValidationError({name: "Coordinates out of range."})
+    return west, south, east, north
+
+
+def bbox_point_filter(lng_field, lat_field, bbox):
+    west, south, east, north = bbox
+    if west <= east:
+        longitude = {lng_field: {"$gte": west, "$lte": east}}
+    else:
+        # Box crosses the antimeridian
+        longitude = {"$or": [{lng_field: {"$gte": west}}, {lng_field: {"$lte": east}}]}
+    return {"$and": [longitude, {lat_field: {"$gte": south, "$lte": north}}]}
+
+
+def cluster_pipeline(match, zoom, bbox=None, cells_per_tile=4):
+    """Bin source and destination points into a lat/lng grid sized for a web map zoom level."""
+    # A 256px tile spans 360 / 2**zoom degrees; split it into cells_per_tile cells
+    cell = 360.0 / (2 ** zoom) / cells_per_tile
+
+    pipeline = [
+        {"$match": match},
+        {"$project": {
+            "attack_type": 1,
+            "severity": 1,
+            "points": [
+                {"lng": "$source_location.longitude", "lat": "$source_location.latitude"},
+                {"lng": "$destination_location.longitude", "lat": "$destination_location.latitude"},
+            ],
+        }},
+        {"$unwind": "$points"},
+    ]
+    if bbox:
+        pipeline.append({"$match": bbox_point_filter("points.lng", "points.lat", bbox)})
+    pipeline += [
+        {"$group": {
+            "_id": {
+                "x": {"$floor": {"$divide": [{"$add": ["$points.lng", 180]}, cell]}},
+                "y": {"$floor": {"$divide": [{"$add": ["$points.lat", 90]}, cell]}},
+                "attack_type": "$attack_type",
+            },
+            "count": {"$sum": 1},
+            "max_severity": {"$max": "$severity"},
+            "lng": {"$sum": "$points.lng"},
+            "lat": {"$sum": "$points.lat"},
+        }},
+        {"$group": {
+            "_id": {"x": "$_id.x", "y": "$_id.y"},
+            "count": {"$sum": "$count"},
+            "max_severity": {"$max": "$max_severity"},
+            "lng": {"$sum": "$lng"},
+            "lat": {"$sum": "$lat"},
+            "by_attack_type": {"$push": {"k": "$_id.attack_type", "v": "$count"}},
+        }},
+        {"$project": {
+            "_id": 0,
+            "cell": ["$_id.x", "$_id.y"],
+            "count": 1,
+            "max_severity": 1,
+            # Cluster marker sits at the centroid of its points
+            "lng": {"$divide": ["$lng", "$count"]},
+            "lat": {"$divide": ["$lat", "$count"]},
+            "by_attack_type": {"$arrayToObject": "$by_attack_type"},
+        }},
+    ]
+    return pipeline
+
+
+EARTH_RADIUS_KM = 6378.1
+
+
+def bbox_polygon(bbox, step=10.0):
+    """GeoJSON polygon for a lat/lng box whose edges follow parallels and meridians.
+
+    Edges are densified so the geodesic segments stay close to the box, and the
+    ring is wound counter-clockwise under MongoDB's strict-winding CRS so boxes
+    larger than a hemisphere keep their interior.
+    """
+    west, south, east, north = bbox
+    if east < west:
+        east += 360
+    # A full-width box would put both meridian edges on the same line, and every
+    # vertex on a pole is the same point, so stop just short of both
+    east = min(east, west + 359.999)
+    south, north = max(south, -89.999), min(north, 89.999)
+
+    def wrap(lng):
+        return lng - 360 if lng > 180 else lng
+
+    segments = max(1, math.ceil((east - west) / step))
+    bottom = [[wrap(west + (east - west) * i / segments), south] for i in range(segments + 1)]
+    top = [[lng, north] for lng, _ in reversed(bottom)]
+    return {
+        "type": "Polygon",
+        "coordinates": [bottom + top + [bottom[0]]],
+        "crs": {"type": "name", "properties": {"name": "urn:x-mongodb:crs:strictwinding:EPSG:4326"}},
+    }
+
+
+def parse_near(params, name='near'):
+    """Parse a "lng,lat,radius_km" circle, or return None."""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        lng, lat, radius_km = (float(part) for part in value.split(','))
+    except ValueError:
+        raise ValidationError({name: "Must be three comma-separated numbers: lng,lat,radius_km."})
+    if not (-180 <= lng <= 180 and -90 <= lat <= 90 and radius_km > 0):
+        raise ValidationError({name: "Coordinates out of range or radius not positive."})
+    return lng, lat, radius_km
+
+
+def region_filter(params):
+    """$geoWithin operator for the bbox= or near= parameter, or None."""
+    bbox = parse_bbox(params)
+    if bbox:
+        return {"$geoWithin": {"$geometry": bbox_polygon(bbox)}}
+    near = parse_near(params)
+    if near:
+        lng, lat, radius_km = near
+        # $centerSphere (not $near) so the filter can sit inside $or and be counted
+        return {"$geoWithin": {"$centerSphere": [[lng, lat], radius_km / EARTH_RADIUS_KM]}}
+    return None
+
+
+def distance_km(lng1, lat1, lng2, lat2):
+    """Great-circle distance on the sphere $centerSphere uses."""
+    lng1, lat1, lng2, lat2 = map(math.radians, (lng1, lat1, lng2, lat2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def attack_matcher(params):
+    """In-memory counterpart of attack_filter: a predicate over raw attack documents.
+
+    bbox edges are taken along parallels and meridians rather than geodesics.
+    """
+    attack_type = params.get('attack_type')
+    country = params.get('country')
+    min_severity = parse_int(params, 'min_severity')
+    max_severity = parse_int(params, 'max_severity')
+    start, end = parse_datetime(params, 'start'), parse_datetime(params, 'end')
+    start, end = start and as_utc(start), end and as_utc(end)
+    bbox, near = parse_bbox(params), parse_near(params)
+
+    def in_region(location):
+        lng, lat = location["longitude"], location["latitude"]
+        if bbox:
+            west, south, east, north = bbox
+            inside_lng = west <= lng <= east if west <= east else lng >= west or lng <= east
+            return inside_lng and south <= lat <= north
+        return distance_km(near[0], near[1], lng, lat) <= near[2]
+
+    def matches(attack):
+        if attack_type and attack["attack_type"] != attack_type:
+            return False
+        source, destination = attack["source_location"], attack["destination_location"]
+        if country and country not in (source["country"], destination["country"]):
+            return False
+        if min_severity is not None and attack["severity"] < min_severity:
+            return False
+        if max_severity is not None and attack["severity"] > max_severity:
+            return False
+        if start and attack["timestamp"] < start:
+            return False
+        if end and attack["timestamp"] > end:
+            return False
+        if (bbox or near) and not (in_region(source) or in_region(destination)):
+            return False
+        return True
+
+    return matches
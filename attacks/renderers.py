@@ -0,0 +1,98 @@
+import math
+import time
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from attacks.geojson import dumps
+from attacks.instrumentation import current_stats
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+
+def record_serialization(started):
+    stats = current_stats.get()
+    if stats is not None:
+        stats.serialization_seconds += time.perf_counter() - started
+
+
+# Dict keys json writes as strings; orjson (with OPT_NON_STR_KEYS) writes the same for them
+PLAIN_KEYS = (str, int, float, type(None))
+
+
+def has_mismatched_float(data):
+    """Whether ``data`` holds a float orjson writes differently from json (1e16 vs 1e+16, 0.00001 vs 1e-05, NaN).
+
+    Float dict keys are checked as well, and keys of any other non-plain type
+    (a datetime, say) count as a mismatch.
+    """
+    pending = [data]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, float):
+            # json writes repr(); the two only differ where it uses an exponent
+            if not math.isfinite(value) or "e" in repr(value):
+                return True
+        elif isinstance(value, dict):
+            for key in value:
+                if not isinstance(key, PLAIN_KEYS):
+                    return True
+                if isinstance(key, float):
+                    pending.append(key)
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            pending.extend(value)
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer with the same output, encoded by orjson when it is installed.
+
+    Anything orjson would write differently (exponent floats, types it does
+    not know, indented output) goes through the stock renderer instead.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        started = time.perf_counter()
+        try:
+            return self.encode(data, accepted_media_type, renderer_context)
+        finally:
+            record_serialization(started)
+
+    def encode(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or orjson is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) or has_mismatched_float(data):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                # Int keys (by_severity) are written as strings, as json does
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS,
+            )
+        except (TypeError, orjson.JSONEncodeError):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped by JSONRenderer for JavaScript compatibility
+        return ret.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Newline-delimited JSON: one line per list item (or per GeoJSON feature)."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        started = time.perf_counter()
+        if isinstance(data, dict) and data.get("type") == "FeatureCollection":
+            data = data["features"]
+        if not isinstance(data, list):
+            data = [data]
+        try:
+            return ''.join(dumps(item) + '\n' for item in data).encode(self.charset)
+        finally:
+            record_serialization(started)
@@ -0,0 +1,173 @@
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from pymongo import UpdateOne
+from attacks.models import AttackRollup
+from attacks.queries import as_utc, parse_datetime, parse_int
+
+GRANULARITIES = {
+    "hour": timedelta(hours=1),
+    "minute": timedelta(minutes=1),
+}
+
+# Filters the rollup dimensions can answer; anything else needs the raw attacks
+ROLLUP_PARAMS = {"attack_type", "country", "min_severity", "max_severity", "start", "end"}
+
+STATISTICS_KEYS = ("by_country", "by_attack_type", "by_severity")
+
+KEY_FIELDS = ("granularity", "bucket", "attack_type", "src_country", "dst_country", "severity")
+
+
+def truncate(timestamp, granularity):
+    timestamp = as_utc(timestamp).replace(second=0, microsecond=0)
+    if granularity == "hour":
+        timestamp = timestamp.replace(minute=0)
+    return timestamp
+
+
+def rollup_operations(attacks):
+    """One $inc upsert per distinct rollup row the attacks fall into."""
+    counts = Counter()
+    for attack in attacks:
+        for granularity in GRANULARITIES:
+            counts[(
+                granularity,
+                truncate(attack["timestamp"], granularity),
+                attack["attack_type"],
+                attack["source_location"]["country"],
+                attack["destination_location"]["country"],
+                attack["severity"],
+            )] += 1
+    return [
+        UpdateOne(dict(zip(KEY_FIELDS, key)), {"$inc": {"count": count}}, upsert=True)
+        for key, count in counts.items()
+    ]
+
+
+def record_attacks(attacks):
+    operations = rollup_operations(attacks)
+    if operations:
+        AttackRollup._get_collection().bulk_write(operations, ordered=False)
+
+
+def rebuild_pipeline(granularity, match):
+    """Server-side rollup of raw attacks, merged over the existing rows."""
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "bucket": {"$dateTrunc": {"date": "$timestamp", "unit": granularity}},
+                "attack_type": "$attack_type",
+                "src_country": "$source_location.country",
+                "dst_country": "$destination_location.country",
+                "severity": "$severity",
+            },
+            "count": {"$sum": 1},
+        }},
+        {"$replaceWith": {"$mergeObjects": ["$_id", {"granularity": granularity, "count": "$count"}]}},
+        {"$merge": {
+            "into": AttackRollup._get_collection_name(),
+            "on": list(KEY_FIELDS),
+            "whenMatched": "replace",
+            "whenNotMatched": "insert",
+        }},
+    ]
+
+
+def aligned(timestamp, granularity):
+    return timestamp is None or truncate(timestamp, granularity) == as_utc(timestamp)
+
+
+def rollup_granularity(params):
+    """The coarsest rollup that answers these filters exactly, or None."""
+    if not getattr(settings, 'ATTACK_STATISTICS_FROM_ROLLUPS', False):
+        return None
+    if any(name not in ROLLUP_PARAMS for name in params):
+        return None
+    start, end = parse_datetime(params, 'start'), parse_datetime(params, 'end')
+    for granularity in GRANULARITIES:
+        if aligned(start, granularity) and aligned(end, granularity):
+            return granularity
+    return None
+
+
+def rollup_filter(params, granularity):
+    query = {"granularity": granularity}
+    if params.get('attack_type'):
+        query["attack_type"] = params['attack_type']
+    if params.get('country'):
+        query["$or"] = [{"src_country": params['country']}, {"dst_country": params['country']}]
+
+    severity = {}
+    min_severity, max_severity = parse_int(params, 'min_severity'), parse_int(params, 'max_severity')
+    if min_severity is not None:
+        severity["$gte"] = min_severity
+    if max_severity is not None:
+        severity["$lte"] = max_severity
+    if severity:
+        query["severity"] = severity
+
+    # ``end`` is inclusive on attacks; its own bucket is counted from the raw attacks
+    bucket = {}
+    start, end = parse_datetime(params, 'start'), parse_datetime(params, 'end')
+    if start:
+        bucket["$gte"] = as_utc(start)
+    if end:
+        bucket["$lt"] = as_utc(end)
+    if bucket:
+        query["bucket"] = bucket
+    return query
+
+
+def statistics_facets(rolled_up=False):
+    """$facet branches counting countries, attack types and severities of raw attacks or rollup rows."""
+    if rolled_up:
+        count, countries = "$count", ["$src_country", "$dst_country"]
+    else:
+        count, countries = {"$literal": 1}, ["$source_location.country", "$destination_location.country"]
+    return {
+        # Count both source and destination countries
+        "by_country": [
+            {"$project": {"country": countries, "count": count}},
+            {"$unwind": "$country"},
+            {"$group": {"_id": "$country", "count": {"$sum": "$count"}}},
+        ],
+        "by_attack_type": [{"$group": {"_id": "$attack_type", "count": {"$sum": count}}}],
+        "by_severity": [{"$group": {"_id": "$severity", "count": {"$sum": count}}}],
+    }
+
+
+def statistics_pipeline(match, rolled_up=False):
+    """Country, attack type and severity counts over raw attacks or rollup rows."""
+    return [
+        {"$match": match},
+        {"$facet": statistics_facets(rolled_up)},
+    ]
+
+
+def search_pipeline(match, skip, limit, projection):
+    """One pass over the matching attacks: a page, the total and the statistics counts.
+
+    ``skip`` must be at least 0 and ``limit`` at least 1 ($limit: 0 is an error).
+    The whole page comes back in one document under MongoDB's 16 MB cap, so
+    ``limit`` is kept to parse_page_size's maximum.
+    """
+    return [
+        {"$match": match},
+        # Sorted before $facet, where the (timestamp) index can still provide the order
+        {"$sort": {"timestamp": -1}},
+        {"$project": projection},
+        {"$facet": {
+            "results": [{"$skip": skip}, {"$limit": limit}],
+            "total": [{"$count": "count"}],
+            **statistics_facets(),
+        }},
+    ]
+
+
+def search_total(facets):
+    return facets["total"][0]["count"] if facets["total"] else 0
+
+
+def statistics_counts(facets):
+    return {key: Counter({bucket["_id"]: bucket["count"] for bucket in facets[key]}) for key in STATISTICS_KEYS}
@@ -0,0 +1,359 @@
+import heapq
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from attacks.metrics import RULE_MATCHES, RULE_PASS_SECONDS, RULE_SECONDS, RULE_WINDOW_MATCHES
+from attacks.models import CyberAttack, NotificationRule, Notification, RuleEngineState, VOLUME_TRIGGER_ID
+
+# Fields a rule looks at; everything else stays in MongoDB
+RULE_PROJECTION = {
+    "attack_type": 1,
+    "severity": 1,
+    "timestamp": 1,
+    "source_location.country": 1,
+    "destination_location.country": 1,
+}
+
+# Attacks fetched per round trip while streaming
+BATCH_SIZE = 1000
+
+DUPLICATE_KEY = 11000
+
+EPOCH = datetime(1970, 1, 1)
+
+# Writers do not commit attacks in _id order, so each run re-reads this far
+# behind the high-water mark; the notification upserts make that harmless
+HIGH_WATER_OVERLAP = timedelta(seconds=5)
+
+
+def rule_filter(rule):
+    """Raw MongoDB filter for the attacks a rule matches (ignoring its time window)."""
+    query = {}
+    if rule.attack_type:
+        query["attack_type"] = rule.attack_type
+    if rule.country:
+        query["$or"] = [
+            {"source_location.country": rule.country},
+            {"destination_location.country": rule.country}
+        ]
+    severity = {}
+    if rule.min_severity:
+        severity["$gte"] = rule.min_severity
+    if rule.max_severity:
+        severity["$lte"] = rule.max_severity
+    if severity:
+        query["severity"] = severity
+    return query
+
+
+def severity_matches(rule, attack):
+    if rule.min_severity and attack["severity"] < rule.min_severity:
+        return False
+    if rule.max_severity and attack["severity"] > rule.max_severity:
+        return False
+    return True
+
+
+def within_window(rule, attack, now):
+    if not rule.time_window_minutes:
+        return True
+    return attack["timestamp"] >= now - timedelta(minutes=rule.time_window_minutes)
+
+
+def in_cooldown(rule, now):
+    if not rule.last_triggered_at:
+        return False
+    return now < rule.last_triggered_at + timedelta(minutes=rule.cooldown_minutes or 10)
+
+
+class RuleIndex:
+    """Rules bucketed by (attack_type, country), with None as the wildcard.
+
+    An attack only reaches the handful of buckets its type and countries can
+    hit, so rules for other types or countries are never looked at.
+    """
+
+    def __init__(self, rules):
+        self.buckets = defaultdict(list)
+        for rule in rules:
+            self.buckets[(rule.attack_type or None, rule.country or None)].append(rule)
+
+    def match(self, attack):
+        attack_type = attack["attack_type"]
+        src = attack["source_location"]["country"]
+        dst = attack["destination_location"]["country"]
+        keys = dict.fromkeys([
+            (attack_type, src), (attack_type, dst), (attack_type, None),
+            (None, src), (None, dst), (None, None),
+        ])
+        for key in keys:
+            for rule in self.buckets.get(key, ()):
+                if severity_matches(rule, attack):
+                    yield rule
+
+
+def epoch_seconds(timestamp):
+    return int((timestamp - EPOCH).total_seconds())
+
+
+class SlidingWindowCounter:
+    """Count of a rule's matching attacks over a sliding time window.
+
+    Counts live in one-second buckets keyed by epoch second, with a heap of
+    bucket keys for expiry. Memory is bounded by the number of distinct seconds
+    in the window, never by the number of attacks. ``window`` is in seconds;
+    None means the count never expires.
+    """
+
+    def __init__(self, window=None):
+        self.window = window
+        self.buckets = {}
+        self.expiry = []
+        self.total = 0
+
+    def add(self, second, count=1):
+        if second not in self.buckets:
+            self.buckets[second] = 0
+            heapq.heappush(self.expiry, second)
+        self.buckets[second] += count
+        self.total += count
+
+    def count(self, now):
+        if self.window is not None:
+            cutoff = epoch_seconds(now) - self.window
+            while self.expiry and self.expiry[0] < cutoff:
+                self.total -= self.buckets.pop(heapq.heappop(self.expiry))
+        return self.total
+
+    @classmethod
+    def seed(cls, rule, now):
+        """Build a rule's counter from per-second counts grouped in MongoDB."""
+        collection = CyberAttack._get_collection()
+        if not rule.time_window_minutes:
+            counter = cls()
+            counter.add(0, collection.count_documents(rule_filter(rule)))
+            return counter
+
+        counter = cls(rule.time_window_minutes * 60)
+        cutoff = now - timedelta(minutes=rule.time_window_minutes)
+        pipeline = [
+            {"$match": {"$and": [rule_filter(rule), {"timestamp": {"$gte": cutoff}}]}},
+            {"$group": {
+                "_id": {"$floor": {"$divide": [{"$toLong": "$timestamp"}, 1000]}},
+                "count": {"$sum": 1},
+            }},
+        ]
+        for bucket in collection.aggregate(pipeline):
+            counter.add(int(bucket["_id"]), bucket["count"])
+        return counter
+
+
+def attack_details(attack):
+    return {
+        "attack_type": attack["attack_type"],
+        "severity": attack["severity"],
+        "country_src": attack["source_location"]["country"],
+        "country_dst": attack["destination_location"]["country"],
+        "timestamp": str(attack["timestamp"])
+    }
+
+
+def trigger_volume(rule, matched_count):
+    """Fire a threshold rule unless another evaluator beat us to it.
+
+    The cooldown is claimed with a compare-and-set on last_triggered_at, so of
+    several workers seeing the same surge only one writes the notification.
+    """
+    now = datetime.utcnow()
+    # MongoDB keeps milliseconds; compare-and-set needs the value as stored
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    claimed = NotificationRule.objects(
+        id=rule.id, last_triggered_at=rule.last_triggered_at
+    ).update_one(set__last_triggered_at=now)
+    if not claimed:
+        rule.reload('last_triggered_at')
+        return False
+
+    rule.last_triggered_at = now
+    Notification(
+        rule_name=rule.name,
+        attack_id=VOLUME_TRIGGER_ID,
+        triggered_at=now,
+        details={
+            "matched_count": matched_count,
+            "rule": rule.name
+        }
+    ).save()
+    return True
+
+
+class NotificationBatch:
+    """Buffered, idempotent per-attack notification writes.
+
+    Each match becomes an upsert on (rule_name, attack_id) that only sets the
+    notification body on insert, so re-evaluating an attack, or two evaluators
+    racing on it, never creates a duplicate. Writes go out in unordered
+    bulk_write calls of ``size`` operations.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.operations = []
+        self.inserted = 0
+        self.existing = 0
+
+    def add(self, rule, attack):
+        self.operations.append(UpdateOne(
+            {"rule_name": rule.name, "attack_id": str(attack["_id"])},
+            {"$setOnInsert": {
+                "triggered_at": datetime.utcnow(),
+                "details": attack_details(attack),
+            }},
+            upsert=True,
+        ))
+        # size=None leaves flushing to the caller
+        if self.size and len(self.operations) >= self.size:
+            self.flush()
+
+    def take(self):
+        operations, self.operations = self.operations, []
+        return operations
+
+    def record(self, result):
+        self.inserted += result.upserted_count
+        self.existing += result.matched_count
+
+    def record_error(self, exc):
+        # Two upserts racing on the same key: the loser finds it already present
+        errors = exc.details["writeErrors"]
+        if any(error["code"] != DUPLICATE_KEY for error in errors):
+            raise exc
+        self.inserted += exc.details["nUpserted"]
+        self.existing += exc.details["nMatched"] + len(errors)
+
+    def flush(self):
+        operations = self.take()
+        if not operations:
+            return
+        try:
+            self.record(Notification._get_collection().bulk_write(operations, ordered=False))
+        except BulkWriteError as exc:
+            self.record_error(exc)
+
+
+class RuleEvaluator:
+    """Single-pass, incremental evaluation of notification rules.
+
+    Attacks newer than the persisted high-water mark (by ``_id``) are streamed
+    once and matched against every per-attack rule through a ``RuleIndex``.
+    Rules the evaluator has not seen before are caught up on older attacks
+    with their own query, once.
+    """
+
+    def __init__(self, name="evaluate_rules", log=None, batch_size=1000, worker=None, keep_alive=None):
+        self.name = name
+        # Label of this process's rule metrics
+        self.worker = worker or name
+        self.log = log or (lambda message: None)
+        # Called every BATCH_SIZE attacks and before each threshold rule; may raise to abort the run
+        self.keep_alive = keep_alive or (lambda: None)
+        self.notifications = NotificationBatch(batch_size)
+        self.volume_triggers = 0
+
+    @property
+    def created(self):
+        return self.notifications.inserted + self.volume_triggers
+
+    def evaluate_threshold(self, rule, counter, now):
+        matched_count = counter.count(now)
+        RULE_WINDOW_MATCHES.set(matched_count, worker=self.worker, rule=rule.name)
+        if matched_count < rule.threshold_count:
+            return
+
+        if trigger_volume(rule, matched_count):
+            self.volume_triggers += 1
+            self.log(f"Rule '{rule.name}' triggered by volume: {matched_count} attacks")
+
+    def run(self, rules=None, full=False):
+        rules = list(NotificationRule.objects(active=True) if rules is None else rules)
+        now = datetime.utcnow()
+        collection = CyberAttack._get_collection()
+
+        state = RuleEngineState.objects(name=self.name).first() or RuleEngineState(name=self.name)
+        if full:
+            state.last_attack_id = None
+            state.rule_ids = []
+        high_water = state.last_attack_id
+        seen = set(state.rule_ids)
+
+        per_attack = [rule for rule in rules if not rule.threshold_count]
+        matches = Counter()
+
+        # New rules have not looked at anything below the high-water mark yet
+        if high_water:
+            for rule in per_attack:
+                if str(rule.id) in seen:
+                    continue
+                started = time.perf_counter()
+                conditions = [rule_filter(rule), {"_id": {"$lte": high_water}}]
+                if rule.time_window_minutes:
+                    # Let the timestamp index cut the scan down to the rule's window
+                    conditions.append({"timestamp": {"$gte": now - timedelta(minutes=rule.time_window_minutes)}})
+                query = {"$and": conditions}
+                for read, attack in enumerate(collection.find(query, RULE_PROJECTION).batch_size(BATCH_SIZE), 1):
+                    if read % BATCH_SIZE == 0:
+                        self.keep_alive()
+                    self.notifications.add(rule, attack)
+                    matches[rule.name] += 1
+                RULE_SECONDS.observe(time.perf_counter() - started, worker=self.worker, rule=rule.name)
+
+        # One pass over everything newer than the high-water mark, and the overlap behind it
+        started = time.perf_counter()
+        index = RuleIndex(per_attack)
+        last = None
+        query = {}
+        if high_water:
+            query = {"_id": {"$gt": ObjectId.from_datetime(high_water.generation_time - HIGH_WATER_OVERLAP)}}
+        cursor = collection.find(query, RULE_PROJECTION).sort("_id", 1).batch_size(BATCH_SIZE)
+        for read, attack in enumerate(cursor, 1):
+            if read % BATCH_SIZE == 0:
+                self.keep_alive()
+            for rule in index.match(attack):
+                if within_window(rule, attack, now):
+                    self.notifications.add(rule, attack)
+                    # Overlap matches were counted by the run that first saw them
+                    if not high_water or attack["_id"] > high_water:
+                        matches[rule.name] += 1
+            last = attack
+        RULE_PASS_SECONDS.observe(time.perf_counter() - started, worker=self.worker)
+        for rule_name, count in matches.items():
+            RULE_MATCHES.inc(count, worker=self.worker, rule=rule_name)
+
+        self.notifications.flush()
+        self.log(
+            f"Per-attack notifications: {self.notifications.inserted} new, "
+            f"{self.notifications.existing} already present"
+        )
+
+        for rule in rules:
+            if not rule.threshold_count:
+                continue
+            if in_cooldown(rule, now):
+                self.log(f"Skipping '{rule.name}' (cooldown active)")
+                continue
+            # Counted server-side; matching attacks are never loaded
+            self.keep_alive()
+            started = time.perf_counter()
+            self.evaluate_threshold(rule, SlidingWindowCounter.seed(rule, now), now)
+            RULE_SECONDS.observe(time.perf_counter() - started, worker=self.worker, rule=rule.name)
+
+        if last and (not high_water or last["_id"] > high_water):
+            state.last_attack_id = last["_id"]
+            state.last_timestamp = last["timestamp"]
+        state.rule_ids = [str(rule.id) for rule in rules]
+        state.updated_at = now
+        state.save()
+        return self.created
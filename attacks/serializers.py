@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from attacks.backtest import MAX_TIMESTAMP_LIMIT
 
 class LocationSerializer(serializers.Serializer):
     latitude = serializers.FloatField()
@@ -31,4 +32,10 @@ class NotificationSerializer(serializers.Serializer):
     rule_name = serializers.CharField()
     attack_id = serializers.CharField()
     triggered_at = serializers.DateTimeField()
-    details = serializers.DictField()
\ No newline at end of file
+    details = serializers.DictField()
+
+class RuleBacktestSerializer(serializers.Serializer):
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=0, max_value=MAX_TIMESTAMP_LIMIT)
+    rules = NotificationRuleSerializer(many=True)
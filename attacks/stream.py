@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import weakref
+from collections import OrderedDict
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+from attacks.engine import POLL_OVERLAP
+from attacks.geojson import dumps
+from attacks.models import CyberAttack, Notification
+from attacks.mongo import shared_database
+from attacks.rules import BATCH_SIZE
+from attacks.transforms import attack_record, notification_record
+
+# Events a subscriber may fall behind by before it is disconnected (it resumes with Last-Event-ID)
+SUBSCRIBER_BUFFER = 1000
+
+# Events replayed after Last-Event-ID on reconnect
+BACKFILL_LIMIT = 1000
+
+KEEPALIVE_SECONDS = 15.0
+
+# Client reconnect delay sent in the stream's retry: field
+RETRY_MS = 3000
+
+# Event ids remembered to drop the polling overlap
+RECENT_IDS = 10000
+
+# Longest wait between retries after repeated database errors
+MAX_BACKOFF_SECONDS = 60.0
+
+_feeds = weakref.WeakKeyDictionary()
+
+logger = logging.getLogger(__name__)
+
+# What a document missing fields or holding the wrong types raises in a matcher or record
+MALFORMED = (KeyError, TypeError, ValueError, AttributeError)
+
+
+def attack_event(attack):
+    return {"id": str(attack["_id"]), **attack_record(attack)}
+
+
+EVENT_RECORDS = {
+    "attack": attack_event,
+    "notification": notification_record,
+}
+
+
+def sse_event(kind, document):
+    return f"id: {document['_id']}\nevent: {kind}\ndata: {dumps(EVENT_RECORDS[kind](document))}\n\n"
+
+
+class Subscription:
+    """One SSE client: its filter and a bounded queue of matching events."""
+
+    def __init__(self, matcher, notifications=False):
+        self.matcher = matcher
+        self.notifications = notifications
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_BUFFER)
+        self.overflowed = False
+
+    def offer(self, kind, document):
+        if kind == "attack" and not self.matcher(document):
+            return
+        if kind == "notification" and not self.notifications:
+            return
+        try:
+            self.queue.put_nowait((kind, document))
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class LiveFeed:
+    """The single upstream reader of new attacks and notifications for an event loop.
+
+    Follows a database change stream filtered to inserts on the two
+    collections, or polls both by ``_id`` where change streams are not
+    available, and hands every document to each subscriber. It runs only
+    while someone is subscribed.
+    """
+
+    def __init__(self, database, poll_interval=1.0):
+        self.database = database
+        self.poll_interval = poll_interval
+        self.kinds = {
+            CyberAttack._get_collection_name(): "attack",
+            Notification._get_collection_name(): "notification",
+        }
+        self.subscribers = set()
+        self.recent = OrderedDict()
+        self.resume_token = None
+        self.last_ids = {}
+        self.task = None
+        # Database errors in a row, for the retry backoff
+        self.failures = 0
+
+    def subscribe(self, subscription):
+        self.subscribers.add(subscription)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            # The next subscriber starts from the present, not from here
+            self.task, self.resume_token, self.last_ids = None, None, {}
+
+    def publish(self, kind, document):
+        if document["_id"] in self.recent:
+            return
+        self.recent[document["_id"]] = None
+        if len(self.recent) > RECENT_IDS:
+            self.recent.popitem(last=False)
+        for subscription in list(self.subscribers):
+            try:
+                subscription.offer(kind, document)
+            except MALFORMED:
+                # One bad document must not stop the feed every subscriber shares
+                logger.warning("Skipped malformed %s %s", kind, document.get("_id"), exc_info=True)
+
+    async def run(self):
+        change_stream = True
+        while True:
+            try:
+                if change_stream:
+                    await self.follow_change_stream()
+                else:
+                    await self.poll()
+            except OperationFailure:
+                if change_stream:
+                    # No change streams on a standalone server: poll instead, right away
+                    change_stream = False
+                    continue
+                # Auth / permission errors, killed cursors: retrying at once would spin the event loop
+                logger.warning("Polling for new events failed", exc_info=True)
+                await self.back_off()
+            except PyMongoError:
+                # Lost the server; pick up where the stream stopped once it is back
+                logger.warning("Lost the live feed's database connection", exc_info=True)
+                await self.back_off()
+
+    async def back_off(self):
+        self.failures += 1
+        await asyncio.sleep(min(self.poll_interval * 2 ** (self.failures - 1), MAX_BACKOFF_SECONDS))
+
+    async def follow_change_stream(self):
+        pipeline = [{"$match": {"operationType": "insert", "ns.coll": {"$in": list(self.kinds)}}}]
+        stream = await self.database.watch(pipeline, resume_after=self.resume_token, max_await_time_ms=500)
+        async with stream:
+            self.failures = 0
+            async for change in stream:
+                self.publish(self.kinds[change["ns"]["coll"]], change["fullDocument"])
+                self.resume_token = stream.resume_token
+
+    async def poll(self):
+        for name in self.kinds:
+            if name not in self.last_ids:
+                newest = await self.database[name].find_one({}, {"_id": 1}, sort=[("_id", -1)])
+                self.last_ids[name] = newest["_id"] if newest else None
+
+        while True:
+            for name, kind in self.kinds.items():
+                query = {}
+                if self.last_ids[name]:
+                    # Writers' ObjectIds are only ordered to the second; look back and dedupe
+                    query = {"_id": {"$gt": ObjectId.from_datetime(self.last_ids[name].generation_time - POLL_OVERLAP)}}
+                while True:
+                    batch = await self.database[name].find(query).sort("_id", 1).limit(BATCH_SIZE).to_list()
+                    for document in batch:
+                        self.publish(kind, document)
+                    if batch:
+                        self.last_ids[name] = max(self.last_ids[name] or batch[-1]["_id"], batch[-1]["_id"])
+                    if len(batch) < BATCH_SIZE:
+                        break
+                    query = {"_id": {"$gt": batch[-1]["_id"]}}
+            self.failures = 0
+            await asyncio.sleep(self.poll_interval)
+
+
+def shared_feed():
+    loop = asyncio.get_running_loop()
+    feed = _feeds.get(loop)
+    if feed is None:
+        feed = _feeds[loop] = LiveFeed(shared_database())
+    return feed
+
+
+async def backfill(database, filters, last_event_id, notifications):
+    """Events after Last-Event-ID, oldest first, up to BACKFILL_LIMIT."""
+    after = {"_id": {"$gt": last_event_id}}
+    query = {"$and": [filters, after]} if filters else after
+    attacks = database[CyberAttack._get_collection_name()].find(query).sort("_id", 1).limit(BACKFILL_LIMIT)
+    events = [("attack", attack) async for attack in attacks]
+    if notifications:
+        logs = database[Notification._get_collection_name()].find(after).sort("_id", 1).limit(BACKFILL_LIMIT)
+        events += [("notification", log) async for log in logs]
+    events.sort(key=lambda event: event[1]["_id"])
+    return events[:BACKFILL_LIMIT]
+
+
+async def event_stream(subscription, filters, last_event_id=None):
+    """SSE body: replay after Last-Event-ID, then live events with keepalive comments."""
+    feed = shared_feed()
+    # Subscribe before the replay so nothing inserted in between is missed
+    feed.subscribe(subscription)
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        replayed = set()
+        if last_event_id:
+            for kind, document in await backfill(feed.database, filters, last_event_id, subscription.notifications):
+                replayed.add(document["_id"])
+                yield sse_event(kind, document)
+
+        while not subscription.overflowed:
+            try:
+                kind, document = await asyncio.wait_for(subscription.queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if document["_id"] in replayed:
+                continue
+            try:
+                event = sse_event(kind, document)
+            except MALFORMED:
+                logger.warning("Skipped malformed %s %s", kind, document.get("_id"), exc_info=True)
+                continue
+            yield event
+    finally:
+        feed.unsubscribe(subscription)
@@ -1,12 +1,21 @@
 from django.test import TestCase
 from rest_framework.test import APIClient
-from attacks.models import CyberAttack, Location
+from django.core.cache import cache
+from django.test import override_settings
+from attacks.models import AttackRollup, CyberAttack, FlowSummary, IPSketch, Location
 from datetime import datetime
+import json
 
 class AttackAPITestCase(TestCase):
     def setUp(self):
         self.client = APIClient()
 
+        CyberAttack.objects.delete()
+        AttackRollup.objects.delete()
+        FlowSummary.objects.delete()
+        IPSketch.objects.delete()
+        cache.clear()
+
         # Create sample attacks
         location1 = Location(latitude=40.7128, longitude=-74.0060, country="USA")
         location2 = Location(latitude=48.8566, longitude=2.3522, country="France")
@@ -31,19 +40,559 @@ class AttackAPITestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(all(a["attack_type"] == "DDoS" for a in response.json()["results"]))
 
+    def test_cursor_pagination(self):
+        severities = []
+        response = self.client.get("/api/attacks/?cursor=&page_size=2")
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertEqual(data["total"], 5)
+            severities.extend(a["severity"] for a in data["results"])
+            if not data["next"]:
+                break
+            response = self.client.get(f"/api/attacks/?cursor={data['next']}&page_size=2&include_total=true")
+        self.assertEqual(sorted(severities), [5, 6, 7, 8, 9])
+
+    def test_page_parameters_are_checked(self):
+        for query in ["page_size=0", "page_size=1001", "page=0", "page=-1", "page_size=-5", "page=x"]:
+            self.assertEqual(self.client.get(f"/api/attacks/?{query}").status_code, 400, query)
+            self.assertEqual(self.client.get(f"/api/async/attacks/?{query}").status_code, 400, query)
+
+    def test_cursor_pagination_without_total(self):
+        response = self.client.get("/api/attacks/?cursor=&page_size=2&include_total=false")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("total", response.json())
+        self.assertEqual(len(response.json()["results"]), 2)
+
+    def test_filter_by_bbox(self):
+        response = self.client.get("/api/attacks/?bbox=-80,35,-70,45")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total"], 5)
+
+        response = self.client.get("/api/attacks/?bbox=100,-10,120,10")
+        self.assertEqual(response.json()["total"], 0)
+
+    def test_filter_by_near(self):
+        # Paris is about 5,800 km from New York
+        response = self.client.get("/api/attacks/visualization-data/?near=2.35,48.85,50")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["features"]), 10)
+
+        response = self.client.get("/api/attacks/visualization-data/?near=139.69,35.68,500")
+        self.assertEqual(len(response.json()["features"]), 0)
+
+    def test_backfill_geo_points(self):
+        from django.core.management import call_command
+        CyberAttack._get_collection().update_many({}, {"$unset": {"source_location.point": ""}})
+        call_command("backfill_geo_points")
+        attack = CyberAttack._get_collection().find_one()
+        self.assertEqual(attack["source_location"]["point"]["coordinates"], [-74.0060, 40.7128])
+
+    def test_backfill_geo_points_skips_missing_coordinates(self):
+        from io import StringIO
+        from django.core.management import call_command
+        collection = CyberAttack._get_collection()
+        collection.insert_many([
+            {"attack_type": "Malware", "severity": 1, "timestamp": datetime(2025, 5, 4)},
+            {"attack_type": "Malware", "severity": 1, "timestamp": datetime(2025, 5, 4),
+             "source_location": {"latitude": None, "longitude": 2.3, "country": "France"}},
+        ])
+        out = StringIO()
+        call_command("backfill_geo_points", stdout=out)
+        self.assertIn("Skipped 2 attacks without a valid source_location", out.getvalue())
+        self.assertIn("Skipped 2 attacks without a valid destination_location", out.getvalue())
+        self.assertEqual(collection.count_documents({"attack_type": "Malware", "source_location.point": {"$exists": True}}), 0)
+        # The 2dsphere indexes can be built over what is left
+        call_command("sync_indexes", stdout=StringIO())
+
+    def test_bulk_ingest_json(self):
+        attack = {
+            "source_location": {"latitude": 40.7, "longitude": -74.0, "country": "USA"},
+            "destination_location": {"latitude": 48.8, "longitude": 2.3, "country": "France"},
+            "attack_type": "Malware",
+            "severity": 4,
+            "timestamp": "2025-05-04T12:00:00",
+        }
+        response = self.client.post("/api/attacks/bulk/", [attack, {"attack_type": "Malware"}, attack], format="json")
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()["inserted"], 2)
+        self.assertEqual([e["index"] for e in response.json()["errors"]], [1])
+        self.assertEqual(CyberAttack.objects(attack_type="Malware").count(), 2)
+        self.assertIsNotNone(CyberAttack.objects(attack_type="Malware").first().source_location.point)
+
+    def test_bulk_ingest_ndjson(self):
+        line = json.dumps({
+            "source_location": {"latitude": 40.7, "longitude": -74.0, "country": "USA"},
+            "destination_location": {"latitude": 48.8, "longitude": 2.3, "country": "France"},
+            "attack_type": "Phishing",
+            "severity": 2,
+            "timestamp": "2025-05-04T12:00:00",
+        })
+        response = self.client.post(
+            "/api/attacks/bulk/?batch_size=1", f"{line}\n{line}\n", content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {"inserted": 2, "errors": []})
+
+    def test_convert_to_timeseries_needs_force(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        with self.assertRaisesMessage(CommandError, "--force"):
+            call_command("convert_to_timeseries")
+        self.assertEqual(CyberAttack.objects.count(), 5)
+
+    def test_generate_attacks(self):
+        from django.core.management import CommandError, call_command
+        call_command("generate_attacks", count=7, batch_size=3)
+        self.assertEqual(CyberAttack.objects.count(), 12)
+        for batch_size in (0, -1):
+            with self.assertRaisesMessage(CommandError, "--batch-size"):
+                call_command("generate_attacks", count=7, batch_size=batch_size)
+        self.assertEqual(CyberAttack.objects.count(), 12)
+
+    def test_fast_renderer_matches_json_renderer(self):
+        from rest_framework.renderers import JSONRenderer
+        from attacks.renderers import FastJSONRenderer, has_mismatched_float
+        # Hex ids with a digit before "e" are just strings
+        plain = {"id": "6817172b3e0f9aa6b9a87f4", "values": [0.0001, 1e15, {"severity": 9}]}
+        exponent = {"id": "6817172b3e0f9aa6b9a87f4", "values": [1e16, 1e-05]}
+        # Statistics count by integer severity
+        int_keys = {"by_severity": {9: 1, 10: 2}, "flags": {True: 1, None: 0, 1.5: 2}}
+        self.assertFalse(has_mismatched_float(plain))
+        self.assertTrue(has_mismatched_float(exponent))
+        self.assertFalse(has_mismatched_float(int_keys))
+        self.assertTrue(has_mismatched_float({1e16: 1}))
+        self.assertTrue(has_mismatched_float({datetime(2025, 5, 4): 1}))
+        for data in (plain, exponent, int_keys, {1e16: 1}):
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_list_matches_serializer_output(self):
+        from rest_framework.renderers import JSONRenderer
+        from attacks.serializers import CyberAttackSerializer
+        expected = CyberAttackSerializer(CyberAttack.objects.order_by('-timestamp')[:3], many=True).data
+        response = self.client.get("/api/attacks/recent/?limit=3")
+        self.assertEqual(response.content, JSONRenderer().render({"count": 3, "results": expected}))
+
+    def test_async_views_match_sync_views(self):
+        for path in [
+            "attacks/?page_size=3&page=2",
+            "attacks/?cursor=&page_size=2&attack_type=DDoS",
+            "attacks/recent/?limit=3",
+            "attacks/statistics/?min_severity=6",
+            "notifications/logs/",
+        ]:
+            self.assertEqual(self.client.get(f"/api/async/{path}").content, self.client.get(f"/api/{path}").content)
+        self.assertEqual(self.client.get("/api/async/attacks/recent/?limit=0").status_code, 400)
+
+    def test_async_views_under_wsgi_do_not_share_clients(self):
+        from attacks.mongo import _shared_clients
+        before = len(_shared_clients)
+        self.assertEqual(self.client.get("/api/async/attacks/recent/?limit=1").status_code, 200)
+        # The request's own loop is gone; nothing may be left registered for it
+        self.assertEqual(len(_shared_clients), before)
+
+    def test_stream_needs_asgi(self):
+        self.assertEqual(self.client.get("/api/attacks/stream/").status_code, 501)
+
+    def test_feed_skips_malformed_documents(self):
+        from bson import ObjectId
+        from django.http import QueryDict
+        from attacks.queries import attack_matcher
+        from attacks.stream import LiveFeed, Subscription
+
+        async def publish():
+            feed = LiveFeed(None)
+            subscription = Subscription(attack_matcher(QueryDict("country=France")))
+            feed.subscribers.add(subscription)
+            with self.assertLogs("attacks.stream", "WARNING"):
+                feed.publish("attack", {"_id": ObjectId(), "attack_type": "DDoS"})
+            attack = CyberAttack._get_collection().find_one()
+            feed.publish("attack", attack)
+            return subscription.queue.qsize()
+
+        import asyncio
+        self.assertEqual(asyncio.run(publish()), 1)
+
+    def test_feed_backs_off_when_polling_fails(self):
+        import asyncio
+        from unittest import mock
+        from pymongo.errors import OperationFailure
+        from attacks.stream import LiveFeed
+
+        async def run():
+            feed = LiveFeed(None, poll_interval=0.5)
+            feed.follow_change_stream = mock.AsyncMock(side_effect=OperationFailure("not a replica set"))
+            feed.poll = mock.AsyncMock(side_effect=OperationFailure("not authorized"))
+            sleeps = []
+
+            async def sleep(seconds):
+                sleeps.append(seconds)
+                if len(sleeps) == 4:
+                    raise asyncio.CancelledError
+
+            with mock.patch("attacks.stream.asyncio.sleep", sleep), self.assertLogs("attacks.stream", "WARNING"):
+                with self.assertRaises(asyncio.CancelledError):
+                    await feed.run()
+            return feed.follow_change_stream.await_count, sleeps
+
+        self.assertEqual(asyncio.run(run()), (1, [0.5, 1.0, 2.0, 4.0]))
+
+    def test_attack_matcher_agrees_with_filter(self):
+        from django.http import QueryDict
+        from attacks.queries import attack_filter, attack_matcher
+        collection = CyberAttack._get_collection()
+        for query in ["min_severity=7", "country=France&max_severity=6", "bbox=-80,35,-70,45", "near=2.35,48.85,50", "attack_type=Malware"]:
+            params = QueryDict(query)
+            expected = {attack["_id"] for attack in collection.find(attack_filter(params))}
+            matches = attack_matcher(params)
+            self.assertEqual({attack["_id"] for attack in collection.find() if matches(attack)}, expected, query)
+
+    async def test_stream_replays_after_last_event_id(self):
+        first = CyberAttack.objects.order_by('id').first()
+        response = await self.async_client.get(
+            "/api/attacks/stream/?min_severity=7", headers={"Last-Event-ID": str(first.id)}
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b"retry: 3000\n\n")
+        events = [(await anext(chunks)).decode() for _ in range(3)]
+        await chunks.aclose()
+        self.assertTrue(all(event.startswith("id: ") and "\nevent: attack\n" in event for event in events))
+        self.assertEqual([json.loads(event.split("data: ")[1])["severity"] for event in events], [7, 8, 9])
+
     def test_recent_attacks(self):
         response = self.client.get("/api/attacks/recent/?limit=3")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.json()["results"]), 3)
 
+    def test_visualization_data_streaming(self):
+        buffered = self.client.get("/api/attacks/visualization-data/?limit=3").json()
+        response = self.client.get("/api/attacks/visualization-data/?limit=3&stream=true")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), buffered)
+
+    def test_visualization_data_limit_is_checked(self):
+        for limit in (0, -1, 100_001):
+            response = self.client.get(f"/api/attacks/visualization-data/?limit={limit}")
+            self.assertEqual(response.status_code, 400)
+
+    def test_visualization_data_ndjson(self):
+        response = self.client.get("/api/attacks/visualization-data/?limit=3&format=ndjson")
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(json.loads(lines[0])["properties"]["direction"], "source")
+
+    def test_visualization_data_clustered(self):
+        response = self.client.get("/api/attacks/visualization-data/?cluster=true&zoom=0")
+        self.assertEqual(response.status_code, 200)
+        features = response.json()["features"]
+        self.assertEqual(len(features), 2)
+        for feature in features:
+            self.assertEqual(feature["properties"]["count"], 5)
+            self.assertEqual(feature["properties"]["max_severity"], 9)
+            self.assertEqual(feature["properties"]["by_attack_type"], {"DDoS": 5})
+
+        response = self.client.get("/api/attacks/visualization-data/?cluster=true&zoom=0&bbox=-10,40,10,60")
+        features = response.json()["features"]
+        self.assertEqual(len(features), 1)
+        self.assertAlmostEqual(features[0]["geometry"]["coordinates"][0], 2.3522)
+
     def test_statistics(self):
         response = self.client.get("/api/attacks/statistics/")
         self.assertEqual(response.status_code, 200)
         self.assertIn("by_country", response.json())
 
+    def test_statistics_with_filters(self):
+        response = self.client.get("/api/attacks/statistics/?attack_type=DDoS&min_severity=8")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["by_country"], {"USA": 2, "France": 2})
+        self.assertEqual(data["by_attack_type"], {"DDoS": 2})
+        self.assertEqual(data["by_severity"], {"8": 1, "9": 1})
+
+    def ingest_malware(self):
+        attack = {
+            "source_location": {"latitude": 40.7, "longitude": -74.0, "country": "USA"},
+            "destination_location": {"latitude": 48.8, "longitude": 2.3, "country": "France"},
+            "attack_type": "Malware",
+            "severity": 4,
+        }
+        timestamps = ["2025-05-04T12:00:00", "2025-05-04T12:00:30", "2025-05-04T12:59:00", "2025-05-04T13:00:00"]
+        self.client.post("/api/attacks/bulk/", [dict(attack, timestamp=ts) for ts in timestamps], format="json")
+
+    def test_rollups_maintained_on_ingest(self):
+        self.ingest_malware()
+        minutes = {row.bucket: row.count for row in AttackRollup.objects(granularity="minute")}
+        self.assertEqual(minutes[datetime(2025, 5, 4, 12, 0)], 2)
+        hours = {row.bucket: row.count for row in AttackRollup.objects(granularity="hour")}
+        self.assertEqual(hours, {datetime(2025, 5, 4, 12): 3, datetime(2025, 5, 4, 13): 1})
+
+    def test_rebuild_rollups(self):
+        from django.core.management import call_command
+        self.ingest_malware()
+        AttackRollup.objects.delete()
+        call_command("rebuild_rollups")
+        self.assertEqual(sum(row.count for row in AttackRollup.objects(granularity="hour")), 9)
+        self.assertEqual(AttackRollup.objects(granularity="hour", attack_type="Malware").sum("count"), 4)
+
+        # Minute rollups alone leave the hour-based summaries and sketches as they are
+        IPSketch.objects.delete()
+        call_command("rebuild_rollups", granularity=["minute"])
+        self.assertEqual(IPSketch.objects.count(), 0)
+
+    @override_settings(ATTACK_STATISTICS_FROM_ROLLUPS=True)
+    def test_statistics_from_rollups(self):
+        self.ingest_malware()
+        CyberAttack.objects(attack_type="Malware").update(set__severity=1)
+
+        # Hour-aligned: served from rollups, which still hold the ingested severity
+        aligned = self.client.get("/api/attacks/statistics/?attack_type=Malware&start=2025-05-04T12:00:00&end=2025-05-04T13:00:00").json()
+        self.assertEqual(aligned["by_attack_type"], {"Malware": 4})
+        self.assertEqual(aligned["by_severity"], {"4": 3, "1": 1})
+
+        # Not aligned to a minute: falls back to the raw attacks
+        raw = self.client.get("/api/attacks/statistics/?attack_type=Malware&start=2025-05-04T12:00:10").json()
+        self.assertEqual(raw["by_severity"], {"1": 3})
+
+    def test_histogram(self):
+        response = self.client.get("/api/attacks/histogram/?interval=5m&group_by=severity")
+        self.assertEqual(response.status_code, 200)
+        buckets = response.json()["buckets"]
+        self.assertEqual(len(buckets), 24 * 12 + 1)
+        self.assertEqual(sum(bucket["count"] for bucket in buckets), 5)
+        severities = {}
+        for bucket in buckets:
+            for severity, count in bucket["groups"].items():
+                severities[severity] = severities.get(severity, 0) + count
+        self.assertEqual(severities, {"5": 1, "6": 1, "7": 1, "8": 1, "9": 1})
+
+    def test_histogram_fills_empty_buckets(self):
+        self.ingest_malware()
+        response = self.client.get(
+            "/api/attacks/histogram/?attack_type=Malware&interval=30m&start=2025-05-04T11:00:00&end=2025-05-04T13:00:00"
+        )
+        self.assertEqual([bucket["count"] for bucket in response.json()["buckets"]], [0, 0, 2, 1, 1])
+        self.assertEqual(self.client.get("/api/attacks/histogram/?interval=5x").status_code, 400)
+
+    def test_cached_until_next_write(self):
+        first = self.client.get("/api/attacks/recent/?limit=10")
+        # Bypasses ingest, so the cached response is still served
+        CyberAttack.objects.delete()
+        self.assertEqual(self.client.get("/api/attacks/recent/?limit=10").json()["count"], 5)
+
+        self.ingest_malware()
+        second = self.client.get("/api/attacks/recent/?limit=10")
+        self.assertEqual(second.json()["count"], 4)
+        self.assertNotEqual(first["ETag"], second["ETag"])
+
+    def test_etag_not_modified(self):
+        response = self.client.get("/api/attacks/statistics/?attack_type=DDoS&min_severity=1")
+        etag = response["ETag"]
+        # Parameter order does not matter
+        reordered = self.client.get("/api/attacks/statistics/?min_severity=1&attack_type=DDoS", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(reordered.status_code, 304)
+
+        # Only while the response is still cached
+        cache.clear()
+        expired = self.client.get("/api/attacks/statistics/?attack_type=DDoS&min_severity=1", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(expired.status_code, 200)
+
+        self.ingest_malware()
+        changed = self.client.get("/api/attacks/statistics/?attack_type=DDoS&min_severity=1", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+
+    def test_data_version_is_shared_between_processes(self):
+        from attacks.caching import VERSION_NAME
+        from attacks.models import DataVersion
+        first = self.client.get("/api/attacks/recent/?limit=10")
+        # Another process's write: the version in MongoDB moves, this process's cache is untouched
+        DataVersion._get_collection().update_one({"_id": VERSION_NAME}, {"$inc": {"version": 1}})
+        second = self.client.get("/api/attacks/recent/?limit=10", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(first["ETag"], second["ETag"])
+
+    def test_follower_rechecks_cache_after_leader(self):
+        from attacks.caching import wait_for_leader
+        # The leader stored its data and released the lock between the follower's polls
+        cache.set("attacks:response:test", {"total": 5})
+        self.assertEqual(wait_for_leader("attacks:response:test"), {"total": 5})
+        self.assertIsNone(wait_for_leader("attacks:response:missing"))
+
+    def test_flow_summary_update_retries_lost_races(self):
+        from collections import Counter
+        from attacks.flows import update_summaries
+        self.ingest_malware()
+        collection = FlowSummary._get_collection()
+        stale = collection.find_one({"granularity": "hour"})
+        key, flow = (stale["granularity"], stale["bucket"]), ("USA", "France", "Malware")
+        counted = next(row["count"] for row in stale["counters"] if row["src_country"] == "USA")
+
+        # Another ingest moves the version after this one read the summary
+        update_summaries(collection, {key: Counter({flow: 1})}, 500)
+
+        class StaleRead:
+            reads = 0
+
+            def find(self, query):
+                self.reads += 1
+                return [stale] if self.reads == 1 else collection.find(query)
+
+            def __getattr__(self, name):
+                return getattr(collection, name)
+
+        reader = StaleRead()
+        update_summaries(reader, {key: Counter({flow: 2})}, 500)
+        self.assertEqual(reader.reads, 2)
+        stored = collection.find_one({"_id": stale["_id"]})
+        self.assertEqual(stored["counters"][0]["count"], counted + 3)
+        self.assertEqual(collection.count_documents({"granularity": key[0], "bucket": key[1]}), 1)
+
+    def test_rebuild_summaries_overwrites_recreated_buckets(self):
+        from unittest import mock
+        from attacks.flows import rebuild_summaries
+        self.ingest_malware()
+        collection = FlowSummary._get_collection()
+        delete_many = collection.delete_many
+
+        def delete_then_ingest(query):
+            # An ingest recreates the buckets between the delete and the rebuild's writes
+            result = delete_many(query)
+            self.ingest_malware()
+            return result
+
+        with mock.patch.object(type(collection), "delete_many", side_effect=delete_then_ingest):
+            self.assertGreater(rebuild_summaries(), 0)
+        self.assertEqual(collection.count_documents({}), len(set(
+            (document["granularity"], document["bucket"]) for document in collection.find()
+        )))
+
+    def test_top_flows(self):
+        from django.core.management import call_command
+        self.ingest_malware()
+        malware = {"src_country": "USA", "dst_country": "France", "attack_type": "Malware"}
+
+        # Two days from the daily summaries
+        days = "start=2025-05-03T00:00:00&end=2025-05-05T00:00:00"
+        data = self.client.get(f"/api/attacks/flows/?{days}").json()
+        self.assertEqual(data["flows"], [dict(malware, count=4, error=0)])
+        self.assertTrue(data["exact"])
+        # Hourly summaries plus the partial hour at the start, counted exactly
+        hours = "start=2025-05-04T12:30:00&end=2025-05-04T23:00:00"
+        self.assertEqual(self.client.get(f"/api/attacks/flows/?{hours}").json()["flows"], [dict(malware, count=2, error=0)])
+
+        FlowSummary.objects.delete()
+        call_command("rebuild_rollups")
+        self.assertEqual(self.client.get(f"/api/attacks/flows/?{days}").json()["flows"], [dict(malware, count=4, error=0)])
+        self.assertEqual(self.client.get("/api/attacks/flows/?limit=0").status_code, 400)
+
+    def test_flow_summaries_bound_counts(self):
+        from collections import Counter
+        from attacks.flows import exact_summary, merge_summaries
+        flows = [("USA", "France", "DDoS")] * 50 + [(f"C{i}", "France", "DDoS") for i in range(30)]
+        true = Counter(flows)
+        summaries = [merge_summaries([exact_summary(Counter(flows[i::4]))], 5) for i in range(4)]
+        counters, floor = merge_summaries(summaries, 5)
+        self.assertGreater(floor, 0)
+        for key, (count, error) in counters.items():
+            self.assertLessEqual(count - error, true[key])
+            self.assertLessEqual(true[key], count)
+        self.assertEqual(max(counters, key=lambda key: counters[key][0]), ("USA", "France", "DDoS"))
+
+    def test_distinct_ip_cardinality(self):
+        from django.core.management import call_command
+        attacks = [{
+            "source_location": {"latitude": 40.7, "longitude": -74.0, "country": "USA"},
+            "destination_location": {"latitude": 52.5, "longitude": 13.4, "country": "Germany"},
+            "attack_type": "DDoS",
+            "severity": 6,
+            "timestamp": f"2025-05-04T{10 + i // 4:02d}:{i % 4 * 15:02d}:00",
+            "additional_details": {"ip_src": f"203.0.113.{i % 4}", "ip_dst": "198.51.100.1"},
+        } for i in range(6)]
+        self.client.post("/api/attacks/bulk/", attacks, format="json")
+
+        days = "start=2025-05-03T00:00:00&end=2025-05-05T00:00:00"
+        data = self.client.get(f"/api/attacks/cardinality/?country=Germany&attack_type=DDoS&{days}").json()
+        self.assertEqual(data["distinct"], 4)
+        self.assertEqual(self.client.get(f"/api/attacks/cardinality/?ip=dst&country=USA&{days}").json()["distinct"], 1)
+        self.assertEqual(self.client.get(f"/api/attacks/cardinality/?country=France&{days}").json()["distinct"], 0)
+        # 10:45 from the raw attacks, 11:00 and 11:15 from the hourly sketches
+        partial = "start=2025-05-04T10:40:00&end=2025-05-04T23:00:00"
+        self.assertEqual(self.client.get(f"/api/attacks/cardinality/?country=Germany&{partial}").json()["distinct"], 3)
+
+        IPSketch.objects.delete()
+        call_command("rebuild_rollups")
+        self.assertEqual(self.client.get(f"/api/attacks/cardinality/?{days}").json()["distinct"], 4)
+        self.assertEqual(self.client.get("/api/attacks/cardinality/?ip=both").status_code, 400)
+
+    def test_faceted_search(self):
+        self.ingest_malware()
+        params = "attack_type=Malware&min_severity=1&page_size=2"
+        response = self.client.get(f"/api/attacks/?{params}&facets=true")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+
+        plain = self.client.get(f"/api/attacks/?{params}").json()
+        self.assertEqual(data["total"], plain["total"])
+        self.assertEqual(data["results"], plain["results"])
+        self.assertEqual(data["facets"], self.client.get(f"/api/attacks/statistics/?{params}").json())
+        self.assertEqual(self.client.get(f"/api/async/attacks/?{params}&facets=true").json(), data)
+
+        # $limit: 0 and a negative $skip are server errors; they must be a 400 first
+        for query in ["page_size=0", "page=-1", "page_size=5000"]:
+            self.assertEqual(self.client.get(f"/api/attacks/?facets=true&{query}").status_code, 400, query)
+            self.assertEqual(self.client.get(f"/api/async/attacks/?facets=true&{query}").status_code, 400, query)
+
+    def test_bench(self):
+        import os
+        import tempfile
+        from io import StringIO
+        from django.core.management import call_command
+        from mongoengine.connection import get_db
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "bench.json")
+            call_command("bench", size=200, repeat=2, rules="5", db="cyberattacks_test_bench", output=output,
+                         stdout=StringIO())
+            with open(output) as handle:
+                results = json.load(handle)
+        bench = get_db().client["cyberattacks_test_bench"]
+        # The bulk benchmark's attacks are gone from the rollups too
+        hourly = bench[AttackRollup._get_collection_name()].aggregate([
+            {"$match": {"granularity": "hour"}}, {"$group": {"_id": None, "count": {"$sum": "$count"}}},
+        ]).next()
+        self.assertEqual(hourly["count"], bench[CyberAttack._get_collection_name()].count_documents({}))
+        get_db().client.drop_database("cyberattacks_test_bench")
+
+        self.assertEqual(results["rules"][0]["attacks"], 200)
+        names = [case["name"] for case in results["endpoints"]]
+        for name in ("async statistics: type", "flows: last week", "cardinality: source IPs, last week",
+                     "backtest: last day", "visualization: streamed", "visualization: ndjson"):
+            self.assertIn(name, names)
+        for case in results["endpoints"]:
+            self.assertLessEqual(case["p50_ms"], case["p99_ms"])
+        # Back on the test database afterwards
+        self.assertEqual(CyberAttack.objects.count(), 5)
+
+    def test_bench_refuses_other_databases(self):
+        from django.conf import settings
+        from django.core.management import CommandError, call_command
+        for db in (settings.MONGODB['db'], "production"):
+            with self.assertRaisesMessage(CommandError, "_bench"):
+                call_command("bench", size=10, db=db)
+        self.assertEqual(CyberAttack.objects.count(), 5)
+
+    @override_settings(ATTACK_SERVER_TIMING=True)
+    def test_request_metrics(self):
+        response = self.client.get("/api/attacks/?page_size=3")
+        self.assertIn('desc="2 commands, 3 documents"', response["Server-Timing"])
+
+        metrics = self.client.get("/metrics").content.decode()
+        self.assertIn('attackmap_request_seconds_count{route="/api/attacks/",method="GET"}', metrics)
+        self.assertIn('attackmap_request_mongo_documents_bucket{route="/api/attacks/",method="GET",le="5"}', metrics)
+
 from rest_framework.test import APIClient
 from django.test import TestCase
-from attacks.models import NotificationRule, Notification, CyberAttack, Location
+from attacks.models import NotificationRule, Notification, CyberAttack, Location, RuleEngineState
 from datetime import datetime
 
 class NotificationSystemTestCase(TestCase):
@@ -53,6 +602,7 @@ class NotificationSystemTestCase(TestCase):
         NotificationRule.objects.delete()
         Notification.objects.delete()
         CyberAttack.objects.delete()
+        RuleEngineState.objects.delete()
 
         loc_usa = Location(latitude=40.0, longitude=-75.0, country="USA")
         loc_de = Location(latitude=52.5, longitude=13.4, country="Germany")
@@ -107,6 +657,298 @@ class NotificationSystemTestCase(TestCase):
         self.assertGreaterEqual(len(notifications), 1)
         self.assertEqual(notifications[0].rule_name, "DDoS USA Trigger")
 
+    def test_rule_evaluation_is_incremental(self):
+        from django.core.management import call_command
+        NotificationRule(name="DDoS", attack_type="DDoS").save()
+        call_command("evaluate_rules")
+        self.assertEqual(Notification.objects(rule_name="DDoS").count(), 3)
+
+        CyberAttack(
+            source_location=Location(latitude=40.0, longitude=-75.0, country="USA"),
+            destination_location=Location(latitude=52.5, longitude=13.4, country="Germany"),
+            attack_type="DDoS",
+            severity=3,
+            timestamp=datetime.utcnow(),
+        ).save()
+        call_command("evaluate_rules")
+        self.assertEqual(Notification.objects(rule_name="DDoS").count(), 4)
+        self.assertEqual(RuleEngineState.objects.get(name="evaluate_rules").last_attack_id,
+                         CyberAttack.objects.order_by('-id').first().id)
+
+    def test_rule_evaluation_picks_up_late_commits(self):
+        from bson import ObjectId
+        from django.core.management import call_command
+        NotificationRule(name="DDoS", attack_type="DDoS").save()
+        call_command("evaluate_rules")
+        high_water = RuleEngineState.objects.get(name="evaluate_rules").last_attack_id
+
+        # Another writer's attack, with an _id below the mark, becomes visible only now
+        CyberAttack(
+            id=ObjectId.from_datetime(high_water.generation_time),
+            source_location=Location(latitude=40.0, longitude=-75.0, country="USA"),
+            destination_location=Location(latitude=52.5, longitude=13.4, country="Germany"),
+            attack_type="DDoS",
+            severity=3,
+            timestamp=datetime.utcnow(),
+        ).save()
+        call_command("evaluate_rules")
+        self.assertEqual(Notification.objects(rule_name="DDoS").count(), 4)
+        self.assertEqual(RuleEngineState.objects.get(name="evaluate_rules").last_attack_id, high_water)
+
+    def test_rule_metrics_file(self):
+        import os
+        import tempfile
+        from django.core.management import call_command
+        NotificationRule(name="DDoS", attack_type="DDoS").save()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rules.prom")
+            call_command("evaluate_rules", metrics_file=path)
+            with open(path) as handle:
+                metrics = handle.read()
+        self.assertIn('attackmap_rule_matches_total{worker="evaluate_rules",rule="DDoS"}', metrics)
+        self.assertIn('attackmap_rule_pass_seconds_count{worker="evaluate_rules"}', metrics)
+
+    def test_new_rule_catches_up_on_history(self):
+        from datetime import timedelta
+        from django.core.management import call_command
+        attack = CyberAttack.objects.first()
+        CyberAttack(
+            source_location=attack.source_location, destination_location=attack.destination_location,
+            attack_type="DDoS", severity=10, timestamp=datetime.utcnow() - timedelta(hours=2),
+        ).save()
+        call_command("evaluate_rules")
+
+        NotificationRule(name="Germany", country="Germany", min_severity=9).save()
+        NotificationRule(name="Recent", country="Germany", min_severity=9, time_window_minutes=30).save()
+        NotificationRule(name="Phishing", attack_type="Phishing").save()
+        call_command("evaluate_rules")
+        self.assertEqual(Notification.objects(rule_name="Germany").count(), 3)
+        self.assertEqual(Notification.objects(rule_name="Recent").count(), 2)
+        self.assertEqual(Notification.objects(rule_name="Phishing").count(), 0)
+
+    def test_rule_evaluation_is_idempotent(self):
+        from django.core.management import call_command
+        from io import StringIO
+        NotificationRule(name="DDoS", attack_type="DDoS").save()
+        call_command("evaluate_rules")
+
+        out = StringIO()
+        call_command("evaluate_rules", full=True, stdout=out)
+        self.assertEqual(Notification.objects(rule_name="DDoS").count(), 3)
+        self.assertIn("Total new notifications created: 0 (3 already present)", out.getvalue())
+
+    def test_threshold_rule_respects_window_and_cooldown(self):
+        from django.core.management import call_command
+        from datetime import timedelta
+        CyberAttack(
+            source_location=Location(latitude=40.0, longitude=-75.0, country="USA"),
+            destination_location=Location(latitude=52.5, longitude=13.4, country="Germany"),
+            attack_type="DDoS",
+            severity=9,
+            timestamp=datetime.utcnow() - timedelta(hours=2),
+        ).save()
+        rule = NotificationRule(name="DDoS surge", attack_type="DDoS", threshold_count=3, time_window_minutes=60)
+        rule.save()
+
+        call_command("evaluate_rules")
+        volume = Notification.objects(rule_name="DDoS surge")
+        self.assertEqual(volume.count(), 1)
+        self.assertEqual(volume.first().details["matched_count"], 3)
+
+        # Still above the threshold, but inside the cooldown
+        call_command("evaluate_rules")
+        self.assertEqual(Notification.objects(rule_name="DDoS surge").count(), 1)
+
+    def test_threshold_rule_below_threshold(self):
+        from django.core.management import call_command
+        NotificationRule(name="Quiet", attack_type="DDoS", threshold_count=4, time_window_minutes=60).save()
+        call_command("evaluate_rules")
+        self.assertEqual(Notification.objects(rule_name="Quiet").count(), 0)
+
+    def test_backtest_replays_history_without_writing(self):
+        from django.core.management import call_command
+        from datetime import timedelta
+        from io import StringIO
+        base = datetime(2025, 5, 4, 12, 0)
+        for minute in (0, 1, 2, 30, 31, 32):
+            CyberAttack(
+                source_location=Location(latitude=40.0, longitude=-75.0, country="USA"),
+                destination_location=Location(latitude=52.5, longitude=13.4, country="Germany"),
+                attack_type="DDoS",
+                severity=5,
+                timestamp=base + timedelta(minutes=minute),
+            ).save()
+        NotificationRule(name="DDoS", attack_type="DDoS", active=False).save()
+        NotificationRule(
+            name="DDoS surge", attack_type="DDoS", threshold_count=3, time_window_minutes=10, cooldown_minutes=20
+        ).save()
+
+        # The 12:00 attack is before start, but still in the surge window at 12:02
+        out = StringIO()
+        call_command("evaluate_rules", backtest=True, start=base + timedelta(minutes=1), end=base + timedelta(hours=1),
+                     stdout=out)
+        self.assertIn("DDoS: 5 triggers", out.getvalue())
+        self.assertIn("DDoS surge: 2 triggers\n  2025-05-04T12:02:00\n  2025-05-04T12:32:00", out.getvalue())
+        self.assertEqual(Notification.objects.count(), 0)
+        self.assertIsNone(NotificationRule.objects.get(name="DDoS surge").last_triggered_at)
+
+        response = self.client.post("/api/notifications/rules/backtest/", {
+            "start": "2025-05-04T12:00:00",
+            "end": "2025-05-04T13:00:00",
+            "rules": [{"name": "Candidate", "attack_type": "DDoS", "threshold_count": 2, "time_window_minutes": 1}],
+        }, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["attacks"], 6)
+        self.assertEqual(response.json()["rules"], [{
+            "rule": "Candidate", "triggers": 2, "timestamps": ["2025-05-04T12:01:00", "2025-05-04T12:31:00"],
+        }])
+
+        response = self.client.get(
+            "/api/notifications/rules/backtest/?rule_name=DDoS&start=2025-05-04T12:00:00&end=2025-05-04T13:00:00&limit=1"
+        )
+        self.assertEqual(response.json()["rules"], [{"rule": "DDoS", "triggers": 6, "timestamps": ["2025-05-04T12:00:00"]}])
+
+    def test_backtest_windows_with_and_without_numpy(self):
+        import random
+        from array import array
+        from unittest import mock
+        from attacks import backtest
+        rng = random.Random(7)
+        times = array("q", sorted(rng.randrange(3_600_000) for _ in range(500)))
+        for threshold, window in [(1, 0), (3, 10_000), (5, 60_000), (600, 60_000)]:
+            with mock.patch.object(backtest, "numpy", None):
+                expected = backtest.window_ends(times, threshold, window)
+            if backtest.numpy is not None:
+                self.assertEqual(backtest.window_ends(times, threshold, window), expected)
+            self.assertEqual(expected, [
+                index for index in range(len(times))
+                if sum(times[index] - window <= time <= times[index] for time in times[:index + 1]) >= threshold
+            ])
+
+    def test_backtest_rejects_malformed_bodies(self):
+        for body in [
+            {"start": 12345, "rules": []},
+            {"end": ["2025-05-04"], "rules": []},
+            {"limit": "many", "rules": []},
+            {"limit": -1, "rules": []},
+            {"rules": [{"attack_type": "DDoS"}]},
+            {"start": "2025-05-05T00:00:00", "end": "2025-05-04T00:00:00", "rules": []},
+        ]:
+            response = self.client.post("/api/notifications/rules/backtest/", body, format="json")
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_rule_engine_processes_new_attacks(self):
+        import asyncio
+        from attacks.engine import RuleEngine
+        from attacks.mongo import async_client, async_database
+        NotificationRule(name="Per attack", attack_type="DDoS", country="Germany").save()
+        NotificationRule(name="Surge", attack_type="DDoS", threshold_count=5, time_window_minutes=60).save()
+
+        async def run_once():
+            client = async_client()
+            try:
+                engine = RuleEngine(async_database(client))
+                await engine.load_state()
+                await engine.reload_rules()
+                for i in range(2):
+                    CyberAttack(
+                        source_location=Location(latitude=40.0, longitude=-75.0, country="USA"),
+                        destination_location=Location(latitude=52.5, longitude=13.4, country="Germany"),
+                        attack_type="DDoS",
+                        severity=5,
+                        timestamp=datetime.utcnow(),
+                    ).save()
+                await engine.poll_cycle()
+                await engine.checkpoint()
+                return engine
+            finally:
+                await client.close()
+
+        engine = asyncio.run(run_once())
+        # Only the two attacks inserted after start-up, but the surge counter saw all five
+        self.assertEqual(Notification.objects(rule_name="Per attack").count(), 2)
+        self.assertEqual(Notification.objects(rule_name="Surge").count(), 1)
+        self.assertEqual(RuleEngineState.objects.get(name="run_rule_engine").last_attack_id, engine.last_id)
+
+    def test_partitioned_evaluation_covers_all_rules(self):
+        from django.core.management import call_command
+        from attacks.models import RuleLease, WorkerHeartbeat
+        RuleLease.objects.delete()
+        WorkerHeartbeat.objects.delete()
+        NotificationRule(name="DDoS", attack_type="DDoS").save()
+        NotificationRule(name="Germany", country="Germany").save()
+
+        call_command("evaluate_rules", partitions=4, worker_id="test-worker")
+        self.assertEqual(Notification.objects(rule_name="DDoS").count(), 3)
+        self.assertEqual(Notification.objects(rule_name="Germany").count(), 3)
+        self.assertEqual(RuleLease.objects(owner="test-worker").count(), 0)
+
+    def test_lost_lease_stops_evaluation(self):
+        from datetime import timedelta
+        from attacks.leases import LeaseCoordinator, LeaseLost, ShardedEvaluator
+        from attacks.models import RuleLease, WorkerHeartbeat
+        RuleLease.objects.delete()
+        WorkerHeartbeat.objects.delete()
+        NotificationRule(name="DDoS", attack_type="DDoS").save()
+
+        coordinator = LeaseCoordinator("slow-worker", 1, lease_seconds=0)
+        self.assertTrue(coordinator.claim(0, datetime.utcnow() - timedelta(seconds=1)))
+        # The lease lapsed and another worker took it
+        self.assertTrue(LeaseCoordinator("other-worker", 1).claim(0, datetime.utcnow()))
+        with self.assertRaises(LeaseLost):
+            coordinator.renew(0)
+        with self.assertRaises(LeaseLost):
+            ShardedEvaluator("slow-worker", 1, lease_seconds=0).keep_alive(0)()
+
+    def test_invalid_option_combinations(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        for options in [{"processes": 2}, {"loop": 5}, {"full": True, "partitions": 2}, {"backtest": True, "full": True}]:
+            with self.assertRaises(CommandError):
+                call_command("evaluate_rules", **options)
+
+    def test_sigterm_stops_worker_processes(self):
+        import signal
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+
+        class Worker:
+            def __init__(self, target, args):
+                self.alive = False
+
+            def start(self):
+                self.alive = True
+
+            def is_alive(self):
+                return self.alive
+
+            def terminate(self):
+                self.alive = False
+
+            def join(self):
+                # docker stop signals only the parent
+                if self.alive:
+                    signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+
+        handler = signal.getsignal(signal.SIGTERM)
+        context = mock.Mock(Process=Worker)
+        with mock.patch("multiprocessing.get_context", return_value=context):
+            call_command("evaluate_rules", partitions=2, processes=2, stdout=StringIO())
+        self.assertIs(signal.getsignal(signal.SIGTERM), handler)
+
+    def test_volume_trigger_is_compare_and_set(self):
+        from attacks.rules import trigger_volume
+        rule = NotificationRule(name="Surge", attack_type="DDoS", threshold_count=1)
+        rule.save()
+        stale = NotificationRule.objects.get(id=rule.id)
+
+        self.assertTrue(trigger_volume(rule, 3))
+        # A second worker holding the old last_triggered_at loses the race
+        self.assertFalse(trigger_volume(stale, 3))
+        self.assertEqual(Notification.objects(rule_name="Surge").count(), 1)
+        self.assertEqual(stale.last_triggered_at, rule.last_triggered_at)
+
     def test_get_notifications_logs(self):
         # Create a notification manually
         Notification(
@@ -117,4 +959,85 @@ class NotificationSystemTestCase(TestCase):
 
         response = self.client.get("/api/notifications/logs/")
         self.assertEqual(response.status_code, 200)
-        self.assertGreaterEqual(len(response.json()), 1)
+        self.assertGreaterEqual(len(response.json()["results"]), 1)
+
+    def test_notification_log_pages_and_filters(self):
+        from datetime import timedelta
+        start = datetime(2025, 5, 4, 12, 0)
+        for i in range(5):
+            Notification(rule_name="Noisy", attack_id=f"attack-{i}", triggered_at=start + timedelta(minutes=i)).save()
+        Notification(rule_name="Quiet", attack_id="attack-0", triggered_at=start).save()
+
+        seen, cursor = [], ""
+        while cursor is not None:
+            page = self.client.get(f"/api/notifications/logs/?rule_name=Noisy&page_size=2&cursor={cursor}").json()
+            seen += [log["attack_id"] for log in page["results"]]
+            cursor = page["next"]
+        self.assertEqual(seen, [f"attack-{i}" for i in reversed(range(5))])
+
+        page = self.client.get("/api/notifications/logs/?attack_id=attack-0").json()
+        self.assertEqual(sorted(log["rule_name"] for log in page["results"]), ["Noisy", "Quiet"])
+        page = self.client.get("/api/notifications/logs/?start=2025-05-04T12:01:00&end=2025-05-04T12:02:00").json()
+        self.assertEqual([log["attack_id"] for log in page["results"]], ["attack-2", "attack-1"])
+        self.assertEqual(page["total"], 2)
+
+    def test_notification_retention_index(self):
+        from django.core.management import call_command
+        from attacks.models import notification_retention_seconds
+        # Opt-in: nothing expires unless retention is configured
+        self.assertIsNone(notification_retention_seconds())
+        call_command("sync_indexes")
+        self.assertFalse(any("expireAfterSeconds" in index for index in Notification._get_collection().list_indexes()))
+        # The TTL counts from triggered_at, which is naive UTC like every other timestamp
+        triggered_at = Notification(rule_name="Rule", attack_id="attack").triggered_at
+        self.assertLess(abs(triggered_at - datetime.utcnow()).total_seconds(), 60)
+
+    def test_notification_retention_changes(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from attacks.management.commands.sync_indexes import Command
+        collection = Notification._get_collection()
+        call_command("sync_indexes", stdout=StringIO())
+
+        # A new period: the TTL is changed in place
+        collection.create_index("triggered_at", expireAfterSeconds=60)
+        with override_settings(ATTACK_NOTIFICATION_RETENTION_DAYS=1):
+            Command(stdout=StringIO()).sync_retention(dry_run=False)
+        indexes = {index["name"]: index for index in collection.list_indexes()}
+        self.assertEqual(indexes["triggered_at_1"]["expireAfterSeconds"], 86400)
+
+        # Back to the default, with another index missing: the TTL goes before ensure_indexes runs
+        collection.drop_index("attack_id_1")
+        call_command("sync_indexes", stdout=StringIO())
+        indexes = {index["name"]: index for index in collection.list_indexes()}
+        self.assertFalse(any("expireAfterSeconds" in index for index in indexes.values()))
+        self.assertIn("attack_id_1", indexes)
+
+    def test_sync_indexes_removes_duplicate_notifications(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from attacks.models import VOLUME_TRIGGER_ID
+        collection = Notification._get_collection()
+        collection.drop_indexes()
+        first = collection.insert_one({"rule_name": "Test Rule", "attack_id": "someid123"}).inserted_id
+        collection.insert_many([{"rule_name": "Test Rule", "attack_id": "someid123"} for _ in range(2)])
+        collection.insert_many([{"rule_name": "Test Rule", "attack_id": VOLUME_TRIGGER_ID} for _ in range(2)])
+
+        out = StringIO()
+        call_command("sync_indexes", dry_run=True, stdout=out)
+        self.assertIn("2 duplicate notification(s)", out.getvalue())
+        self.assertEqual(collection.count_documents({}), 5)
+
+        call_command("sync_indexes", stdout=StringIO())
+        self.assertEqual([doc["_id"] for doc in collection.find({"attack_id": "someid123"})], [first])
+        # Volume triggers share their attack_id and are kept
+        self.assertEqual(collection.count_documents({"attack_id": VOLUME_TRIGGER_ID}), 2)
+
+    def test_notification_unique_per_rule_and_attack(self):
+        from django.core.management import call_command
+        from mongoengine.errors import NotUniqueError
+        call_command("sync_indexes")
+
+        Notification(rule_name="Test Rule", attack_id="someid123").save()
+        with self.assertRaises(NotUniqueError):
+            Notification(rule_name="Test Rule", attack_id="someid123").save()
@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import serializers
+
+_datetime_field = serializers.DateTimeField()
+
+
+def datetime_value(value):
+    # Naive UTC from MongoDB: what DateTimeField renders, without its timezone round trip
+    if value.tzinfo is None and settings.USE_TZ and timezone.get_current_timezone_name() == "UTC":
+        return value.isoformat() + "Z"
+    return _datetime_field.to_representation(value)
+
+
+def dict_value(value):
+    return {str(key): item for key, item in value.items()}
+
+
+def record_transform(fields):
+    """Compile (output name, stored name, convert, default) specs into a document -> dict function.
+
+    Mirrors what the matching DRF Serializer produces from a hydrated
+    Document: fields appear in declaration order, missing values take the
+    Document's default and ``None`` is never converted.
+    """
+    fields = tuple(fields)
+
+    def transform(document):
+        record = {}
+        for name, stored, convert, default in fields:
+            value = document.get(stored, default)
+            record[name] = None if value is None else convert(value)
+        return record
+
+    return transform
+
+
+location_record = record_transform([
+    ("latitude", "latitude", float, None),
+    ("longitude", "longitude", float, None),
+    ("country", "country", str, None),
+])
+
+# Same output as CyberAttackSerializer
+attack_record = record_transform([
+    ("source_location", "source_location", location_record, None),
+    ("destination_location", "destination_location", location_record, None),
+    ("attack_type", "attack_type", str, None),
+    ("severity", "severity", int, None),
+    ("timestamp", "timestamp", datetime_value, None),
+    ("additional_details", "additional_details", dict_value, {}),
+])
+
+ATTACK_RECORD_PROJECTION = {
+    "source_location.latitude": 1,
+    "source_location.longitude": 1,
+    "source_location.country": 1,
+    "destination_location.latitude": 1,
+    "destination_location.longitude": 1,
+    "destination_location.country": 1,
+    "attack_type": 1,
+    "severity": 1,
+    "timestamp": 1,
+    "additional_details": 1,
+}
+
+# Same output as NotificationSerializer
+notification_record = record_transform([
+    ("id", "_id", str, None),
+    ("rule_name", "rule_name", str, None),
+    ("attack_id", "attack_id", str, None),
+    ("triggered_at", "triggered_at", datetime_value, None),
+    ("details", "details", dict_value, {}),
+])
@@ -1,11 +1,28 @@
 from django.urls import path
-from .views import AttackListView, RecentAttackView, VisualizationDataView, AttackStatisticsView, NotificationRuleView, NotificationLogView
+from .async_views import (
+    AsyncAttackListView, AsyncRecentAttackView, AsyncAttackStatisticsView, AsyncAttackHistogramView, AsyncNotificationLogView,
+    AttackStreamView,
+)
+from .views import AttackListView, AttackBulkView, RecentAttackView, VisualizationDataView, AttackStatisticsView, AttackHistogramView, AttackFlowView, AttackCardinalityView, NotificationRuleView, RuleBacktestView, NotificationLogView, MetricsView
 
 urlpatterns = [
     path('api/attacks/', AttackListView.as_view()),
+    path('api/attacks/bulk/', AttackBulkView.as_view()),
     path('api/attacks/recent/', RecentAttackView.as_view()),
     path('api/attacks/visualization-data/', VisualizationDataView.as_view()),
     path('api/attacks/statistics/', AttackStatisticsView.as_view()),
+    path('api/attacks/histogram/', AttackHistogramView.as_view()),
+    path('api/attacks/flows/', AttackFlowView.as_view()),
+    path('api/attacks/cardinality/', AttackCardinalityView.as_view()),
+    path('api/attacks/stream/', AttackStreamView.as_view()),
     path('api/notifications/rules/', NotificationRuleView.as_view()),
+    path('api/notifications/rules/backtest/', RuleBacktestView.as_view()),
     path('api/notifications/logs/', NotificationLogView.as_view()),
+    path('metrics', MetricsView.as_view()),
+    # Async variants of the read endpoints, for ASGI servers
+    path('api/async/attacks/', AsyncAttackListView.as_view()),
+    path('api/async/attacks/recent/', AsyncRecentAttackView.as_view()),
+    path('api/async/attacks/statistics/', AsyncAttackStatisticsView.as_view()),
+    path('api/async/attacks/histogram/', AsyncAttackHistogramView.as_view()),
+    path('api/async/notifications/logs/', AsyncNotificationLogView.as_view()),
 ]
@@ -1,70 +1,140 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from attacks.models import CyberAttack, NotificationRule, Notification
-from attacks.serializers import CyberAttackSerializer, NotificationRuleSerializer, NotificationSerializer
-from datetime import datetime
+from rest_framework.settings import api_settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views import View
+from attacks.models import AttackRollup, CyberAttack, NotificationRule, Notification
+from attacks.serializers import NotificationRuleSerializer, RuleBacktestSerializer
+from attacks.transforms import ATTACK_RECORD_PROJECTION, attack_record, notification_record
+from attacks.queries import attack_filter, cluster_pipeline, notification_filter, parse_bbox, parse_datetime
+from attacks.geojson import FEATURE_PROJECTION, attack_features, cluster_feature, stream_feature_collection, stream_ndjson
+from attacks.renderers import NDJSONRenderer
+from attacks.parsers import NDJSONParser
+from attacks.ingest import batch_size_setting, insert_attacks, validate_attack
+from attacks.pagination import seek_filter, parse_page, parse_page_size, count_total, split_page
+from attacks.rollups import (
+    STATISTICS_KEYS, rollup_filter, rollup_granularity, search_pipeline, search_total, statistics_counts,
+    statistics_pipeline,
+)
+from attacks.caching import bump_data_version, cached_response
+from attacks.metrics import REGISTRY
+from attacks.backtest import TIMESTAMP_LIMIT, backtest, backtest_range, parse_timestamp_limit, replay_range
+from attacks.cardinality import STANDARD_ERROR, distinct_ips, parse_ip_field
+from attacks.flows import summary_range, parse_limit, summary_size, top_flows
+from attacks.histogram import DEFAULT_INTERVAL, GROUP_KEYS, fill_buckets, histogram_pipeline, histogram_range, parse_interval
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 
 class AttackListView(APIView):
     def get(self, request):
-        query = CyberAttack.objects
-
-        # Filter by attack_type
-        attack_type = request.GET.get('attack_type')
-        if attack_type:
-            query = query.filter(attack_type=attack_type)
-
-        # Filter by country (source or destination)
-        country = request.GET.get('country')
-        if country:
-            query = query.filter(
-                __raw__={
-                    "$or": [
-                        {"source_location.country": country},
-                        {"destination_location.country": country}
-                    ]
-                }
-            )
+        filters = attack_filter(request.GET)
+
+        if 'cursor' in request.GET:
+            return self.get_cursor_page(request, filters)
 
-        # Severity range
-        min_severity = request.GET.get('min_severity')
-        max_severity = request.GET.get('max_severity')
-        if min_severity:
-            query = query.filter(severity__gte=int(min_severity))
-        if max_severity:
-            query = query.filter(severity__lte=int(max_severity))
-
-        # Date range
-        start = request.GET.get('start')
-        end = request.GET.get('end')
-        if start:
-            start_date = datetime.fromisoformat(start)
-            query = query.filter(timestamp__gte=start_date)
-        if end:
-            end_date = datetime.fromisoformat(end)
-            query = query.filter(timestamp__lte=end_date)
+        query = CyberAttack.objects(__raw__=filters)
 
         # Pagination
-        page = int(request.GET.get('page', 1))
-        page_size = int(request.GET.get('page_size', 20))
+        page = parse_page(request.GET)
+        page_size = parse_page_size(request.GET)
         start_index = (page - 1) * page_size
         end_index = start_index + page_size
 
+        if request.GET.get('facets') == 'true':
+            return self.get_faceted_page(filters, page, page_size)
+
         total = query.count()
-        results = query.order_by('-timestamp')[start_index:end_index]
-        serialized = CyberAttackSerializer(results, many=True)
+        # Raw documents straight to response dicts: no Document hydration, no Serializer
+        results = CyberAttack._get_collection().find(filters, ATTACK_RECORD_PROJECTION).sort(
+            "timestamp", -1
+        ).skip(start_index).limit(end_index - start_index)
 
         return Response({
             "total": total,
             "page": page,
             "page_size": page_size,
-            "results": serialized.data
+            "results": [attack_record(attack) for attack in results]
         })
 
-from rest_framework import status
-from rest_framework.exceptions import ValidationError
+    def get_faceted_page(self, filters, page, page_size):
+        # Page, total and sidebar counts from a single aggregation
+        pipeline = search_pipeline(filters, (page - 1) * page_size, page_size, ATTACK_RECORD_PROJECTION)
+        facets = CyberAttack._get_collection().aggregate(pipeline).next()
+        counts = statistics_counts(facets)
+        return Response({
+            "total": search_total(facets),
+            "page": page,
+            "page_size": page_size,
+            "results": [attack_record(attack) for attack in facets["results"]],
+            "facets": {key: dict(counts[key]) for key in STATISTICS_KEYS},
+        })
+
+    def get_cursor_page(self, request, filters):
+        # Keyset pagination: seek on the (timestamp, _id) index instead of skipping
+        page_size = parse_page_size(request.GET)
+        total, exact = count_total(
+            CyberAttack._get_collection(), filters, request.GET.get('include_total', 'estimated')
+        )
+
+        cursor = request.GET.get('cursor')
+        if cursor:
+            filters = {"$and": [filters, seek_filter("timestamp", cursor)]} if filters else seek_filter("timestamp", cursor)
+
+        results = list(CyberAttack._get_collection().find(filters, ATTACK_RECORD_PROJECTION).sort(
+            [("timestamp", -1), ("_id", -1)]
+        ).limit(page_size + 1))
+        results, next_cursor = split_page(results, page_size, "timestamp")
+
+        data = {
+            "page_size": page_size,
+            "next": next_cursor,
+            "results": [attack_record(attack) for attack in results]
+        }
+        if total is not None:
+            data["total"] = total
+            data["total_exact"] = exact
+        return Response(data)
+
+class AttackBulkView(APIView):
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + [NDJSONParser]
+
+    def post(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError("Expected a JSON array or NDJSON body of attacks.")
+
+        try:
+            batch_size = int(request.GET.get('batch_size', batch_size_setting()))
+        except ValueError:
+            raise ValidationError("Batch size must be an integer.")
+        if batch_size < 1:
+            raise ValidationError("Batch size must be positive.")
+
+        # Validate everything first, remembering where each document came from
+        documents, positions, errors = [], [], []
+        for index, item in enumerate(items):
+            document, item_errors = validate_attack(item)
+            if item_errors:
+                errors.append({"index": index, "errors": item_errors})
+            else:
+                documents.append(document)
+                positions.append(index)
+
+        inserted, write_errors = insert_attacks(documents, batch_size)
+        for error in write_errors:
+            error["index"] = positions[error["index"]]
+        errors = sorted(errors + write_errors, key=lambda error: error["index"])
+
+        if not errors:
+            response_status = status.HTTP_201_CREATED
+        elif inserted:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({"inserted": inserted, "errors": errors}, status=response_status)
 
 class RecentAttackView(APIView):
+    @cached_response
     def get(self, request):
         try:
             limit = int(request.GET.get('limit', 10))  # default: 10
@@ -77,90 +147,149 @@ class RecentAttackView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        attacks = CyberAttack.objects.order_by('-timestamp')[:limit]
-        serialized = CyberAttackSerializer(attacks, many=True)
+        attacks = CyberAttack._get_collection().find({}, ATTACK_RECORD_PROJECTION).sort("timestamp", -1).limit(limit)
+        results = [attack_record(attack) for attack in attacks]
         return Response({
-            "count": len(serialized.data),
-            "results": serialized.data
+            "count": len(results),
+            "results": results
         })
 
 class VisualizationDataView(APIView):
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
+
+    # Documents fetched per round trip when streaming
+    batch_size = 1000
+
+    # pymongo reads limit(0) as no limit at all
+    max_limit = 100_000
+
+    @cached_response
     def get(self, request):
         view_type = request.GET.get("view_type", "map")  # map or globe
-        limit = int(request.GET.get("limit", 500))  # to limit the response size
-
-        attacks = CyberAttack.objects.order_by('-timestamp')[:limit]
-
-        features = []
-
-        for attack in attacks:
-            # Source point
-            features.append({
-                "type": "Feature",
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [
-                        attack.source_location.longitude,
-                        attack.source_location.latitude
-                    ]
-                },
-                "properties": {
-                    "direction": "source",
-                    "country": attack.source_location.country,
-                    "attack_type": attack.attack_type,
-                    "severity": attack.severity,
-                    "timestamp": attack.timestamp.isoformat()
-                }
-            })
-
-            # Destination point
-            features.append({
-                "type": "Feature",
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [
-                        attack.destination_location.longitude,
-                        attack.destination_location.latitude
-                    ]
-                },
-                "properties": {
-                    "direction": "destination",
-                    "country": attack.destination_location.country,
-                    "attack_type": attack.attack_type,
-                    "severity": attack.severity,
-                    "timestamp": attack.timestamp.isoformat()
-                }
-            })
+        try:
+            limit = int(request.GET.get("limit", 500))  # to limit the response size
+        except ValueError:
+            raise ValidationError("Limit must be an integer.")
+
+        if limit < 1 or limit > self.max_limit:
+            return Response(
+                {"error": f"Limit must be between 1 and {self.max_limit}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if request.GET.get("cluster") == "true":
+            return self.get_clusters(request)
+
+        attacks = (
+            CyberAttack._get_collection()
+            .find(attack_filter(request.GET), FEATURE_PROJECTION)
+            .sort("timestamp", -1)
+            .limit(limit)
+            .batch_size(self.batch_size)
+        )
+        features = (feature for attack in attacks for feature in attack_features(attack))
+
+        # Streaming modes write each feature as the cursor yields it
+        if request.accepted_renderer.format == 'ndjson':
+            return StreamingHttpResponse(stream_ndjson(features), content_type=NDJSONRenderer.media_type)
+        if request.GET.get("stream") == "true":
+            return StreamingHttpResponse(stream_feature_collection(features), content_type="application/geo+json")
 
         geojson = {
             "type": "FeatureCollection",
-            "features": features
+            "features": list(features)
         }
 
         return Response(geojson)
 
-from collections import Counter
+    def get_clusters(self, request):
+        # One feature per grid cell, so the payload scales with the viewport, not attack volume
+        try:
+            zoom = int(request.GET.get("zoom", 2))
+        except ValueError:
+            raise ValidationError("Zoom must be an integer.")
+        if zoom < 0 or zoom > 20:
+            raise ValidationError("Zoom must be between 0 and 20.")
+
+        pipeline = cluster_pipeline(attack_filter(request.GET), zoom, parse_bbox(request.GET))
+        clusters = CyberAttack._get_collection().aggregate(pipeline, allowDiskUse=True)
+
+        return Response({
+            "type": "FeatureCollection",
+            "features": [cluster_feature(cluster) for cluster in clusters]
+        })
+
+def facet_counts(collection, pipeline):
+    return statistics_counts(next(collection.aggregate(pipeline)))
 
 class AttackStatisticsView(APIView):
+    @cached_response
     def get(self, request):
-        attacks = CyberAttack.objects()
+        attacks = CyberAttack._get_collection()
 
-        country_counts = Counter()
-        type_counts = Counter()
-        severity_counts = Counter()
+        granularity = rollup_granularity(request.GET)
+        if granularity is None:
+            counts = facet_counts(attacks, statistics_pipeline(attack_filter(request.GET)))
+        else:
+            rollups = AttackRollup._get_collection()
+            counts = facet_counts(rollups, statistics_pipeline(rollup_filter(request.GET, granularity), rolled_up=True))
+            end = parse_datetime(request.GET, 'end')
+            if end:
+                # Attacks exactly at the inclusive end open a bucket the rollups leave out
+                edge = facet_counts(attacks, statistics_pipeline(
+                    {"$and": [attack_filter(request.GET), {"timestamp": end}]}
+                ))
+                for key in STATISTICS_KEYS:
+                    counts[key].update(edge[key])
 
-        for attack in attacks:
-            # Count both source and destination countries
-            country_counts[attack.source_location.country] += 1
-            country_counts[attack.destination_location.country] += 1
+        return Response({key: dict(counts[key]) for key in STATISTICS_KEYS})
 
-            type_counts[attack.attack_type] += 1
-            severity_counts[attack.severity] += 1
+class AttackHistogramView(APIView):
+    def get(self, request):
+        unit, bin_size, step = parse_interval(request.GET)
+        start, end = histogram_range(request.GET, step)
 
+        group_by = request.GET.get("group_by") or None
+        if group_by is not None and group_by not in GROUP_KEYS:
+            raise ValidationError({"group_by": f"Must be one of {', '.join(GROUP_KEYS)}."})
+
+        pipeline = histogram_pipeline(request.GET, unit, bin_size, start, end, group_by)
+        facets = next(CyberAttack._get_collection().aggregate(pipeline))
         return Response({
-            "by_country": dict(country_counts),
-            "by_attack_type": dict(type_counts),
-            "by_severity": dict(severity_counts)
+            "interval": request.GET.get("interval") or DEFAULT_INTERVAL,
+            "start": start,
+            "end": end,
+            "group_by": group_by,
+            "buckets": fill_buckets(facets, start, end, step, group_by),
+        })
+
+class AttackFlowView(APIView):
+    def get(self, request):
+        start, end = summary_range(request.GET)
+        limit = parse_limit(request.GET, summary_size())
+        flows, exact = top_flows(start, end, limit, exact=request.GET.get("exact") == "true")
+        return Response({
+            "start": start,
+            "end": end,
+            "exact": exact,
+            "flows": flows,
+        })
+
+class AttackCardinalityView(APIView):
+    def get(self, request):
+        ip = parse_ip_field(request.GET)
+        start, end = summary_range(request.GET)
+        country, attack_type = request.GET.get("country") or None, request.GET.get("attack_type") or None
+        distinct, sketches = distinct_ips(ip, country, attack_type, start, end)
+        return Response({
+            "ip": ip,
+            "country": country,
+            "attack_type": attack_type,
+            "start": start,
+            "end": end,
+            "distinct": distinct,
+            "standard_error": STANDARD_ERROR,
+            "sketches": sketches,
         })
 
 class NotificationRuleView(APIView):
@@ -173,11 +302,65 @@ class NotificationRuleView(APIView):
         serializer = NotificationRuleSerializer(data=request.data)
         if serializer.is_valid():
             NotificationRule(**serializer.validated_data).save()
+            bump_data_version()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class RuleBacktestView(APIView):
+    # Dry run: nothing here touches the notifications or the rules' cooldown state
+    def get(self, request):
+        rules = NotificationRule.objects()
+        names = request.GET.getlist('rule_name')
+        if names:
+            rules = rules.filter(name__in=names)
+        start, end = backtest_range(request.GET)
+        return self.backtest(list(rules), start, end, parse_timestamp_limit(request.GET))
+
+    def post(self, request):
+        # Candidate rules, not saved; a bare list is just the rules
+        data = request.data if isinstance(request.data, dict) else {"rules": request.data}
+        serializer = RuleBacktestSerializer(data=data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = serializer.validated_data
+        start, end = replay_range(params.get('start'), params.get('end'))
+        rules = [NotificationRule(**rule) for rule in params['rules']]
+        return self.backtest(rules, start, end, params.get('limit', TIMESTAMP_LIMIT))
+
+    def backtest(self, rules, start, end, limit):
+        replayed, results = backtest(rules, start, end, limit)
+        return Response({
+            "start": start,
+            "end": end,
+            "attacks": replayed,
+            "rules": results,
+        })
+
 class NotificationLogView(APIView):
     def get(self, request):
-        logs = Notification.objects.order_by('-triggered_at')
-        serializer = NotificationSerializer(logs, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        # Keyset pages on the (triggered_at, _id) indexes, like the attack cursor pages
+        filters = notification_filter(request.GET)
+        page_size = parse_page_size(request.GET)
+        logs = Notification._get_collection()
+        total, exact = count_total(logs, filters, request.GET.get('include_total', 'estimated'))
+
+        cursor = request.GET.get('cursor')
+        if cursor:
+            filters = {"$and": [filters, seek_filter("triggered_at", cursor)]} if filters else seek_filter("triggered_at", cursor)
+        results = list(logs.find(filters).sort([("triggered_at", -1), ("_id", -1)]).limit(page_size + 1))
+        results, next_cursor = split_page(results, page_size, "triggered_at")
+
+        data = {
+            "page_size": page_size,
+            "next": next_cursor,
+            "results": [notification_record(log) for log in results]
+        }
+        if total is not None:
+            data["total"] = total
+            data["total_exact"] = exact
+        return Response(data)
+
+class MetricsView(View):
+    # Prometheus text exposition of this process's metrics
+    def get(self, request):
+        return HttpResponse(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")